@@ -0,0 +1,343 @@
+"""
+Micro-benchmarks for the pure-Python path run on every WebSocket frame.
+
+Each case streams audio frames of a given size and format to a number of
+clients, going through Client.append_audio_data, the buffering strategy and,
+whenever a chunk is complete, the copies into the scratch buffer, the stages
+of the processing pipeline and the JSON serialization of the results in the
+outbound queues, as configured by default by the server. VAD and ASR are
+replaced by stubs returning canned results, so only the overhead of the
+server itself is measured.
+
+Usage:
+
+    python -m benchmarks.bench_ingest                  # compare to baseline
+    python -m benchmarks.bench_ingest --save-baseline  # update the baseline
+
+The comparison fails, with exit status 1, if the frames per second drop by
+more than --tolerance, or the p99 per-frame time grows by more than
+--p99-tolerance and P99_NOISE_US, with respect to the stored baseline. The
+p99 of a few microseconds is dominated by the noise of the machine, hence
+its wider tolerance. Baselines are only comparable when taken on the same
+machine: regenerate them on the reference machine before relying on them.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from src.client import Client
+from src.outbound_queue import OutboundQueue
+from src.processing_pipeline import ProcessingPipeline
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+FRAME_MILLISECONDS = (20, 100, 250)
+MIN_FRAMES = 2000
+# Growths of the p99 below this are considered noise
+P99_NOISE_US = 20
+CLIENT_COUNTS = (1, 10, 100)
+# name: (config, numpy dtype, sampling rate)
+FORMATS = {
+    "int16_16k": ({}, "<i2", 16000),
+    "float32_48k": (
+        {"sampleRate": 48000, "sampleFormat": "float32"},
+        "<f4",
+        48000,
+    ),
+}
+
+
+class StubVAD:
+    async def detect_activity(self, client):
+        return [{"start": 0.0, "end": 0.5, "confidence": 1.0}]
+
+
+class StubASR:
+    def __init__(self, words=40):
+        self.result = {
+            "language": "en",
+            "language_probability": 0.99,
+            "text": " ".join(["word"] * words),
+            "words": [
+                {
+                    "word": "word",
+                    "start": i * 0.1,
+                    "end": i * 0.1 + 0.1,
+                    "probability": 0.9,
+                }
+                for i in range(words)
+            ],
+        }
+
+    async def transcribe(self, client):
+        return dict(self.result)
+
+
+class StubWebSocket:
+    def __init__(self):
+        self.sent_bytes = 0
+
+    async def send(self, message):
+        self.sent_bytes += len(message)
+
+
+def make_frame(format_name, frame_ms):
+    _, dtype, sampling_rate = FORMATS[format_name]
+    samples = sampling_rate * frame_ms // 1000
+    t = np.arange(samples) / sampling_rate
+    signal = 0.1 * np.sin(2 * np.pi * 440 * t)
+    if dtype == "<i2":
+        signal = signal * 32767
+    return signal.astype(dtype).tobytes()
+
+
+def make_clients(format_name, count, websocket):
+    # The default configuration of the server: a processing pipeline shared
+    # by the clients, and an outbound queue for each
+    config, _, _ = FORMATS[format_name]
+    pipeline = ProcessingPipeline()
+    clients = []
+    for i in range(count):
+        client = Client(f"bench-{i}", 16000, 2)
+        client.update_config(
+            dict(
+                config,
+                processing_args={
+                    "chunk_length_seconds": 1,
+                    "chunk_offset_seconds": 0.1,
+                },
+            )
+        )
+        client.pipeline = pipeline
+        client.outbound = OutboundQueue(websocket)
+        clients.append(client)
+    return clients
+
+
+async def close_clients(clients):
+    # Let the chunks in the pipeline be delivered
+    for client in clients:
+        await client.outbound.flush(1)
+        client.outbound.close()
+    clients[0].pipeline.close()
+
+
+async def measure_time(format_name, frame_ms, client_count, rounds):
+    frame = make_frame(format_name, frame_ms)
+    vad, asr, websocket = StubVAD(), StubASR(), StubWebSocket()
+    clients = make_clients(format_name, client_count, websocket)
+
+    frame_times = np.empty(rounds * client_count)
+    gc.collect()
+    wall_start = time.perf_counter()
+    n = 0
+    for _ in range(rounds):
+        for client in clients:
+            start = time.perf_counter_ns()
+            client.append_audio_data(frame)
+            client.process_audio(websocket, vad, asr)
+            frame_times[n] = time.perf_counter_ns() - start
+            n += 1
+        # Let the scheduled chunk processing tasks run
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    wall_time = time.perf_counter() - wall_start
+    await close_clients(clients)
+
+    return {
+        "fps": len(frame_times) / wall_time,
+        "mean_us": float(frame_times.mean() / 1000),
+        "p99_us": float(np.percentile(frame_times, 99) / 1000),
+    }
+
+
+async def measure_allocations(format_name, frame_ms, client_count, rounds):
+    frame = make_frame(format_name, frame_ms)
+    vad, asr, websocket = StubVAD(), StubASR(), StubWebSocket()
+    clients = make_clients(format_name, client_count, websocket)
+
+    tracemalloc.start()
+    peaks = []
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(rounds):
+        for client in clients:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            client.append_audio_data(frame)
+            client.process_audio(websocket, vad, asr)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    net_blocks = sys.getallocatedblocks() - blocks_before
+    tracemalloc.stop()
+    await close_clients(clients)
+
+    return {
+        "peak_alloc_bytes_per_frame": float(np.mean(peaks)),
+        "net_blocks_per_frame": net_blocks / len(peaks),
+    }
+
+
+def run_case(format_name, frame_ms, client_count, seconds, repeat):
+    # Stream at least MIN_FRAMES frames so that the percentiles are stable
+    rounds = max(seconds * 1000 // frame_ms, -(-MIN_FRAMES // client_count))
+
+    # Keep the best of several runs to filter out the noise
+    runs = [
+        asyncio.run(measure_time(format_name, frame_ms, client_count, rounds))
+        for _ in range(repeat)
+    ]
+    # Tracing slows everything down, so allocations are measured separately
+    # on fewer frames
+    allocations = asyncio.run(
+        measure_allocations(
+            format_name,
+            frame_ms,
+            client_count,
+            max(1, min(rounds, MIN_FRAMES // 4 // client_count)),
+        )
+    )
+
+    return dict(
+        {
+            "format": format_name,
+            "frame_ms": frame_ms,
+            "clients": client_count,
+            "frames": rounds * client_count,
+            "fps": max(run["fps"] for run in runs),
+            "mean_us": min(run["mean_us"] for run in runs),
+            "p99_us": min(run["p99_us"] for run in runs),
+        },
+        **allocations,
+    )
+
+
+def case_key(result):
+    return f"{result['format']}/{result['frame_ms']}ms/{result['clients']}"
+
+
+def compare(results, baseline, tolerance, p99_tolerance):
+    regressions = []
+    for result in results:
+        reference = baseline.get(case_key(result))
+        if reference is None:
+            continue
+        if result["fps"] < reference["fps"] * (1 - tolerance):
+            regressions.append(
+                f"{case_key(result)}: fps {result['fps']:.0f} < baseline "
+                f"{reference['fps']:.0f}"
+            )
+        if result["p99_us"] > max(
+            reference["p99_us"] * (1 + p99_tolerance),
+            reference["p99_us"] + P99_NOISE_US,
+        ):
+            regressions.append(
+                f"{case_key(result)}: p99 {result['p99_us']:.1f}us > "
+                f"baseline {reference['p99_us']:.1f}us"
+            )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-frame ingest and buffering path"
+    )
+    parser.add_argument(
+        "--seconds",
+        type=int,
+        default=5,
+        help="Seconds of audio streamed by each client in each case",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of runs of each case, the best one is kept",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="Relative drop of the frames per second tolerated with "
+        "respect to the baseline",
+    )
+    parser.add_argument(
+        "--p99-tolerance",
+        type=float,
+        default=1.0,
+        help="Relative growth of the p99 per-frame time tolerated with "
+        "respect to the baseline",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=BASELINE_PATH,
+        help="Path of the baseline results",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = []
+    for format_name in FORMATS:
+        for frame_ms in FRAME_MILLISECONDS:
+            for client_count in CLIENT_COUNTS:
+                result = run_case(
+                    format_name,
+                    frame_ms,
+                    client_count,
+                    args.seconds,
+                    args.repeat,
+                )
+                results.append(result)
+                print(
+                    f"{case_key(result):>24}: {result['fps']:>10.0f} fps, "
+                    f"mean {result['mean_us']:7.1f}us, "
+                    f"p99 {result['p99_us']:7.1f}us, "
+                    f"peak alloc {result['peak_alloc_bytes_per_frame']:9.0f}B"
+                    f", net blocks {result['net_blocks_per_frame']:6.2f}"
+                )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(
+                {case_key(result): result for result in results},
+                file,
+                indent=2,
+            )
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, run with --save-baseline")
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(
+        results, baseline, args.tolerance, args.p99_tolerance
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regression with respect to the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -73,7 +73,31 @@ function connectWebsocketHandler() {
     };
 }
 
+function getTranscriptionContainer(transcript_data) {
+    // With the speculative strategy a 'draft' is sent first and later
+    // replaced by the 'final' transcription of the same chunk. Streamed
+    // 'segment's are appended until the 'final' transcription replaces them.
+    if (!transcript_data.type || !transcript_data.chunk_id) {
+        return transcriptionDiv;
+    }
+    const containerId = 'chunk-' + transcript_data.chunk_id;
+    let container = document.getElementById(containerId);
+    if (container) {
+        if (transcript_data.type !== 'segment') {
+            container.replaceChildren();
+        }
+    } else {
+        container = document.createElement('span');
+        container.id = containerId;
+        transcriptionDiv.appendChild(container);
+    }
+    container.className = transcript_data.type;
+    return container;
+}
+
 function updateTranscription(transcript_data) {
+    const container = getTranscriptionContainer(transcript_data);
+
     if (Array.isArray(transcript_data.words) && transcript_data.words.length > 0) {
         // Append words with color based on their probability
         transcript_data.words.forEach(wordData => {
@@ -90,17 +114,17 @@ function updateTranscription(transcript_data) {
                 span.style.color = 'red';
             }
 
-            transcriptionDiv.appendChild(span);
+            container.appendChild(span);
         });
 
         // Add a new line at the end
-        transcriptionDiv.appendChild(document.createElement('br'));
+        container.appendChild(document.createElement('br'));
     } else {
         // Fallback to plain text
         const span = document.createElement('span');
         span.textContent = transcript_data.text;
-        transcriptionDiv.appendChild(span);
-        transcriptionDiv.appendChild(document.createElement('br'));
+        container.appendChild(span);
+        container.appendChild(document.createElement('br'));
     }
 
     // Update the language information
@@ -186,7 +210,7 @@ function stopRecordingHandler() {
 function sendAudioConfig(language) {
     let processingArgs = {};
 
-    if (selectedStrategy.value === 'silence_at_end_of_chunk') {
+    if (selectedStrategy.value.endsWith('silence_at_end_of_chunk')) {
         processingArgs = {
             chunk_length_seconds: parseFloat(chunk_length_seconds.value),
             chunk_offset_seconds: parseFloat(chunk_offset_seconds.value)
@@ -198,6 +222,7 @@ function sendAudioConfig(language) {
         data: {
             sampleRate: context.sampleRate,
             channels: 1,
+            sampleFormat: 'int16',
             language: language,
             processing_strategy: selectedStrategy.value,
             processing_args: processingArgs
@@ -209,47 +234,17 @@ function sendAudioConfig(language) {
 
 function processAudio(sampleData) {
     // ASR (Automatic Speech Recognition) and VAD (Voice Activity Detection)
-    // models typically require mono audio with a sampling rate of 16 kHz,
-    // represented as a signed int16 array type.
+    // models typically require mono audio with a sampling rate of 16 kHz.
     //
-    // Implementing changes to the sampling rate using JavaScript can reduce
-    // computational costs on the server.
-    const outputSampleRate = 16000;
-    const decreaseResultBuffer = decreaseSampleRate(sampleData, context.sampleRate, outputSampleRate);
-    const audioData = convertFloat32ToInt16(decreaseResultBuffer);
+    // The audio is sent at the native sampling rate of the AudioContext, as
+    // announced in the config message: the server takes care of resampling.
+    const audioData = convertFloat32ToInt16(sampleData);
 
     if (websocket && websocket.readyState === WebSocket.OPEN) {
         websocket.send(audioData);
     }
 }
 
-function decreaseSampleRate(buffer, inputSampleRate, outputSampleRate) {
-    if (inputSampleRate < outputSampleRate) {
-        console.error("Sample rate too small.");
-        return;
-    } else if (inputSampleRate === outputSampleRate) {
-        return;
-    }
-
-    let sampleRateRatio = inputSampleRate / outputSampleRate;
-    let newLength = Math.ceil(buffer.length / sampleRateRatio);
-    let result = new Float32Array(newLength);
-    let offsetResult = 0;
-    let offsetBuffer = 0;
-    while (offsetResult < result.length) {
-        let nextOffsetBuffer = Math.round((offsetResult + 1) * sampleRateRatio);
-        let accum = 0, count = 0;
-        for (let i = offsetBuffer; i < nextOffsetBuffer && i < buffer.length; i++) {
-            accum += buffer[i];
-            count++;
-        }
-        result[offsetResult] = accum / count;
-        offsetResult++;
-        offsetBuffer = nextOffsetBuffer;
-    }
-    return result;
-}
-
 function convertFloat32ToInt16(buffer) {
     let l = buffer.length;
     const buf = new Int16Array(l);
@@ -263,7 +258,7 @@ function convertFloat32ToInt16(buffer) {
 //  window.onload = initWebSocket;
 
 function toggleBufferingStrategyPanel() {
-    if (selectedStrategy.value === 'silence_at_end_of_chunk') {
+    if (selectedStrategy.value.endsWith('silence_at_end_of_chunk')) {
         panel.classList.remove('hidden');
     } else {
         panel.classList.add('hidden');
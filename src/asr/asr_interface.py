@@ -11,3 +11,18 @@ class ASRInterface:
         raise NotImplementedError(
             "This method should be implemented by subclasses."
         )
+
+    async def transcribe_stream(self, client, on_segment):
+        """
+        Transcribe the given audio data, reporting each segment as soon as
+        it is decoded.
+
+        The default implementation does not report any segment and only
+        returns the whole transcription.
+
+        :param client: The client object, as for `transcribe`
+        :param on_segment: Coroutine function called with each segment, a
+                           dict with its "start", "end", "text" and "words"
+        :return: The transcription structure, as returned by `transcribe`.
+        """
+        return await self.transcribe(client)
@@ -0,0 +1,222 @@
+import asyncio
+import functools
+import gc
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from src.metrics import metrics
+
+from .asr_factory import ASRFactory
+from .asr_interface import ASRInterface
+
+# The argument selecting the model for each ASR pipeline type
+MODEL_ARGUMENTS = {
+    "whisper": "model_name",
+    "faster_whisper": "model_size",
+}
+
+
+def resident_memory_bytes():
+    """
+    Return the resident set size of the current process, or 0 if it cannot
+    be determined on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ASRModelPool(ASRInterface):
+    """
+    Serves several ASR models from the same process.
+
+    Each client can select a model by setting the 'asr_model' key in its
+    config message. Models are loaded lazily the first time they are
+    requested, and each loaded instance is shared by all the sessions using
+    it. When the memory held by the loaded models exceeds the budget, the
+    least recently used models that are not currently transcribing are
+    evicted.
+
+    The memory held by a model is measured as the growth of the resident
+    set size of the process while loading it, which does not account for
+    GPU memory: use `model_memory_mb` to provide the actual footprint of
+    each model in that case.
+
+    Attributes:
+        asr_type (str): The type of ASR pipeline of all the models.
+        models (list): The names of the models clients may request.
+        default_model (str): The model used when a client does not request
+                             one.
+        memory_budget_bytes (int): Maximum memory held by the loaded models,
+                                   or None for no limit.
+    """
+
+    def __init__(
+        self,
+        asr_type,
+        models=None,
+        memory_budget_mb=None,
+        model_memory_mb=None,
+        **kwargs,
+    ):
+        if asr_type not in MODEL_ARGUMENTS:
+            raise ValueError(f"Unknown ASR pipeline type: {asr_type}")
+        self.asr_type = asr_type
+        self.model_argument = MODEL_ARGUMENTS[asr_type]
+        self.asr_args = kwargs
+
+        self.default_model = kwargs.get(self.model_argument)
+        self.models = list(models or [])
+        if self.default_model is None:
+            if not self.models:
+                raise ValueError("At least one model must be configured")
+            self.default_model = self.models[0]
+        if self.default_model not in self.models:
+            self.models.insert(0, self.default_model)
+
+        self.memory_budget_bytes = (
+            None if memory_budget_mb is None else memory_budget_mb * 2**20
+        )
+        self.model_memory_bytes = {
+            name: size * 2**20
+            for name, size in (model_memory_mb or {}).items()
+        }
+
+        self._loaded = OrderedDict()
+        self._load_lock = asyncio.Lock()
+
+    async def transcribe(self, client):
+        model_name = client.config.get("asr_model") or self.default_model
+        return await self.transcribe_with(model_name, client)
+
+    async def transcribe_stream(self, client, on_segment):
+        model_name = client.config.get("asr_model") or self.default_model
+        return await self._run(
+            model_name,
+            lambda pipeline: pipeline.transcribe_stream(client, on_segment),
+        )
+
+    async def transcribe_with(self, model_name, client):
+        """
+        Transcribe the client's audio with a specific model of the pool.
+
+        Args:
+            model_name (str): One of the models of the pool.
+            client: The client object, as for `transcribe`.
+
+        Returns:
+            The transcription structure returned by the model's pipeline.
+        """
+        return await self._run(
+            model_name, lambda pipeline: pipeline.transcribe(client)
+        )
+
+    async def _run(self, model_name, transcribe):
+        entry = await self._acquire(model_name)
+        task = asyncio.ensure_future(transcribe(entry["pipeline"]))
+
+        def release(task):
+            entry["in_use"] -= 1
+            if not task.cancelled():
+                # Retrieved even if the caller was cancelled
+                task.exception()
+
+        # The inference runs in a thread that cannot be cancelled: when the
+        # caller is cancelled, the model stays in use, and cannot be
+        # evicted, until the inference is over
+        task.add_done_callback(release)
+        return await asyncio.shield(task)
+
+    async def _acquire(self, model_name):
+        if model_name not in self.models:
+            raise ValueError(
+                f"Model {model_name} is not served, available models: "
+                f"{', '.join(self.models)}"
+            )
+
+        if model_name not in self._loaded:
+            async with self._load_lock:
+                if model_name not in self._loaded:
+                    await self._load(model_name)
+
+        entry = self._loaded[model_name]
+        self._loaded.move_to_end(model_name)
+        entry["in_use"] += 1
+        entry["last_used"] = time.time()
+        return entry
+
+    async def _load(self, model_name):
+        logging.info(f"Loading ASR model {model_name}")
+        start = time.time()
+        memory_before = resident_memory_bytes()
+        args = dict(self.asr_args, **{self.model_argument: model_name})
+        pipeline = await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                ASRFactory.create_asr_pipeline, self.asr_type, **args
+            ),
+        )
+        memory_bytes = self.model_memory_bytes.get(
+            model_name, max(resident_memory_bytes() - memory_before, 0)
+        )
+
+        self._loaded[model_name] = {
+            "pipeline": pipeline,
+            "memory_bytes": memory_bytes,
+            "in_use": 0,
+            "last_used": time.time(),
+        }
+        metrics.increment("asr_pool.loads")
+        metrics.set_gauge(
+            f"asr_pool.resident_bytes.{model_name}", memory_bytes
+        )
+        self._update_total_gauge()
+        logging.info(
+            f"Loaded ASR model {model_name} in {time.time() - start:.1f}s, "
+            f"{memory_bytes / 2**20:.0f} MiB"
+        )
+
+        self._evict(keep=model_name)
+
+    def _evict(self, keep):
+        if self.memory_budget_bytes is None:
+            return
+
+        evicted = False
+        for model_name in list(self._loaded):
+            if self._total_memory_bytes() <= self.memory_budget_bytes:
+                break
+            entry = self._loaded[model_name]
+            if model_name == keep or entry["in_use"] > 0:
+                continue
+            del self._loaded[model_name]
+            metrics.increment("asr_pool.evictions")
+            metrics.remove_gauge(f"asr_pool.resident_bytes.{model_name}")
+            logging.info(
+                f"Evicted ASR model {model_name}, "
+                f"{entry['memory_bytes'] / 2**20:.0f} MiB"
+            )
+            evicted = True
+
+        if evicted:
+            gc.collect()
+            self._update_total_gauge()
+
+        if self._total_memory_bytes() > self.memory_budget_bytes:
+            logging.warning(
+                "ASR models exceed the memory budget, all the other models "
+                "are in use"
+            )
+
+    def _total_memory_bytes(self):
+        return sum(entry["memory_bytes"] for entry in self._loaded.values())
+
+    def _update_total_gauge(self):
+        metrics.set_gauge("asr_pool.loaded_models", len(self._loaded))
+        metrics.set_gauge(
+            "asr_pool.resident_bytes_total", self._total_memory_bytes()
+        )
@@ -0,0 +1,167 @@
+import asyncio
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from src.metrics import metrics
+
+from .asr_interface import ASRInterface
+
+# Samples below this fraction of the peak are trimmed from both ends
+TRIM_RATIO = 0.02
+
+
+def audio_fingerprint(audio):
+    """
+    Hash 16-bit PCM audio so that identical and nearly identical audio get
+    the same digest.
+
+    The audio is trimmed of its leading and trailing near-silence, scaled to
+    its peak and quantized to 8 bits before hashing, so that the same prompt
+    played with a different padding, gain or dithering noise still matches.
+
+    :param audio: The 16-bit PCM audio, as a bytes-like object
+    :return: The hexadecimal digest.
+    """
+    usable = len(audio) // 2 * 2
+    samples = np.frombuffer(memoryview(audio)[:usable], dtype="<i2")
+    magnitudes = np.abs(samples.astype(np.int32))
+    peak = int(magnitudes.max()) if len(magnitudes) else 0
+    if peak == 0:
+        return hashlib.blake2b(
+            f"silence:{len(samples)}".encode(), digest_size=16
+        ).hexdigest()
+    loud = np.flatnonzero(magnitudes > peak * TRIM_RATIO)
+    first, last = loud[0], loud[-1] + 1
+    trimmed = samples[first:last].astype(np.float32)
+    quantized = np.round(trimmed * (127 / peak)).astype(np.int8)
+    return hashlib.blake2b(quantized.tobytes(), digest_size=16).hexdigest()
+
+
+class CachedASR(ASRInterface):
+    """
+    Caches the transcriptions of an ASR pipeline by audio content.
+
+    Recorded prompts, hold messages and monitoring calls send the same audio
+    over and over: their transcriptions are served from the cache, at the
+    cost of hashing the audio, instead of running the model again. The key
+    is a fingerprint of the normalized audio (see `audio_fingerprint`), the
+    language of the client, the requested model and the decoding options
+    set in the client config. Concurrent requests for the same key wait for
+    the first one instead of transcribing twice, and take over if it is
+    cancelled. `transcribe_with` is only available if the wrapped pipeline
+    serves several models.
+
+    The cache is bounded by a number of entries and by the size of the
+    cached transcriptions, the least recently used being evicted first.
+    Hits, misses and the size of the cache are reported in the metrics.
+
+    Attributes:
+        asr_pipeline: The wrapped ASR pipeline.
+        max_entries (int): The maximum number of cached transcriptions.
+        max_bytes (int): The maximum size of the cached transcriptions,
+                         measured as their JSON encoding.
+    """
+
+    def __init__(self, asr_pipeline, max_entries=1024, max_bytes=64 * 2**20):
+        self.asr_pipeline = asr_pipeline
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._in_flight = {}
+        if hasattr(asr_pipeline, "transcribe_with"):
+            self.transcribe_with = self._transcribe_with
+
+    async def transcribe(self, client):
+        return await self._cached(
+            client, None, lambda: self.asr_pipeline.transcribe(client)
+        )
+
+    async def _transcribe_with(self, model_name, client):
+        return await self._cached(
+            client,
+            model_name,
+            lambda: self.asr_pipeline.transcribe_with(model_name, client),
+        )
+
+    async def transcribe_stream(self, client, on_segment):
+        # A cached transcription is returned whole, without segments
+        return await self._cached(
+            client,
+            None,
+            lambda: self.asr_pipeline.transcribe_stream(client, on_segment),
+        )
+
+    def cache_key(self, client, model_name):
+        return (
+            audio_fingerprint(client.scratch_buffer),
+            client.config.get("language"),
+            model_name or client.config.get("asr_model"),
+            client.config.get("beam_size"),
+            client.config.get("word_timestamps"),
+        )
+
+    async def _cached(self, client, model_name, transcribe):
+        key = self.cache_key(client, model_name)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._count("hits")
+            return copy.deepcopy(self._entries[key][0])
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            try:
+                transcription = await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+                # The request it waited for was cancelled, it takes over
+                return await self._cached(client, model_name, transcribe)
+            self._count("hits")
+            return copy.deepcopy(transcription)
+
+        self._count("misses")
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            transcription = await transcribe()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Only the waiters, if any, need to see the exception
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+        # The caller may modify its transcription before the waiters copy it
+        future.set_result(copy.deepcopy(transcription))
+        self._store(key, transcription)
+        return transcription
+
+    def _store(self, key, transcription):
+        size = len(json.dumps(transcription))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (copy.deepcopy(transcription), size)
+        self._bytes += size
+        while (
+            len(self._entries) > self.max_entries
+            or self._bytes > self.max_bytes
+        ):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            metrics.increment("asr_cache.evictions")
+        metrics.set_gauge("asr_cache.entries", len(self._entries))
+        metrics.set_gauge("asr_cache.bytes", self._bytes)
+
+    def _count(self, outcome):
+        metrics.increment(f"asr_cache.{outcome}")
+        hits = metrics.get_counter("asr_cache.hits")
+        misses = metrics.get_counter("asr_cache.misses")
+        metrics.set_gauge("asr_cache.hit_rate", hits / (hits + misses))
@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 from faster_whisper import WhisperModel
@@ -113,12 +114,41 @@ language_codes = {
 class FasterWhisperASR(ASRInterface):
     def __init__(self, **kwargs):
         model_size = kwargs.get("model_size", "large-v3")
+        # The decoding options, which the client config can override
+        self.beam_size = int(kwargs.get("beam_size", 5))
+        self.word_timestamps = kwargs.get("word_timestamps", True)
         # Run on GPU with FP16
         self.asr_pipeline = WhisperModel(
             model_size, device="cuda", compute_type="float16"
         )
 
+    def _transcribe_file(
+        self,
+        file_path,
+        language,
+        on_segment=None,
+        beam_size=5,
+        word_timestamps=True,
+    ):
+        segments, info = self.asr_pipeline.transcribe(
+            file_path,
+            beam_size=beam_size,
+            word_timestamps=word_timestamps,
+            language=language,
+        )
+        if on_segment is None:
+            # The transcription will actually run here.
+            return list(segments), info
+        decoded = []
+        for segment in segments:
+            on_segment(segment)
+            decoded.append(segment)
+        return decoded, info
+
     async def transcribe(self, client):
+        return await self.transcribe_stream(client, None)
+
+    async def transcribe_stream(self, client, on_segment):
         file_path = await save_audio_to_file(
             client.scratch_buffer, client.get_file_name()
         )
@@ -128,29 +158,80 @@ class FasterWhisperASR(ASRInterface):
             if client.config["language"] is None
             else language_codes.get(client.config["language"].lower())
         )
-        segments, info = self.asr_pipeline.transcribe(
-            file_path, word_timestamps=True, language=language
-        )
+        loop = asyncio.get_running_loop()
+        # The segments are produced lazily by the inference thread and
+        # handed over to the event loop as soon as each is decoded.
+        decoded_segments = None
+        if on_segment is not None:
+            decoded_segments = asyncio.Queue()
 
-        segments = list(segments)  # The transcription will actually run here.
-        os.remove(file_path)
+            def on_decoded_segment(segment):
+                loop.call_soon_threadsafe(decoded_segments.put_nowait, segment)
 
-        flattened_words = [
-            word for segment in segments for word in segment.words
-        ]
+        # The inference runs in the default executor so that the event loop,
+        # and with it the other sessions, is not blocked in the meantime.
+        inference = loop.run_in_executor(
+            None,
+            self._transcribe_file,
+            file_path,
+            language,
+            None if on_segment is None else on_decoded_segment,
+            client.config.get("beam_size", self.beam_size),
+            client.config.get("word_timestamps", self.word_timestamps),
+        )
+        try:
+            if on_segment is not None:
+                await self._report_segments(
+                    inference, decoded_segments, on_segment
+                )
+            segments, info = await inference
+        finally:
+            os.remove(file_path)
 
-        to_return = {
+        return {
             "language": info.language,
             "language_probability": info.language_probability,
             "text": " ".join([s.text.strip() for s in segments]),
             "words": [
-                {
-                    "word": w.word,
-                    "start": w.start,
-                    "end": w.end,
-                    "probability": w.probability,
-                }
-                for w in flattened_words
+                word for segment in segments for word in _words(segment)
             ],
         }
-        return to_return
+
+    @staticmethod
+    async def _report_segments(inference, decoded_segments, on_segment):
+        while True:
+            get_segment = asyncio.ensure_future(decoded_segments.get())
+            await asyncio.wait(
+                [get_segment, inference], return_when=asyncio.FIRST_COMPLETED
+            )
+            if not get_segment.done():
+                get_segment.cancel()
+                # The inference is over, report the segments left
+                while not decoded_segments.empty():
+                    await on_segment(
+                        _format_segment(decoded_segments.get_nowait())
+                    )
+                return
+            await on_segment(_format_segment(get_segment.result()))
+
+
+def _words(segment):
+    return [
+        {
+            "word": w.word,
+            "start": w.start,
+            "end": w.end,
+            "probability": w.probability,
+        }
+        # None without word timestamps
+        for w in segment.words or []
+    ]
+
+
+def _format_segment(segment):
+    return {
+        "start": segment.start,
+        "end": segment.end,
+        "text": segment.text.strip(),
+        "words": _words(segment),
+    }
@@ -0,0 +1,250 @@
+import asyncio
+import itertools
+import logging
+
+from src.client import ClientSnapshot
+from src.metrics import metrics
+
+from .asr_interface import ASRInterface
+
+
+class _Window:
+    def __init__(self):
+        self.items = []
+        self.seconds = 0.0
+        self.timer = None
+
+
+class PackingASR(ASRInterface):
+    """
+    Packs short utterances into shared Whisper windows.
+
+    Whisper pads every input to a 30 seconds window, so a one second command
+    costs about as much to encode as 30 seconds of audio. Utterances shorter
+    than `max_utterance_seconds` are held for up to `max_wait` seconds and
+    concatenated with those transcribed at the same time, from the same or
+    other clients, separated by `gap_seconds` of silence, as long as the
+    window stays within `window_seconds`. The window is transcribed once
+    with word timestamps, and each word is handed back to the utterance
+    around which it was spoken, its timestamps made relative to that
+    utterance again.
+
+    Only utterances with the same language, model and beam size share a
+    window. Longer utterances, and the segments of the streaming
+    transcriptions, are passed through unchanged: a packed utterance is
+    returned whole. If the wrapped pipeline returns no word timestamps, the
+    utterances of the window are transcribed one by one. Utterances are only
+    packed together when they are transcribed at the same time, which needs
+    several ASR workers (see --asr-workers). The windows, the utterances per
+    window and the fallbacks are reported in the `packing.*` metrics.
+
+    Attributes:
+        asr_pipeline: The wrapped ASR pipeline.
+        window_seconds (float): The maximum length of a packed window.
+        gap_seconds (float): The silence between two packed utterances.
+        max_utterance_seconds (float): The maximum length of the utterances
+                                       packed.
+        max_wait (float): The maximum time, in seconds, an utterance waits
+                          for others to share its window.
+    """
+
+    def __init__(
+        self,
+        asr_pipeline,
+        window_seconds=28.0,
+        gap_seconds=0.5,
+        max_utterance_seconds=5.0,
+        max_wait=0.05,
+    ):
+        if not 0 < max_utterance_seconds <= window_seconds:
+            raise ValueError(
+                "The maximum utterance length must be positive and fit in "
+                "the packed window"
+            )
+        self.asr_pipeline = asr_pipeline
+        self.window_seconds = window_seconds
+        self.gap_seconds = gap_seconds
+        self.max_utterance_seconds = max_utterance_seconds
+        self.max_wait = max_wait
+        self._open = {}
+        self._tasks = set()
+        self._window_ids = itertools.count()
+        if hasattr(asr_pipeline, "transcribe_with"):
+            self.transcribe_with = self._transcribe_with
+
+    async def transcribe(self, client):
+        return await self._packed(client, None)
+
+    async def _transcribe_with(self, model_name, client):
+        return await self._packed(client, model_name)
+
+    async def transcribe_stream(self, client, on_segment):
+        if self._duration(client) <= self.max_utterance_seconds:
+            return await self._packed(client, None)
+        return await self.asr_pipeline.transcribe_stream(client, on_segment)
+
+    def pack_key(self, client, model_name):
+        return (
+            model_name,
+            client.config.get("language"),
+            client.config.get("asr_model"),
+            client.config.get("beam_size"),
+            client.sampling_rate,
+            client.samples_width,
+        )
+
+    async def _packed(self, client, model_name):
+        duration = self._duration(client)
+        if duration > self.max_utterance_seconds:
+            return await self._transcribe_one(client, model_name)
+
+        key = self.pack_key(client, model_name)
+        window = self._open.get(key)
+        if (
+            window is not None
+            and window.seconds + self.gap_seconds + duration
+            > self.window_seconds
+        ):
+            self._flush(key, window)
+            window = None
+        loop = asyncio.get_running_loop()
+        if window is None:
+            window = _Window()
+            window.timer = loop.call_later(
+                self.max_wait, self._flush, key, window
+            )
+            self._open[key] = window
+        else:
+            window.seconds += self.gap_seconds
+        future = loop.create_future()
+        window.items.append((client, duration, future))
+        window.seconds += duration
+        return await future
+
+    def _flush(self, key, window):
+        if self._open.get(key) is window:
+            del self._open[key]
+        window.timer.cancel()
+        task = asyncio.get_running_loop().create_task(
+            self._run(window, key[0])
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, window, model_name):
+        # The utterances whose transcription was cancelled while waiting
+        items = [item for item in window.items if not item[2].done()]
+        if not items:
+            return
+        try:
+            if len(items) == 1:
+                client, _, future = items[0]
+                results = [await self._transcribe_one(client, model_name)]
+            else:
+                results = await self._transcribe_window(items, model_name)
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+                    # Only the waiters, if any, need to see the exception
+                    future.exception()
+            return
+        for (_, _, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _transcribe_window(self, items, model_name):
+        first = items[0][0]
+        gap = bytes(
+            int(self.gap_seconds * first.sampling_rate) * first.samples_width
+        )
+        audio = bytearray()
+        spans = []
+        for client, duration, _ in items:
+            if audio:
+                audio += gap
+            offset = len(audio) / (first.sampling_rate * first.samples_width)
+            spans.append((offset, offset + duration))
+            audio += client.scratch_buffer
+
+        packed = ClientSnapshot(
+            first, f"packed-{next(self._window_ids)}", audio
+        )
+        packed.config["word_timestamps"] = True
+        metrics.increment("packing.windows")
+        metrics.observe("packing.utterances_per_window", len(items))
+        transcription = await self._transcribe_one(packed, model_name)
+
+        words = transcription.get("words")
+        if not isinstance(words, list) or (
+            not words and transcription.get("text", "").strip()
+        ):
+            # The words cannot be handed back without their timestamps
+            metrics.increment("packing.fallbacks")
+            logging.debug(
+                "The ASR pipeline returned no word timestamps, "
+                "transcribing the packed utterances one by one"
+            )
+            return [
+                await self._transcribe_one(client, model_name)
+                for client, _, _ in items
+            ]
+        return self.split(transcription, spans, self.gap_seconds)
+
+    @staticmethod
+    def split(transcription, spans, gap_seconds):
+        """
+        Split the transcription of a packed window between its utterances.
+
+        Each word goes to the utterance whose span, widened by half the gap
+        on each side, contains the middle of the word.
+
+        Args:
+            transcription (dict): The transcription of the window, with its
+                                  word timestamps.
+            spans (list): The (start, end) of each utterance in the window,
+                          in seconds.
+            gap_seconds (float): The silence between two utterances.
+
+        Returns:
+            list: The transcription of each utterance.
+        """
+        words = [[] for _ in spans]
+        for word in transcription["words"]:
+            middle = (word["start"] + word["end"]) / 2
+            index = 0
+            while (
+                index < len(spans) - 1
+                and middle >= spans[index][1] + gap_seconds / 2
+            ):
+                index += 1
+            offset = spans[index][0]
+            words[index].append(
+                dict(
+                    word,
+                    start=max(word["start"] - offset, 0.0),
+                    end=max(word["end"] - offset, 0.0),
+                )
+            )
+        return [
+            {
+                "language": transcription.get("language"),
+                "language_probability": transcription.get(
+                    "language_probability"
+                ),
+                "text": "".join(word["word"] for word in owned).strip(),
+                "words": owned,
+            }
+            for owned in words
+        ]
+
+    async def _transcribe_one(self, client, model_name):
+        if model_name is None:
+            return await self.asr_pipeline.transcribe(client)
+        return await self.asr_pipeline.transcribe_with(model_name, client)
+
+    @staticmethod
+    def _duration(client):
+        return len(client.scratch_buffer) / (
+            client.sampling_rate * client.samples_width
+        )
@@ -1,3 +1,5 @@
+import asyncio
+import functools
 import os
 
 import torch
@@ -24,14 +26,24 @@ class WhisperASR(ASRInterface):
         )
 
         if client.config["language"] is not None:
-            to_return = self.asr_pipeline(
+            inference = functools.partial(
+                self.asr_pipeline,
                 file_path,
                 generate_kwargs={"language": client.config["language"]},
-            )["text"]
+            )
         else:
-            to_return = self.asr_pipeline(file_path)["text"]
-
-        os.remove(file_path)
+            inference = functools.partial(self.asr_pipeline, file_path)
+
+        # The inference runs in the default executor so that the event loop,
+        # and with it the other sessions, is not blocked in the meantime.
+        try:
+            to_return = (
+                await asyncio.get_running_loop().run_in_executor(
+                    None, inference
+                )
+            )["text"]
+        finally:
+            os.remove(file_path)
 
         to_return = {
             "language": "UNSUPPORTED_BY_HUGGINGFACE_WHISPER",
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+
+# The ffmpeg demuxer for each codec that can be negotiated by the clients
+CODECS = {
+    "opus": "ogg",
+    "ogg": "ogg",
+    "webm": "webm",
+    "flac": "flac",
+}
+
+
+class StreamingAudioDecoder:
+    """
+    Incrementally decodes a compressed audio stream, such as Ogg/Opus or FLAC
+    frames sent over the WebSocket, to mono signed 16-bit PCM.
+
+    Decoding is delegated to an ffmpeg subprocess reading from a pipe. The
+    compressed frames are written to its standard input as they arrive, and
+    a reader task hands the decoded PCM to a callback as soon as ffmpeg
+    produces it. Writes wait for the pipe to drain, so the memory held by
+    the decoder stays bounded even when the client sends faster than ffmpeg
+    decodes.
+
+    The path of the ffmpeg executable can be set with the FFMPEG_BINARY
+    environment variable.
+
+    Attributes:
+        codec (str): The codec of the incoming stream, a key of CODECS.
+        sampling_rate (int): The sampling rate of the decoded audio in Hz.
+        failed (bool): Whether ffmpeg exited before the end of the stream,
+                       for example on invalid input.
+    """
+
+    def __init__(self, codec, sampling_rate, on_audio):
+        """
+        Args:
+            codec (str): The codec of the incoming stream, a key of CODECS.
+            sampling_rate (int): The sampling rate of the decoded audio in Hz.
+            on_audio (coroutine function): Called with each block of decoded
+                                           PCM audio, as bytes.
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.codec = codec
+        self.sampling_rate = sampling_rate
+        self.on_audio = on_audio
+        self.failed = False
+        self._process = None
+        self._reader_task = None
+
+    async def start(self):
+        ffmpeg = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                ffmpeg,
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-probesize",
+                "32",
+                "-analyzeduration",
+                "0",
+                "-f",
+                CODECS[self.codec],
+                "-i",
+                "pipe:0",
+                "-f",
+                "s16le",
+                "-ac",
+                "1",
+                "-ar",
+                str(self.sampling_rate),
+                "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise ValueError(
+                f"Decoding {self.codec} audio requires ffmpeg, not found at "
+                f"'{ffmpeg}'"
+            )
+        self._reader_task = asyncio.create_task(self._read_output())
+
+    async def feed(self, data):
+        """
+        Write compressed frames to the decoder, waiting for room in the pipe.
+
+        Raises:
+            ValueError: If ffmpeg has exited.
+        """
+        try:
+            self._process.stdin.write(data)
+            await self._process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            self.failed = True
+            raise ValueError(
+                f"The {self.codec} decoder exited with code "
+                f"{self._process.returncode}, the stream may be invalid"
+            )
+
+    async def close(self):
+        """
+        Flush the decoder, deliver the remaining audio and stop ffmpeg.
+        """
+        if self._process is None:
+            return
+        if not self._process.stdin.is_closing():
+            self._process.stdin.close()
+        try:
+            await asyncio.wait_for(self._reader_task, timeout=5)
+        except asyncio.TimeoutError:
+            self._process.kill()
+        await self._process.wait()
+
+    async def _read_output(self):
+        # Read whole samples only, so that no sample is split between calls
+        pending = b""
+        while True:
+            data = await self._process.stdout.read(4096)
+            if not data:
+                break
+            data = pending + data
+            usable = len(data) - len(data) % 2
+            pending = data[usable:]
+            if usable:
+                try:
+                    await self.on_audio(data[:usable])
+                except Exception:
+                    logging.exception("Failed to process decoded audio")
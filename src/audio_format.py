@@ -0,0 +1,220 @@
+from math import gcd
+
+import numpy as np
+
+SAMPLE_FORMATS = {
+    "int16": np.dtype("<i2"),
+    "float32": np.dtype("<f4"),
+}
+
+
+class PolyphaseResampler:
+    """
+    Streaming polyphase FIR resampler.
+
+    The rational ratio output_rate / input_rate is reduced to up / down and
+    a Kaiser-windowed sinc low-pass filter is split into `up` polyphase
+    branches. Each call to `process` computes all the output samples that
+    can be produced from the input received so far in a single vectorized
+    operation, and keeps the filter history and the output phase so that
+    consecutive frames are resampled as one continuous signal.
+
+    Attributes:
+        input_rate (int): The sampling rate of the input signal in Hz.
+        output_rate (int): The sampling rate of the output signal in Hz.
+        up (int): The interpolation factor.
+        down (int): The decimation factor.
+    """
+
+    def __init__(
+        self, input_rate, output_rate, zero_crossings=10, kaiser_beta=5.0
+    ):
+        """
+        Initialize the resampler and design its anti-aliasing filter.
+
+        Args:
+            input_rate (int): The sampling rate of the input signal in Hz.
+            output_rate (int): The sampling rate of the output signal in Hz.
+            zero_crossings (int): Number of zero crossings of the sinc on
+                                  each side of the filter center.
+            kaiser_beta (float): The beta parameter of the Kaiser window.
+        """
+        self.input_rate = int(input_rate)
+        self.output_rate = int(output_rate)
+        if self.input_rate <= 0 or self.output_rate <= 0:
+            raise ValueError("Sampling rates must be positive")
+
+        divisor = gcd(self.input_rate, self.output_rate)
+        self.up = self.output_rate // divisor
+        self.down = self.input_rate // divisor
+
+        max_rate = max(self.up, self.down)
+        half_length = zero_crossings * max_rate
+        t = np.arange(-half_length, half_length + 1)
+        cutoff = 1.0 / max_rate
+        taps = (
+            self.up
+            * cutoff
+            * np.sinc(cutoff * t)
+            * np.kaiser(len(t), kaiser_beta)
+        )
+
+        self.taps_per_phase = -(-len(taps) // self.up)
+        taps = np.pad(taps, (0, self.taps_per_phase * self.up - len(taps)))
+        # bank[p, j] holds the tap applied to x[i - (taps_per_phase - 1 - j)]
+        # for the output samples that fall on phase p, so that it can be
+        # multiplied directly with an ascending window of the input.
+        self._bank = np.ascontiguousarray(
+            taps.reshape(self.taps_per_phase, self.up).T[:, ::-1],
+            dtype=np.float32,
+        )
+
+        self._history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        self._input_offset = 0
+        self._output_index = 0
+        # Drop the filter group delay so that output stays aligned with input
+        self._skip = half_length // self.down
+
+    def process(self, samples):
+        """
+        Resample the next frame of a continuous mono signal.
+
+        Args:
+            samples (np.ndarray): The next input samples, as float32.
+
+        Returns:
+            np.ndarray: The output samples that could be computed, as float32.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples) == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        signal = np.concatenate((self._history, samples))
+        input_end = self._input_offset + len(samples)
+        last_output = (input_end * self.up - 1) // self.down
+
+        positions = (
+            np.arange(self._output_index, last_output + 1, dtype=np.int64)
+            * self.down
+        )
+        input_indexes = positions // self.up - self._input_offset
+        phases = positions % self.up
+
+        windows = np.lib.stride_tricks.sliding_window_view(
+            signal, self.taps_per_phase
+        )[input_indexes]
+        output = np.einsum("ij,ij->i", self._bank[phases], windows)
+
+        if self.taps_per_phase > 1:
+            self._history = signal[-(self.taps_per_phase - 1) :]  # noqa: E203
+        self._input_offset = input_end
+        self._output_index = last_output + 1
+
+        if self._skip:
+            skipped = min(self._skip, len(output))
+            output = output[skipped:]
+            self._skip -= skipped
+
+        return output
+
+
+class AudioFormatConverter:
+    """
+    Converts incoming audio frames to the format expected by the pipelines.
+
+    Frames are decoded according to the negotiated sample format, down-mixed
+    to mono and resampled to the target rate, then re-encoded as signed
+    16-bit little-endian PCM. Bytes belonging to an incomplete sample frame
+    are kept until the next call.
+
+    Attributes:
+        sample_rate (int): The sampling rate of the incoming audio in Hz.
+        channels (int): The number of interleaved channels of the incoming
+                        audio.
+        sample_format (str): The sample format of the incoming audio, one of
+                             the keys of SAMPLE_FORMATS.
+        target_rate (int): The sampling rate of the converted audio in Hz.
+    """
+
+    def __init__(self, sample_rate, channels, sample_format, target_rate):
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f"Unsupported sample format: {sample_format}")
+        if int(channels) < 1:
+            raise ValueError(f"Invalid number of channels: {channels}")
+
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self.sample_format = sample_format
+        self.target_rate = int(target_rate)
+
+        self._dtype = SAMPLE_FORMATS[sample_format]
+        self._frame_size = self._dtype.itemsize * self.channels
+        self._remainder = b""
+        self._resampler = None
+        if self.sample_rate != self.target_rate:
+            self._resampler = PolyphaseResampler(
+                self.sample_rate, self.target_rate
+            )
+
+    @staticmethod
+    def from_config(config, target_rate):
+        """
+        Create a converter for the audio format described in a client
+        configuration.
+
+        Args:
+            config (dict): The client configuration, possibly containing the
+                           'sampleRate', 'channels' and 'sampleFormat' keys.
+            target_rate (int): The sampling rate expected by the pipelines.
+
+        Returns:
+            AudioFormatConverter or None: None if the incoming audio is
+                                          already mono int16 at the target
+                                          rate and needs no conversion.
+
+        Raises:
+            ValueError: If the requested format is not supported.
+        """
+        sample_rate = config.get("sampleRate") or target_rate
+        channels = config.get("channels") or 1
+        sample_format = config.get("sampleFormat") or "int16"
+
+        if (
+            int(sample_rate) == target_rate
+            and int(channels) == 1
+            and sample_format == "int16"
+        ):
+            return None
+        return AudioFormatConverter(
+            sample_rate, channels, sample_format, target_rate
+        )
+
+    def convert(self, audio_data):
+        """
+        Convert a frame of incoming audio.
+
+        Args:
+            audio_data (bytes): Raw audio in the negotiated format.
+
+        Returns:
+            bytes: Mono signed 16-bit PCM at the target rate.
+        """
+        data = self._remainder + bytes(audio_data)
+        usable = len(data) - len(data) % self._frame_size
+        self._remainder = data[usable:]
+
+        samples = np.frombuffer(data[:usable], dtype=self._dtype)
+        if self.sample_format == "int16":
+            samples = samples.astype(np.float32) / 32768.0
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(
+                axis=1, dtype=np.float32
+            )
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+
+        return (
+            np.clip(samples * 32768.0, -32768, 32767)
+            .astype(SAMPLE_FORMATS["int16"])
+            .tobytes()
+        )
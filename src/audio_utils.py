@@ -1,3 +1,4 @@
+import asyncio
 import os
 import wave
 
@@ -19,10 +20,19 @@ async def save_audio_to_file(
 
     file_path = os.path.join(audio_dir, file_name)
 
+    # The file is written in the default executor so that the disk I/O does
+    # not block the event loop; the buffer is copied as it may keep growing
+    # in the meantime.
+    await asyncio.get_running_loop().run_in_executor(
+        None, _write_wav_file, file_path, bytes(audio_data)
+    )
+
+    return file_path
+
+
+def _write_wav_file(file_path, audio_data):
     with wave.open(file_path, "wb") as wav_file:
         wav_file.setnchannels(1)  # Assuming mono audio
         wav_file.setsampwidth(2)
         wav_file.setframerate(16000)
         wav_file.writeframes(audio_data)
-
-    return file_path
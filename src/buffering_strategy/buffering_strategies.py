@@ -1,10 +1,20 @@
 import asyncio
+import functools
 import json
+import logging
 import os
 import time
+from collections import deque
+
+from src.metrics import metrics
+from src.vad.energy_vad import EnergyFrameVAD
 
 from .buffering_strategy_interface import BufferingStrategyInterface
 
+# The model of the ASR model pool transcribing the drafts of
+# SpeculativeSilenceAtEndOfChunk by default
+DEFAULT_DRAFT_MODEL = "tiny"
+
 
 class SilenceAtEndOfChunk(BufferingStrategyInterface):
     """
@@ -21,6 +31,12 @@ class SilenceAtEndOfChunk(BufferingStrategyInterface):
         chunk_length_seconds (float): Length of each audio chunk in seconds.
         chunk_offset_seconds (float): Offset time in seconds to be considered
                                       for processing audio chunks.
+        stream_segments (bool): Whether each segment is sent as soon as it
+                                is decoded, before the whole transcription.
+        adaptive_chunk_length (bool): Whether the chunk length follows the
+                                      load of the server, between
+                                      min_chunk_length_seconds and
+                                      max_chunk_length_seconds.
     """
 
     def __init__(self, client, **kwargs):
@@ -31,7 +47,11 @@ class SilenceAtEndOfChunk(BufferingStrategyInterface):
             client (Client): The client instance associated with this buffering
                              strategy.
             **kwargs: Additional keyword arguments, including
-                      'chunk_length_seconds' and 'chunk_offset_seconds'.
+                      'chunk_length_seconds', 'chunk_offset_seconds' and
+                      'stream_segments', and for the adaptive mode
+                      'adaptive_chunk_length', 'min_chunk_length_seconds',
+                      'max_chunk_length_seconds', 'rtf_low', 'rtf_high' and
+                      'max_chunks_in_flight'.
         """
         self.client = client
 
@@ -49,13 +69,93 @@ class SilenceAtEndOfChunk(BufferingStrategyInterface):
             self.chunk_offset_seconds = kwargs.get("chunk_offset_seconds")
         self.chunk_offset_seconds = float(self.chunk_offset_seconds)
 
+        self.stream_segments = kwargs.get("stream_segments", False)
+
         self.error_if_not_realtime = os.environ.get("ERROR_IF_NOT_REALTIME")
         if not self.error_if_not_realtime:
             self.error_if_not_realtime = kwargs.get(
                 "error_if_not_realtime", False
             )
 
+        self.adaptive_chunk_length = kwargs.get("adaptive_chunk_length", False)
+        self.min_chunk_length_seconds = float(
+            kwargs.get("min_chunk_length_seconds", 1)
+        )
+        self.max_chunk_length_seconds = float(
+            kwargs.get("max_chunk_length_seconds", 10)
+        )
+        if self.min_chunk_length_seconds > self.max_chunk_length_seconds:
+            raise ValueError(
+                "min_chunk_length_seconds must not exceed "
+                "max_chunk_length_seconds"
+            )
+        self.rtf_low = float(kwargs.get("rtf_low", 0.25))
+        self.rtf_high = float(kwargs.get("rtf_high", 0.5))
+        self.max_chunks_in_flight = int(kwargs.get("max_chunks_in_flight", 8))
+        if self.adaptive_chunk_length:
+            self.chunk_length_seconds = min(
+                max(self.chunk_length_seconds, self.min_chunk_length_seconds),
+                self.max_chunk_length_seconds,
+            )
+
         self.processing_flag = False
+        self.closed = False
+        # Set when the server drains: the remaining speech is transcribed
+        # even if it has not ended
+        self.flushing = False
+        # Chunks of this client being processed
+        self.in_flight = 0
+        # Order of the results of the pipelined chunks
+        self._next_sequence = 0
+        self._next_delivery = 0
+        self._pending_deliveries = {}
+
+    def adapt_chunk_length(self):
+        """
+        Adjust the chunk length to the load of the server.
+
+        The load is estimated from the moving average of the real time
+        factor of the chunks processed by all the clients, and from the
+        number of chunks being processed: by all the clients sharing the
+        processing pipeline, or by this client without one. Under load,
+        longer chunks amortize the fixed cost of each VAD and ASR call; when
+        the server is idle, shorter chunks lower the latency. The length
+        grows or shrinks by 25% per chunk, within the configured bounds, and
+        the band between 'rtf_low' and 'rtf_high' keeps it from
+        oscillating.
+        """
+        rtf = metrics.get_ewma("buffering.rtf", 0.0)
+        pipeline = self.client.pipeline
+        in_flight = (
+            self.in_flight if pipeline is None else pipeline.chunks_in_flight
+        )
+
+        if rtf > self.rtf_high or in_flight > self.max_chunks_in_flight:
+            length = min(
+                self.chunk_length_seconds * 1.25,
+                self.max_chunk_length_seconds,
+            )
+            direction = "up"
+        elif rtf < self.rtf_low and in_flight <= 1:
+            length = max(
+                self.chunk_length_seconds / 1.25,
+                self.min_chunk_length_seconds,
+            )
+            direction = "down"
+        else:
+            return
+
+        if length != self.chunk_length_seconds:
+            logging.debug(
+                f"Client {self.client.client_id} chunk length "
+                f"{self.chunk_length_seconds:.2f}s -> {length:.2f}s "
+                f"(rtf {rtf:.2f}, {in_flight} chunks in flight)"
+            )
+            self.chunk_length_seconds = length
+            metrics.increment(
+                f"buffering.chunk_length_adjustments.{direction}"
+            )
+            metrics.observe("buffering.chunk_length_seconds", length)
 
     def process_audio(self, websocket, vad_pipeline, asr_pipeline):
         """
@@ -63,68 +163,979 @@ class SilenceAtEndOfChunk(BufferingStrategyInterface):
         asynchronous processing.
 
         This method checks if the length of the audio buffer exceeds the chunk
-        length and, if so, it schedules asynchronous processing of the audio.
+        length and, if so, it schedules asynchronous processing of the audio:
+        through the stages of the client's processing pipeline if it has one,
+        or in a task of its own.
 
         Args:
             websocket: The WebSocket connection for sending transcriptions.
             vad_pipeline: The voice activity detection pipeline.
             asr_pipeline: The automatic speech recognition pipeline.
         """
+        chunk_length_seconds = self.chunk_length_seconds
+        overload = self.client.overload
+        if overload is not None:
+            overload.update()
+            chunk_length_seconds *= overload.chunk_length_factor()
         chunk_length_in_bytes = (
-            self.chunk_length_seconds
+            chunk_length_seconds
             * self.client.sampling_rate
             * self.client.samples_width
         )
         if len(self.client.buffer) > chunk_length_in_bytes:
             if self.processing_flag:
-                exit(
-                    "Error in realtime processing: tried processing a new "
-                    "chunk while the previous one was still being processed"
-                )
+                if self.error_if_not_realtime:
+                    exit(
+                        "Error in realtime processing: tried processing a new "
+                        "chunk while the previous one was still being "
+                        "processed"
+                    )
+                # Keep buffering until the previous chunk has been processed
+                return
 
-            self.client.scratch_buffer += self.client.buffer
-            self.client.buffer.clear()
-            self.processing_flag = True
+            pipeline = self.client.pipeline
+            if pipeline is not None and pipeline.vad.full():
+                # Keep buffering until the VAD stage catches up
+                metrics.increment("pipeline.gate.held")
+                return
+
+            if self.adaptive_chunk_length:
+                self.adapt_chunk_length()
+
+            self._start_chunk(websocket, vad_pipeline, asr_pipeline)
+
+    def _start_chunk(self, websocket, vad_pipeline, asr_pipeline):
+        # Move the buffered audio to the scratch buffer and schedule its
+        # processing
+        timings = {
+            "arrival": self.client.buffer_arrival_time,
+            "capture": self.client.buffer_capture_time,
+            "enqueue": time.time(),
+        }
+        self.client.scratch_buffer += self.client.buffer
+        self.client.buffer.clear()
+        self.processing_flag = True
+        self._chunk_started()
+        chunk_id = self.client.next_chunk_id()
+        pipeline = self.client.pipeline
+        if pipeline is None:
             # Schedule the processing in a separate task
             asyncio.create_task(
-                self.process_audio_async(websocket, vad_pipeline, asr_pipeline)
+                self.process_audio_async(
+                    websocket,
+                    vad_pipeline,
+                    asr_pipeline,
+                    chunk_id,
+                    timings,
+                )
             )
+        else:
+            pipeline.vad.put_nowait(
+                functools.partial(
+                    self.vad_stage,
+                    websocket,
+                    vad_pipeline,
+                    asr_pipeline,
+                    chunk_id,
+                    timings,
+                )
+            )
+
+    async def flush(self, websocket, vad_pipeline, asr_pipeline):
+        self.flushing = True
+        pipeline = self.client.pipeline
+        # The chunk being analyzed by the VAD may leave its speech in the
+        # scratch buffer
+        while self.processing_flag or (
+            pipeline is not None and pipeline.vad.full()
+        ):
+            await asyncio.sleep(0.01)
+        if not self.closed and (
+            self.client.buffer or self.client.scratch_buffer
+        ):
+            self._start_chunk(websocket, vad_pipeline, asr_pipeline)
+        await self._wait_processed()
 
-    async def process_audio_async(self, websocket, vad_pipeline, asr_pipeline):
+    async def _wait_processed(self):
+        while self.in_flight:
+            await asyncio.sleep(0.01)
+
+    async def process_audio_async(
+        self, websocket, vad_pipeline, asr_pipeline, chunk_id, timings
+    ):
         """
         Asynchronously process audio for activity detection and transcription.
 
         This method performs heavy processing, including voice activity
         detection and transcription of the audio data. It sends the
-        transcription results through the WebSocket connection.
+        transcription results through the WebSocket connection, together
+        with a breakdown of the latency of the chunk. The next chunk of the
+        client waits until it is done.
 
         Args:
             websocket (Websocket): The WebSocket connection for sending
                                    transcriptions.
             vad_pipeline: The voice activity detection pipeline.
             asr_pipeline: The automatic speech recognition pipeline.
+            chunk_id (str): The identifier of the chunk being processed.
+            timings (dict): The 'arrival' time of the first frame of the
+                            chunk, its 'capture' time if known, and the time
+                            at which it was 'enqueue'd.
         """
-        start = time.time()
+        try:
+            await self._profiled(
+                chunk_id,
+                self._process_chunk(
+                    websocket, vad_pipeline, asr_pipeline, chunk_id, timings
+                ),
+            )
+        finally:
+            self.processing_flag = False
+            self._chunk_done()
+
+    async def _process_chunk(
+        self, websocket, vad_pipeline, asr_pipeline, chunk_id, timings
+    ):
+        snapshot, audio_duration = await self.detect_speech(
+            vad_pipeline, chunk_id, timings
+        )
+        if snapshot is not None:
+            transcription, segments_sent = await self.transcribe_chunk(
+                websocket, asr_pipeline, snapshot, timings
+            )
+            await self.send_result(
+                websocket,
+                asr_pipeline,
+                snapshot,
+                transcription,
+                segments_sent,
+                timings,
+                audio_duration,
+            )
+        self._observe_rtf(timings, audio_duration)
+
+    async def vad_stage(
+        self, websocket, vad_pipeline, asr_pipeline, chunk_id, timings
+    ):
+        """
+        Run the VAD on a chunk in the VAD stage of the pipeline, and hand it
+        over to the ASR stage if it is to be transcribed.
+
+        The next chunk of the client can enter the VAD stage as soon as this
+        one leaves it.
+        """
+        snapshot = None
+        try:
+            if not self.closed:
+                snapshot, audio_duration = await self._profiled(
+                    chunk_id,
+                    self.detect_speech(vad_pipeline, chunk_id, timings),
+                )
+        finally:
+            self.processing_flag = False
+            if snapshot is None:
+                self._chunk_done()
+        if snapshot is None:
+            if not self.closed:
+                self._observe_rtf(timings, audio_duration)
+            return
+
+        await self.client.pipeline.asr.put(
+            self.transcription_job(
+                websocket, asr_pipeline, snapshot, timings, audio_duration
+            )
+        )
+
+    def transcription_job(
+        self,
+        websocket,
+        asr_pipeline,
+        snapshot,
+        timings,
+        audio_duration,
+        after_vad=True,
+    ):
+        """
+        Return the job of the ASR stage transcribing a chunk. Its results
+        are delivered after those of the chunks of the client for which a
+        job was created before. `after_vad` tells whether the chunk went
+        through the VAD stage, whose profile the transcription continues.
+        """
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        return functools.partial(
+            self.asr_stage,
+            websocket,
+            asr_pipeline,
+            snapshot,
+            timings,
+            audio_duration,
+            sequence,
+            after_vad,
+        )
+
+    async def asr_stage(
+        self,
+        websocket,
+        asr_pipeline,
+        snapshot,
+        timings,
+        audio_duration,
+        sequence,
+        after_vad=True,
+    ):
+        delivery = None
+        try:
+            if not self.closed:
+                transcription, segments_sent = await self._profiled(
+                    snapshot.chunk_id,
+                    self.transcribe_chunk(
+                        websocket, asr_pipeline, snapshot, timings
+                    ),
+                    continued=after_vad,
+                )
+                self._observe_rtf(timings, audio_duration)
+                delivery = functools.partial(
+                    self.send_result,
+                    websocket,
+                    asr_pipeline,
+                    snapshot,
+                    transcription,
+                    segments_sent,
+                    timings,
+                    audio_duration,
+                )
+        finally:
+            # A failed chunk still takes its turn, so that it does not hold
+            # back the results of the next ones
+            await self.client.pipeline.deliver.put(
+                functools.partial(self.deliver_stage, sequence, delivery)
+            )
+
+    async def deliver_stage(self, sequence, delivery):
+        self._pending_deliveries[sequence] = delivery
+        while self._next_delivery in self._pending_deliveries:
+            delivery = self._pending_deliveries.pop(self._next_delivery)
+            self._next_delivery += 1
+            try:
+                if delivery is not None and not self.closed:
+                    await delivery()
+            finally:
+                self._chunk_done()
+
+    async def detect_speech(self, vad_pipeline, chunk_id, timings):
+        """
+        Run the VAD on the client's scratch buffer and decide whether it is
+        transcribed now.
+
+        When the last speech segment ends before the end of the audio, minus
+        the chunk offset, a snapshot of the scratch buffer is taken for the
+        transcription and the buffer is cleared. When the speech goes on, the
+        audio is kept to be extended by the next chunk. Audio without speech
+        is dropped.
+
+        Args:
+            vad_pipeline: The voice activity detection pipeline.
+            chunk_id (str): The identifier of the chunk.
+            timings (dict): The timestamps of the chunk, to which the 'start'
+                            and 'vad_end' times are added.
+
+        Returns:
+            tuple: The ClientSnapshot to transcribe, or None, and the
+                   duration of the audio analyzed.
+        """
+        timings["start"] = time.time()
         vad_results = await vad_pipeline.detect_activity(self.client)
+        timings["vad_end"] = time.time()
 
+        audio_duration = len(self.client.scratch_buffer) / (
+            self.client.sampling_rate * self.client.samples_width
+        )
         if len(vad_results) == 0:
             self.client.scratch_buffer.clear()
             self.client.buffer.clear()
-            self.processing_flag = False
-            return
+            return None, audio_duration
 
         last_segment_should_end_before = (
-            len(self.client.scratch_buffer)
-            / (self.client.sampling_rate * self.client.samples_width)
-        ) - self.chunk_offset_seconds
-        if vad_results[-1]["end"] < last_segment_should_end_before:
-            transcription = await asr_pipeline.transcribe(self.client)
-            if transcription["text"] != "":
-                end = time.time()
-                transcription["processing_time"] = end - start
-                json_transcription = json.dumps(transcription)
-                await websocket.send(json_transcription)
+            audio_duration - self.chunk_offset_seconds
+        )
+        if (
+            self.flushing
+            or vad_results[-1]["end"] < last_segment_should_end_before
+        ):
+            snapshot = self.take_snapshot(chunk_id)
             self.client.scratch_buffer.clear()
             self.client.increment_file_counter()
+            return snapshot, audio_duration
+        return None, audio_duration
 
-        self.processing_flag = False
+    def take_snapshot(self, chunk_id, audio=None):
+        """
+        Take the snapshot of the client to transcribe, with the config
+        overrides of the current quality level of the overload controller,
+        if the client has one.
+        """
+        snapshot = self.client.snapshot(chunk_id, audio)
+        overload = self.client.overload
+        if overload is not None:
+            overload.update()
+            snapshot.config.update(overload.overrides())
+            snapshot.config["quality_level"] = overload.level
+        return snapshot
+
+    def _chunk_started(self):
+        self.in_flight += 1
+        if self.client.pipeline is not None:
+            self.client.pipeline.chunks_in_flight += 1
+        metrics.adjust_gauge("buffering.chunks_in_flight", 1)
+
+    def _chunk_done(self):
+        self.in_flight -= 1
+        if self.client.pipeline is not None:
+            self.client.pipeline.chunks_in_flight -= 1
+        metrics.adjust_gauge("buffering.chunks_in_flight", -1)
+
+    async def _profiled(self, chunk_id, coroutine, continued=False):
+        if self.client.profiler is None:
+            return await coroutine
+        with self.client.profiler.profile(chunk_id, continued):
+            return await coroutine
+
+    def _observe_rtf(self, timings, audio_duration):
+        if audio_duration > 0:
+            metrics.observe(
+                "buffering.rtf",
+                (time.time() - timings["start"]) / audio_duration,
+            )
+
+    async def transcribe_chunk(
+        self, websocket, asr_pipeline, snapshot, timings
+    ):
+        """
+        Transcribe a chunk, recording the 'asr_start' and 'asr_end' times.
+
+        Args:
+            websocket (Websocket): The WebSocket connection for sending
+                                   the streamed segments.
+            asr_pipeline: The automatic speech recognition pipeline.
+            snapshot (ClientSnapshot): The chunk to transcribe.
+            timings (dict): The timestamps of the chunk.
+
+        Returns:
+            tuple: The transcription and the number of segments sent.
+        """
+        timings["asr_start"] = time.time()
+        result = await self.transcribe(
+            websocket, asr_pipeline, snapshot, snapshot.chunk_id
+        )
+        timings["asr_end"] = time.time()
+        return result
+
+    async def send_result(
+        self,
+        websocket,
+        asr_pipeline,
+        snapshot,
+        transcription,
+        segments_sent,
+        timings,
+        audio_duration,
+    ):
+        """
+        Send the transcription of a chunk, if not empty.
+
+        Args:
+            websocket (Websocket): The WebSocket connection for sending
+                                   transcriptions.
+            asr_pipeline: The automatic speech recognition pipeline.
+            snapshot (ClientSnapshot): The transcribed chunk.
+            transcription (dict): The transcription of the chunk.
+            segments_sent (int): The number of segments already streamed.
+            timings (dict): The timestamps collected so far for the chunk.
+            audio_duration (float): The duration of the transcribed audio.
+        """
+        if transcription["text"] != "" or segments_sent:
+            await self.send_transcription(
+                websocket,
+                transcription,
+                snapshot.chunk_id,
+                timings,
+                audio_duration,
+                snapshot.config.get("quality_level", 0),
+            )
+
+    async def transcribe(self, websocket, asr_pipeline, client, chunk_id):
+        """
+        Transcribe a chunk, sending each of its segments to the client as
+        soon as it is decoded if 'stream_segments' is set.
+
+        Segments are sent with type 'segment', the chunk_id, their index in
+        the chunk and the time elapsed since the start of the transcription.
+        The complete transcription then gets type 'final', so that the client
+        can replace the segments with it.
+
+        Args:
+            websocket (Websocket): The WebSocket connection for sending
+                                   the segments.
+            asr_pipeline: The automatic speech recognition pipeline.
+            client: The client, or a ClientSnapshot, to transcribe.
+            chunk_id (str): The identifier of the chunk.
+
+        Returns:
+            tuple: The transcription and the number of segments sent.
+        """
+        if not self.stream_segments:
+            return await asr_pipeline.transcribe(client), 0
+
+        start = time.time()
+        segments_sent = 0
+
+        async def on_segment(segment):
+            nonlocal segments_sent
+            segment["type"] = "segment"
+            segment["chunk_id"] = chunk_id
+            segment["segment_index"] = segments_sent
+            segment["time_to_segment"] = time.time() - start
+            await self.send_message(websocket, segment)
+            segments_sent += 1
+
+        transcription = await asr_pipeline.transcribe_stream(
+            client, on_segment
+        )
+        if segments_sent:
+            transcription["type"] = "final"
+        return transcription, segments_sent
+
+    async def send_message(self, websocket, message):
+        """
+        Send a message to the client, through its outbound queue if it has
+        one.
+        """
+        if self.client.outbound is not None:
+            self.client.outbound.put(message)
+        else:
+            await websocket.send(json.dumps(message))
+
+    async def send_transcription(
+        self,
+        websocket,
+        transcription,
+        chunk_id,
+        timings,
+        audio_duration,
+        quality_level=0,
+    ):
+        """
+        Send a transcription to the client, together with the breakdown of
+        the latency of its chunk, and log and record it. When the client has
+        an outbound queue, the transcription is only enqueued for delivery.
+
+        Args:
+            websocket (Websocket): The WebSocket connection for sending
+                                   transcriptions.
+            transcription (dict): The transcription structure returned by the
+                                  ASR pipeline.
+            chunk_id (str): The identifier of the transcribed chunk.
+            timings (dict): The 'arrival', 'enqueue', 'start' and 'vad_end'
+                            timestamps of the chunk, and its 'capture',
+                            'asr_start' and 'asr_end' if known.
+            audio_duration (float): The duration of the transcribed audio.
+            quality_level (int): The quality level of the overload
+                                 controller the chunk was transcribed at.
+        """
+        end = time.time()
+        asr_start = timings.get("asr_start", timings["vad_end"])
+        asr_end = timings.get("asr_end", end)
+        latency = {
+            "arrival_to_enqueue": (
+                timings["enqueue"] - timings["arrival"]
+                if timings["arrival"] is not None
+                else None
+            ),
+            "queue_wait": timings["start"] - timings["enqueue"],
+            "vad": timings["vad_end"] - timings["start"],
+            "asr_queue_wait": asr_start - timings["vad_end"],
+            "asr": asr_end - asr_start,
+            "deliver_wait": end - asr_end,
+            "audio_duration": audio_duration,
+            "rtf": (end - timings["start"]) / audio_duration,
+        }
+        if timings.get("capture") is not None:
+            # From the capture of the audio by the client, with sequenced
+            # frames and a known clock offset
+            latency["capture_to_arrival"] = (
+                timings["arrival"] - timings["capture"]
+            )
+            latency["end_to_end"] = end - timings["capture"]
+            metrics.observe("latency.end_to_end", latency["end_to_end"])
+        transcription["chunk_id"] = chunk_id
+        transcription["processing_time"] = end - timings["start"]
+        transcription["latency"] = latency
+        transcription["quality_level"] = quality_level
+        metrics.observe(
+            "buffering.queue_wait",
+            latency["queue_wait"] + latency["asr_queue_wait"],
+        )
+        await self.send_message(websocket, transcription)
+        latency["send"] = time.time() - end
+        logging.info(f"Chunk {chunk_id} latency: {latency}")
+        if self.client.recorder is not None:
+            await self.client.recorder.record_transcription(
+                self.client.client_id, transcription
+            )
+
+    def close(self):
+        # The chunks of the client still in the pipeline are skipped
+        self.closed = True
+
+
+class SpeculativeSilenceAtEndOfChunk(SilenceAtEndOfChunk):
+    """
+    A variant of SilenceAtEndOfChunk that transcribes each chunk twice.
+
+    A fast draft model transcribes the chunk first, and its result is sent
+    right away with type 'draft'. The accurate model then transcribes the
+    same audio in the background, and its result is sent with type 'final'
+    and the same chunk_id, so that the client can replace the draft. Final
+    passes run one at a time, in chunk order, and are cancelled when the
+    client disconnects.
+
+    Both models are taken from the ASR model pool (see --asr-models); with a
+    single ASR model the strategy behaves like SilenceAtEndOfChunk.
+
+    Attributes:
+        draft_model (str): The model of the pool used for the drafts.
+        final_model (str): The model of the pool used for the final results,
+                           or None to use the client's 'asr_model'.
+        final_tasks (set): The final passes not completed yet.
+    """
+
+    def __init__(self, client, **kwargs):
+        """
+        Initialize the SpeculativeSilenceAtEndOfChunk buffering strategy.
+
+        Args:
+            client (Client): The client instance associated with this buffering
+                             strategy.
+            **kwargs: The keyword arguments of SilenceAtEndOfChunk, plus
+                      'draft_model' and 'final_model'.
+        """
+        super().__init__(client, **kwargs)
+        self.draft_model = kwargs.get("draft_model", DEFAULT_DRAFT_MODEL)
+        self.final_model = kwargs.get("final_model")
+        self.final_tasks = set()
+        self._previous_final_task = None
+
+    async def transcribe_chunk(
+        self, websocket, asr_pipeline, snapshot, timings
+    ):
+        if not hasattr(asr_pipeline, "transcribe_with"):
+            logging.warning(
+                "Speculative transcription requires an ASR model pool, "
+                "sending final results only"
+            )
+            return await super().transcribe_chunk(
+                websocket, asr_pipeline, snapshot, timings
+            )
+
+        timings["asr_start"] = time.time()
+        draft = await asr_pipeline.transcribe_with(self.draft_model, snapshot)
+        timings["asr_end"] = time.time()
+        return draft, 0
+
+    async def send_result(
+        self,
+        websocket,
+        asr_pipeline,
+        snapshot,
+        transcription,
+        segments_sent,
+        timings,
+        audio_duration,
+    ):
+        if not hasattr(asr_pipeline, "transcribe_with"):
+            await super().send_result(
+                websocket,
+                asr_pipeline,
+                snapshot,
+                transcription,
+                segments_sent,
+                timings,
+                audio_duration,
+            )
+            return
+
+        draft_sent = transcription["text"] != ""
+        if draft_sent:
+            transcription["type"] = "draft"
+            await self.send_transcription(
+                websocket,
+                transcription,
+                snapshot.chunk_id,
+                dict(timings),
+                audio_duration,
+                snapshot.config.get("quality_level", 0),
+            )
+
+        task = asyncio.create_task(
+            self.final_pass(
+                websocket,
+                asr_pipeline,
+                snapshot,
+                dict(timings),
+                audio_duration,
+                draft_sent,
+                self._previous_final_task,
+            )
+        )
+        self._previous_final_task = task
+        self.final_tasks.add(task)
+        task.add_done_callback(self.final_tasks.discard)
+
+    async def final_pass(
+        self,
+        websocket,
+        asr_pipeline,
+        snapshot,
+        timings,
+        audio_duration,
+        draft_sent,
+        previous_task,
+    ):
+        """
+        Transcribe a chunk with the accurate model and send the result.
+
+        Args:
+            websocket (Websocket): The WebSocket connection for sending
+                                   transcriptions.
+            asr_pipeline (ASRModelPool): The ASR model pool.
+            snapshot (ClientSnapshot): The chunk to transcribe.
+            timings (dict): The timestamps collected so far for the chunk.
+            audio_duration (float): The duration of the chunk.
+            draft_sent (bool): Whether a draft was sent for the chunk, in
+                               which case the final result is sent even if
+                               empty so that the client can clear it.
+            previous_task (asyncio.Task): The final pass of the previous
+                                          chunk, which must be sent first.
+        """
+        if previous_task is not None:
+            await asyncio.wait([previous_task])
+
+        timings["asr_start"] = time.time()
+        if self.final_model is None:
+            final = await asr_pipeline.transcribe(snapshot)
+        else:
+            final = await asr_pipeline.transcribe_with(
+                self.final_model, snapshot
+            )
+        timings["asr_end"] = time.time()
+
+        if final["text"] != "" or draft_sent:
+            final["type"] = "final"
+            await self.send_transcription(
+                websocket,
+                final,
+                snapshot.chunk_id,
+                timings,
+                audio_duration,
+                snapshot.config.get("quality_level", 0),
+            )
+
+    async def flush(self, websocket, vad_pipeline, asr_pipeline):
+        await super().flush(websocket, vad_pipeline, asr_pipeline)
+        # The final passes are started as the drafts are sent
+        if self.final_tasks:
+            await asyncio.wait(set(self.final_tasks))
+
+    @staticmethod
+    def models(processing_args):
+        """
+        Return the models of the ASR model pool used with the given
+        processing arguments, None standing for the client's 'asr_model'.
+        """
+        return [
+            processing_args.get("draft_model", DEFAULT_DRAFT_MODEL),
+            processing_args.get("final_model"),
+        ]
+
+    def close(self):
+        super().close()
+        for task in self.final_tasks:
+            task.cancel()
+
+
+class VADEndpointing(SilenceAtEndOfChunk):
+    """
+    A buffering strategy that sends each utterance to the ASR as soon as
+    its end is detected.
+
+    Instead of waiting for a chunk of fixed length, a cheap frame-level VAD
+    classifies every frame as it arrives. An utterance starts at the first
+    speech frame, preceded by a short padding of the audio before it, and
+    ends after 'endpoint_silence_seconds' of silence, so a short voice
+    command is transcribed a few hundred milliseconds after the speaker
+    stops. Utterances with less than 'min_utterance_seconds' of speech are
+    dropped as noise, and utterances reaching 'max_utterance_seconds' are
+    cut, to bound the latency of continuous speech. The VAD pipeline of the
+    server is not used.
+
+    Utterances are transcribed in the background, by the ASR stage of the
+    processing pipeline if the client has one, and their results are sent
+    in order while the following audio keeps being analyzed.
+
+    Attributes:
+        frame_vad (EnergyFrameVAD): The frame-level VAD of the client.
+        endpoint_silence_seconds (float): The silence ending an utterance.
+        min_utterance_seconds (float): The minimum speech in an utterance.
+        max_utterance_seconds (float): The maximum length of an utterance.
+        speech_pad_seconds (float): The audio kept before the speech.
+    """
+
+    def __init__(self, client, **kwargs):
+        """
+        Initialize the VADEndpointing buffering strategy.
+
+        Args:
+            client (Client): The client instance associated with this buffering
+                             strategy.
+            **kwargs: 'endpoint_silence_seconds', 'min_utterance_seconds',
+                      'max_utterance_seconds', 'speech_pad_seconds',
+                      'stream_segments', and 'frame_ms', 'threshold_db' and
+                      'margin_db' for the frame-level VAD.
+        """
+        kwargs.setdefault("chunk_length_seconds", 0)
+        kwargs.setdefault("chunk_offset_seconds", 0)
+        super().__init__(client, **kwargs)
+
+        self.frame_vad = EnergyFrameVAD(
+            sampling_rate=client.sampling_rate,
+            frame_ms=int(kwargs.get("frame_ms", 30)),
+            threshold_db=float(kwargs.get("threshold_db", -45)),
+            margin_db=float(kwargs.get("margin_db", 10)),
+        )
+        self.endpoint_silence_seconds = float(
+            kwargs.get("endpoint_silence_seconds", 0.3)
+        )
+        self.min_utterance_seconds = float(
+            kwargs.get("min_utterance_seconds", 0.2)
+        )
+        self.max_utterance_seconds = float(
+            kwargs.get("max_utterance_seconds", 15)
+        )
+        self.speech_pad_seconds = float(kwargs.get("speech_pad_seconds", 0.2))
+
+        frame_seconds = self.frame_vad.frame_ms / 1000
+        self._frame_seconds = frame_seconds
+        self._pad = deque(
+            maxlen=max(int(self.speech_pad_seconds / frame_seconds), 1)
+        )
+        self._utterance = bytearray()
+        self._utterance_arrival = None
+        self._utterance_capture = None
+        self._speech_frames = 0
+        self._silent_frames = 0
+        self._tasks = set()
+        self._previous_task = None
+
+    def process_audio(self, websocket, vad_pipeline, asr_pipeline):
+        frame_bytes = self.frame_vad.frame_bytes
+        buffer = self.client.buffer
+        usable = len(buffer) - len(buffer) % frame_bytes
+        capture = self.client.buffer_capture_time
+        bytes_per_second = (
+            self.client.sampling_rate * self.client.samples_width
+        )
+        with memoryview(buffer) as view:
+            for start in range(0, usable, frame_bytes):
+                end = start + frame_bytes
+                frame = bytes(view[start:end])
+                self._process_frame(
+                    frame,
+                    websocket,
+                    asr_pipeline,
+                    (
+                        None
+                        if capture is None
+                        else capture + start / bytes_per_second
+                    ),
+                )
+        del buffer[:usable]
+        if capture is not None:
+            # The capture time of the rest of the buffer
+            self.client.buffer_capture_time += usable / bytes_per_second
+
+    def _process_frame(self, frame, websocket, asr_pipeline, capture=None):
+        speech = self.frame_vad.is_speech(frame)
+
+        if not self._utterance:
+            if not speech:
+                self._pad.append(frame)
+                return
+            self._utterance_arrival = time.time()
+            self._utterance_capture = capture
+            for padding in self._pad:
+                self._utterance += padding
+            self._pad.clear()
+
+        self._utterance += frame
+        if speech:
+            self._speech_frames += 1
+            self._silent_frames = 0
+        else:
+            self._silent_frames += 1
+
+        utterance_seconds = len(self._utterance) / (
+            self.client.sampling_rate * self.client.samples_width
+        )
+        if (
+            self._silent_frames * self._frame_seconds
+            >= self.endpoint_silence_seconds
+        ):
+            self._end_utterance(websocket, asr_pipeline, utterance_seconds)
+        elif utterance_seconds >= self.max_utterance_seconds:
+            metrics.increment("endpointing.forced_cuts")
+            self._end_utterance(websocket, asr_pipeline, utterance_seconds)
+
+    def _end_utterance(self, websocket, asr_pipeline, utterance_seconds):
+        speech_seconds = self._speech_frames * self._frame_seconds
+        audio = bytes(self._utterance)
+        arrival = self._utterance_arrival
+        capture = self._utterance_capture
+        self._utterance.clear()
+        self._speech_frames = 0
+        self._silent_frames = 0
+
+        if speech_seconds < self.min_utterance_seconds:
+            metrics.increment("endpointing.discarded")
+            return
+
+        metrics.increment("endpointing.utterances")
+        metrics.observe("endpointing.utterance_seconds", utterance_seconds)
+        chunk_id = self.client.next_chunk_id()
+        timings = {
+            "arrival": arrival,
+            "capture": capture,
+            "enqueue": time.time(),
+        }
+        snapshot = self.take_snapshot(chunk_id, audio)
+        if self.client.pipeline is not None:
+            # The utterance goes straight to the ASR stage
+            timings["start"] = timings["vad_end"] = timings["enqueue"]
+            task = asyncio.create_task(
+                self.queue_utterance(
+                    websocket,
+                    asr_pipeline,
+                    snapshot,
+                    timings,
+                    utterance_seconds,
+                )
+            )
+        else:
+            task = asyncio.create_task(
+                self.transcribe_utterance(
+                    websocket,
+                    asr_pipeline,
+                    snapshot,
+                    timings,
+                    utterance_seconds,
+                    self._previous_task,
+                )
+            )
+            self._previous_task = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def queue_utterance(
+        self, websocket, asr_pipeline, snapshot, timings, audio_duration
+    ):
+        """
+        Queue the transcription of an utterance in the ASR stage of the
+        processing pipeline, which delivers its result.
+        """
+        # The utterance is in flight until its delivery, unless it never
+        # entered the ASR stage
+        self._chunk_started()
+        try:
+            await self.client.pipeline.asr.put(
+                self.transcription_job(
+                    websocket,
+                    asr_pipeline,
+                    snapshot,
+                    timings,
+                    audio_duration,
+                    after_vad=False,
+                )
+            )
+        except BaseException:
+            self._chunk_done()
+            raise
+
+    async def transcribe_utterance(
+        self,
+        websocket,
+        asr_pipeline,
+        snapshot,
+        timings,
+        audio_duration,
+        previous_task,
+    ):
+        """
+        Transcribe an utterance and send the result, after the result of the
+        previous utterance. Only used without a processing pipeline.
+
+        Args:
+            websocket (Websocket): The WebSocket connection for sending
+                                   transcriptions.
+            asr_pipeline: The automatic speech recognition pipeline.
+            snapshot (ClientSnapshot): The utterance to transcribe.
+            timings (dict): The 'arrival', 'capture' and 'enqueue' times
+                            of the utterance.
+            audio_duration (float): The duration of the utterance.
+            previous_task (asyncio.Task): The transcription of the previous
+                                          utterance.
+        """
+        self._chunk_started()
+        try:
+            if previous_task is not None:
+                await asyncio.wait([previous_task])
+
+            timings["start"] = timings["vad_end"] = time.time()
+            transcription, segments_sent = await self._profiled(
+                snapshot.chunk_id,
+                self.transcribe_chunk(
+                    websocket, asr_pipeline, snapshot, timings
+                ),
+            )
+            self._observe_rtf(timings, audio_duration)
+            await self.send_result(
+                websocket,
+                asr_pipeline,
+                snapshot,
+                transcription,
+                segments_sent,
+                timings,
+                audio_duration,
+            )
+        finally:
+            self._chunk_done()
+
+    async def flush(self, websocket, vad_pipeline, asr_pipeline):
+        # The audio left in the buffer is shorter than a frame
+        if self._utterance and not self.closed:
+            utterance_seconds = len(self._utterance) / (
+                self.client.sampling_rate * self.client.samples_width
+            )
+            self._end_utterance(websocket, asr_pipeline, utterance_seconds)
+        self._pad.clear()
+        # The utterances are only in flight once their task started
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+        await self._wait_processed()
+
+    def memory_usage(self):
+        return len(self._utterance) + sum(len(frame) for frame in self._pad)
+
+    def close(self):
+        super().close()
+        for task in self._tasks:
+            task.cancel()
@@ -13,6 +13,9 @@ class BufferingStrategyInterface:
     Methods:
         process_audio: Process audio data. This method should be implemented
                        by subclasses.
+        close: Release the resources held by the strategy.
+        flush: Process the audio left when the server drains.
+        memory_usage: The audio held by the strategy itself.
     """
 
     def process_audio(self, websocket, vad_pipeline, asr_pipeline):
@@ -39,3 +42,35 @@ class BufferingStrategyInterface:
         raise NotImplementedError(
             "This method should be implemented by subclasses."
         )
+
+    def close(self):
+        """
+        Release the resources held by the strategy, for example cancel its
+        background tasks, when the client disconnects.
+
+        The default implementation does nothing.
+        """
+
+    async def flush(self, websocket, vad_pipeline, asr_pipeline):
+        """
+        Process the audio left in the client's buffers, whatever its length,
+        and wait until its results are handed over for delivery, when the
+        server drains before stopping.
+
+        The default implementation does nothing.
+
+        Args:
+            websocket (Websocket): The WebSocket connection for sending
+                                   transcriptions.
+            vad_pipeline: The voice activity detection pipeline.
+            asr_pipeline: The automatic speech recognition pipeline.
+        """
+
+    def memory_usage(self):
+        """
+        Return the number of bytes of audio held by the strategy itself,
+        outside of the client's buffers.
+
+        The default implementation holds none.
+        """
+        return 0
@@ -1,5 +1,10 @@
 # isort: skip_file
 
+import copy
+import time
+import weakref
+
+from src.audio_format import AudioFormatConverter
 from src.buffering_strategy.buffering_strategy_factory import (
     BufferingStrategyFactory,
 )
@@ -23,9 +28,57 @@ class Client:
                              client.
         sampling_rate (int): The sampling rate of the audio data in Hz.
         samples_width (int): The width of each audio sample in bits.
+        audio_converter (AudioFormatConverter): Converts the audio sent by
+                                                the client to mono PCM at
+                                                sampling_rate, or None if the
+                                                client already sends it.
+        buffer_arrival_time (float): Time at which the first frame currently
+                                     in the buffer was received.
+        buffer_capture_time (float): Time, on the server's clock, at which
+                                     the first frame currently in the
+                                     buffer was captured by the client, or
+                                     None if unknown.
+        chunk_counter (int): Counter for the number of chunks scheduled for
+                             processing.
+        profiler (ChunkProfiler): Optional profiler sampling the processing
+                                  of this client's chunks.
+        recorder (SessionRecorder): Optional recorder archiving this client's
+                                    audio and transcriptions.
+        decoder (StreamingAudioDecoder): Decoder of the compressed audio sent
+                                         by the client, if it negotiated a
+                                         codec. Managed by the server.
+        outbound (OutboundQueue): The queue delivering the results to the
+                                  client, or None to send them directly.
+                                  Managed by the server.
+        pipeline (ProcessingPipeline): The stages processing the chunks of
+                                       the client, or None to process each
+                                       chunk in a task of its own. Managed
+                                       by the server.
+        overload (OverloadController): The controller degrading the quality
+                                       of the transcriptions under load, or
+                                       None. Managed by the server.
+        pending_bytes (int): The audio of the snapshots of the client still
+                             being processed.
+        jitter_buffer (JitterBuffer): Restores the order of the frames of
+                                      the client if it sends sequenced
+                                      frames, or None. Managed by the
+                                      server.
+        clock_sync (ClockSync): The estimate of the offset of the client's
+                                clock, with sequenced frames, or None.
+                                Managed by the server.
+        closing_reason (str): Why the server is closing the session, for
+                              example when it exceeds its memory limit, or
+                              None.
     """
 
-    def __init__(self, client_id, sampling_rate, samples_width):
+    def __init__(
+        self,
+        client_id,
+        sampling_rate,
+        samples_width,
+        profiler=None,
+        recorder=None,
+    ):
         self.client_id = client_id
         self.buffer = bytearray()
         self.scratch_buffer = bytearray()
@@ -41,6 +94,20 @@ class Client:
         self.total_samples = 0
         self.sampling_rate = sampling_rate
         self.samples_width = samples_width
+        self.audio_converter = None
+        self.buffer_arrival_time = None
+        self.buffer_capture_time = None
+        self.chunk_counter = 0
+        self.profiler = profiler
+        self.recorder = recorder
+        self.decoder = None
+        self.outbound = None
+        self.pipeline = None
+        self.overload = None
+        self.pending_bytes = 0
+        self.jitter_buffer = None
+        self.clock_sync = None
+        self.closing_reason = None
         self.buffering_strategy = (
             BufferingStrategyFactory.create_buffering_strategy(
                 self.config["processing_strategy"],
@@ -51,6 +118,13 @@ class Client:
 
     def update_config(self, config_data):
         self.config.update(config_data)
+        if self.config.get("codec", "pcm") == "pcm":
+            self.audio_converter = AudioFormatConverter.from_config(
+                self.config, self.sampling_rate
+            )
+        else:
+            # The decoder already outputs mono PCM at the server rate
+            self.audio_converter = None
         self.buffering_strategy = (
             BufferingStrategyFactory.create_buffering_strategy(
                 self.config["processing_strategy"],
@@ -59,9 +133,27 @@ class Client:
             )
         )
 
-    def append_audio_data(self, audio_data):
+    def append_audio_data(self, audio_data, capture_time=None):
+        """
+        Append audio received from the client to the buffer, converting it
+        to the server format if needed.
+
+        Args:
+            audio_data (bytes): The audio received.
+            capture_time (float): The time, on the server's clock, at which
+                                  the client captured the audio, if known.
+
+        Returns:
+            bytes: The audio data as appended to the buffer.
+        """
+        if self.audio_converter is not None:
+            audio_data = self.audio_converter.convert(audio_data)
+        if not self.buffer:
+            self.buffer_arrival_time = time.time()
+            self.buffer_capture_time = capture_time
         self.buffer.extend(audio_data)
         self.total_samples += len(audio_data) / self.samples_width
+        return audio_data
 
     def clear_buffer(self):
         self.buffer.clear()
@@ -69,10 +161,101 @@ class Client:
     def increment_file_counter(self):
         self.file_counter += 1
 
+    def next_chunk_id(self):
+        self.chunk_counter += 1
+        return f"{self.client_id}-{self.chunk_counter}"
+
     def get_file_name(self):
         return f"{self.client_id}_{self.file_counter}.wav"
 
+    def snapshot(self, chunk_id, audio=None):
+        snapshot = ClientSnapshot(self, chunk_id, audio)
+        # The audio of the snapshot is held until it is no longer referenced
+        size = len(snapshot.scratch_buffer)
+        self.pending_bytes += size
+        weakref.finalize(snapshot, self._release_pending, size)
+        return snapshot
+
+    def _release_pending(self, size):
+        self.pending_bytes -= size
+
+    def memory_usage(self):
+        """
+        Return the bytes held by the session: its audio buffers, the audio
+        held by its buffering strategy, the snapshots being processed and
+        the results waiting for delivery.
+
+        Returns:
+            dict: The bytes held by each, and their 'total'.
+        """
+        usage = {
+            "buffer": len(self.buffer),
+            "scratch_buffer": len(self.scratch_buffer),
+            "strategy": self.buffering_strategy.memory_usage(),
+            "pending_chunks": self.pending_bytes,
+            "outbound": (
+                0 if self.outbound is None else self.outbound.queued_bytes
+            ),
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
     def process_audio(self, websocket, vad_pipeline, asr_pipeline):
         self.buffering_strategy.process_audio(
             websocket, vad_pipeline, asr_pipeline
         )
+
+    def close(self):
+        self.buffering_strategy.close()
+
+
+class ClientSnapshot:
+    """
+    A frozen copy of the state of a client needed by the VAD and ASR
+    pipelines.
+
+    It can be passed to the pipelines in place of the Client to process a
+    chunk in the background, while the client keeps receiving audio and
+    reusing its scratch buffer.
+
+    Attributes:
+        client_id (str): The identifier of the client.
+        chunk_id (str): The identifier of the chunk.
+        scratch_buffer (bytes): A copy of the client's scratch buffer, or of
+                                the audio given to the constructor.
+        config (dict): A copy of the client's configuration.
+        sampling_rate (int): The sampling rate of the audio data in Hz.
+        samples_width (int): The width of each audio sample in bytes.
+    """
+
+    def __init__(self, client, chunk_id, audio=None):
+        self.client_id = client.client_id
+        self.chunk_id = chunk_id
+        self.scratch_buffer = bytes(
+            client.scratch_buffer if audio is None else audio
+        )
+        self.config = copy.deepcopy(client.config)
+        self.sampling_rate = client.sampling_rate
+        self.samples_width = client.samples_width
+
+    def get_file_name(self):
+        return f"{self.chunk_id}.wav"
+
+    @classmethod
+    def from_description(cls, description, scratch_buffer):
+        """
+        Rebuild a snapshot received by a remote inference worker.
+
+        Args:
+            description (dict): The client_id, chunk_id, config,
+                                sampling_rate and samples_width of the chunk.
+            scratch_buffer (bytes): The audio of the chunk.
+        """
+        snapshot = cls.__new__(cls)
+        snapshot.client_id = description["client_id"]
+        snapshot.chunk_id = description["chunk_id"]
+        snapshot.scratch_buffer = bytes(scratch_buffer)
+        snapshot.config = description["config"]
+        snapshot.sampling_rate = description["sampling_rate"]
+        snapshot.samples_width = description["samples_width"]
+        return snapshot
@@ -0,0 +1,405 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+from src.asr.asr_interface import ASRInterface
+from src.client import ClientSnapshot
+from src.metrics import metrics
+from src.vad.vad_interface import VADInterface
+
+from .protocol import describe_client
+
+# Seconds between two checks of the liveness of the worker processes
+LIVENESS_CHECK_INTERVAL = 1.0
+
+
+async def _run_request(vad_pipeline, asr_pipeline, op, model_name, snapshot):
+    if op == "vad":
+        return await vad_pipeline.detect_activity(snapshot)
+    if op == "asr":
+        if model_name is None:
+            return await asr_pipeline.transcribe(snapshot)
+        return await asr_pipeline.transcribe_with(model_name, snapshot)
+    raise ValueError(f"Unknown operation: {op}")
+
+
+def _read_audio(shm, slot_bytes, offsets, length, block_name):
+    if block_name is not None:
+        block = shared_memory.SharedMemory(name=block_name)
+        try:
+            return bytes(block.buf[:length])
+        finally:
+            block.close()
+    audio = bytearray()
+    for offset in offsets:
+        end = offset + min(slot_bytes, length - len(audio))
+        audio += shm.buf[offset:end]
+    return bytes(audio)
+
+
+def _worker_main(
+    create_pipelines, pipeline_args, shm_name, slot_bytes, requests, results
+):
+    """
+    The main loop of a worker process: load the pipelines, then process
+    the requests one at a time, reading their audio from the shared memory.
+    """
+    vad_pipeline, asr_pipeline = create_pipelines(pipeline_args)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            request_id, op, model_name, description = request[:4]
+            offsets, length, block_name = request[4:]
+            try:
+                audio = _read_audio(
+                    shm, slot_bytes, offsets, length, block_name
+                )
+                snapshot = ClientSnapshot.from_description(description, audio)
+                result = loop.run_until_complete(
+                    _run_request(
+                        vad_pipeline, asr_pipeline, op, model_name, snapshot
+                    )
+                )
+                results.put((request_id, result, None))
+            except Exception as e:
+                logging.exception(f"Failed to process {op} request")
+                results.put((request_id, None, repr(e)))
+    finally:
+        loop.close()
+        shm.close()
+
+
+class ProcessPool:
+    """
+    Runs the VAD and ASR pipelines in a pool of worker processes.
+
+    Each process loads its own copy of the pipelines, so the Python parts of
+    the inference (pre and post-processing, the decoding loops of the
+    pyannote and transformers backends) run on several cores instead of
+    contending for the GIL of the server process.
+
+    The audio of each request is copied once into a slot of a block of
+    shared memory, and only a small descriptor (the slot offset, the audio
+    length, the chunk id and the client config) is pickled to the process.
+    Results come back on a shared queue, read by a thread that resolves the
+    pending requests on the event loop. A slot is released when the result
+    of its request arrives, so the number of slots bounds the audio in
+    flight. Chunks larger than a slot are split over several slots, and
+    those larger than all the slots get a block of shared memory of their
+    own, released with their result, so audio is never pickled.
+
+    Worker processes that die are restarted, and the requests they held
+    fail with a RuntimeError.
+
+    Attributes:
+        processes (int): The number of worker processes.
+        slots (int): The number of shared memory slots.
+        slot_bytes (int): The size of each slot.
+        request_timeout (float): Seconds to wait for the result of a
+                                 request.
+    """
+
+    def __init__(
+        self,
+        create_pipelines,
+        pipeline_args,
+        processes=2,
+        slots=None,
+        slot_bytes=2**20,
+        request_timeout=300.0,
+    ):
+        """
+        Args:
+            create_pipelines (callable): A picklable function returning the
+                                         (vad_pipeline, asr_pipeline) of a
+                                         worker process, called in each
+                                         process with `pipeline_args`.
+            pipeline_args: A picklable argument for `create_pipelines`.
+            processes (int): The number of worker processes.
+            slots (int): The number of shared memory slots, twice the number
+                         of processes by default so that the audio of the
+                         next requests can be staged while processing.
+            slot_bytes (int): The size of each slot, 1 MiB by default, about
+                              32 seconds of 16 kHz 16-bit audio.
+            request_timeout (float): Seconds to wait for a result.
+        """
+        if processes < 1:
+            raise ValueError("At least one worker process is required")
+        self.create_pipelines = create_pipelines
+        self.pipeline_args = pipeline_args
+        self.processes = processes
+        self.slots = slots or 2 * processes
+        self.slot_bytes = slot_bytes
+        self.request_timeout = request_timeout
+
+        self._context = multiprocessing.get_context("spawn")
+        self._loop = None
+        self._shm = None
+        self._free_slots = None
+        self._multi_slot_lock = None
+        self._results = None
+        self._workers = []
+        self._pending = {}
+        self._next_id = 0
+        self._reader_thread = None
+        self._stopping = False
+
+    def start(self):
+        """
+        Create the shared memory and start the worker processes. Called on
+        the first request if not called before.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=self.slots * self.slot_bytes
+        )
+        self._free_slots = asyncio.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put_nowait(slot * self.slot_bytes)
+        self._multi_slot_lock = asyncio.Lock()
+        self._results = self._context.Queue()
+        self._workers = [self._spawn() for _ in range(self.processes)]
+        self._reader_thread = threading.Thread(
+            target=self._read_results, daemon=True
+        )
+        self._reader_thread.start()
+        logging.info(
+            f"Started {self.processes} inference processes with "
+            f"{self.slots} shared memory slots of {self.slot_bytes} bytes"
+        )
+
+    def stop(self):
+        """
+        Stop the worker processes and release the shared memory.
+        """
+        if self._shm is None:
+            return
+        self._stopping = True
+        for worker in self._workers:
+            worker["requests"].put(None)
+        for worker in self._workers:
+            worker["process"].join(timeout=5)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+        self._reader_thread.join()
+        for _, _, _, block in self._pending.values():
+            if block is not None:
+                self._release_block(block)
+        self._pending.clear()
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    async def request(self, op, client, model_name=None):
+        """
+        Run a VAD or ASR request on the least busy worker process.
+
+        Args:
+            op (str): 'vad' or 'asr'.
+            client: The client object, as for the pipelines.
+            model_name (str): The ASR model to use, for pipelines
+                              implementing `transcribe_with`.
+
+        Returns:
+            The result of the pipeline.
+
+        Raises:
+            RuntimeError: If the pipeline or the worker process failed.
+            asyncio.TimeoutError: If no result arrives within the timeout.
+        """
+        if self._shm is None:
+            self.start()
+
+        audio = client.scratch_buffer
+        offsets, block = await self._stage(audio)
+
+        self._next_id += 1
+        request_id = self._next_id
+        future = self._loop.create_future()
+        worker = min(self._workers, key=lambda worker: len(worker["pending"]))
+        worker["pending"].add(request_id)
+        self._pending[request_id] = (future, worker, offsets, block)
+        worker["requests"].put(
+            (
+                request_id,
+                op,
+                model_name,
+                describe_client(client),
+                offsets,
+                len(audio),
+                None if block is None else block.name,
+            )
+        )
+
+        start = time.time()
+        # The slot stays reserved until the result arrives, even when the
+        # request times out, since the process may still read it
+        result = await asyncio.wait_for(
+            asyncio.shield(future), self.request_timeout
+        )
+        metrics.observe(
+            "inference.process_pool.request_seconds", time.time() - start
+        )
+        return result
+
+    async def _stage(self, audio):
+        """
+        Copy the audio of a request to shared memory.
+
+        Returns:
+            tuple: The offsets of the slots holding the audio, and the
+                   block of shared memory of its own holding it instead,
+                   or None.
+        """
+        slots_needed = max(-(-len(audio) // self.slot_bytes), 1)
+        if slots_needed > self.slots:
+            size = len(audio)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            block.buf[:size] = audio
+            metrics.increment("inference.process_pool.oversized_blocks")
+            return [], block
+
+        offsets = []
+        try:
+            if slots_needed == 1:
+                offsets.append(await self._free_slots.get())
+            else:
+                # A single request at a time gathers several slots, so that
+                # two large requests cannot each hold a part of the slots
+                # the other waits for
+                async with self._multi_slot_lock:
+                    while len(offsets) < slots_needed:
+                        offsets.append(await self._free_slots.get())
+        except asyncio.CancelledError:
+            for offset in offsets:
+                self._free_slots.put_nowait(offset)
+            raise
+        start = 0
+        for offset in offsets:
+            end = min(start + self.slot_bytes, len(audio))
+            slot_end = offset + end - start
+            self._shm.buf[offset:slot_end] = audio[start:end]
+            start = end
+        metrics.set_gauge(
+            "inference.process_pool.free_slots", self._free_slots.qsize()
+        )
+        return offsets, None
+
+    @staticmethod
+    def _release_block(block):
+        block.close()
+        block.unlink()
+
+    def _spawn(self):
+        requests = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                self.create_pipelines,
+                self.pipeline_args,
+                self._shm.name,
+                self.slot_bytes,
+                requests,
+                self._results,
+            ),
+            daemon=True,
+        )
+        process.start()
+        return {"process": process, "requests": requests, "pending": set()}
+
+    def _read_results(self):
+        last_check = time.monotonic()
+        while not self._stopping:
+            try:
+                request_id, result, error = self._results.get(
+                    timeout=LIVENESS_CHECK_INTERVAL
+                )
+                self._loop.call_soon_threadsafe(
+                    self._resolve, request_id, result, error
+                )
+            except queue.Empty:
+                pass
+            if time.monotonic() - last_check >= LIVENESS_CHECK_INTERVAL:
+                last_check = time.monotonic()
+                self._loop.call_soon_threadsafe(self._check_processes)
+
+    def _resolve(self, request_id, result, error):
+        entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return
+        future, worker, offsets, block = entry
+        worker["pending"].discard(request_id)
+        for offset in offsets:
+            self._free_slots.put_nowait(offset)
+        if offsets:
+            metrics.set_gauge(
+                "inference.process_pool.free_slots",
+                self._free_slots.qsize(),
+            )
+        if block is not None:
+            self._release_block(block)
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(
+                RuntimeError(f"Inference process failed: {error}")
+            )
+
+    def _check_processes(self):
+        if self._stopping:
+            return
+        for index, worker in enumerate(self._workers):
+            if worker["process"].is_alive():
+                continue
+            logging.error(
+                f"Inference process {worker['process'].pid} exited with "
+                f"code {worker['process'].exitcode}, restarting it"
+            )
+            metrics.increment("inference.process_pool.restarts")
+            for request_id in list(worker["pending"]):
+                self._resolve(request_id, None, "the worker process exited")
+            self._workers[index] = self._spawn()
+
+
+class ProcessPoolVAD(VADInterface):
+    """
+    Detects voice activity in the worker processes of a ProcessPool.
+    """
+
+    def __init__(self, process_pool):
+        self.process_pool = process_pool
+
+    async def detect_activity(self, client):
+        return await self.process_pool.request("vad", client)
+
+
+class ProcessPoolASR(ASRInterface):
+    """
+    Transcribes in the worker processes of a ProcessPool.
+
+    Args:
+        process_pool (ProcessPool): The pool running the pipelines.
+        multiple_models (bool): Whether the pipelines of the processes serve
+                                several models, for `transcribe_with`.
+    """
+
+    def __init__(self, process_pool, multiple_models=False):
+        self.process_pool = process_pool
+        if multiple_models:
+            self.transcribe_with = self._transcribe_with
+
+    async def transcribe(self, client):
+        return await self.process_pool.request("asr", client)
+
+    async def _transcribe_with(self, model_name, client):
+        return await self.process_pool.request("asr", client, model_name)
@@ -0,0 +1,77 @@
+"""
+The wire protocol between the gateway and the inference workers.
+
+Each message is made of a fixed size prefix holding the lengths of a JSON
+header and of a binary payload, followed by the header and the payload. The
+audio of a chunk travels as the raw payload, so that it is neither base64
+encoded nor copied into the JSON document.
+"""
+
+import json
+import os
+import struct
+
+# Lengths of the JSON header and of the binary payload
+PREFIX = struct.Struct("!II")
+# Upper bound on the size of a message, to detect corrupted streams early
+MAX_MESSAGE_BYTES = 256 * 2**20
+
+
+async def read_message(reader):
+    """
+    Read a message from a stream.
+
+    Args:
+        reader (asyncio.StreamReader): The stream to read from.
+
+    Returns:
+        tuple: The decoded header (dict) and the payload (bytes).
+
+    Raises:
+        asyncio.IncompleteReadError: If the stream is closed mid-message.
+        ConnectionError: If the message is malformed.
+    """
+    header_length, payload_length = PREFIX.unpack(
+        await reader.readexactly(PREFIX.size)
+    )
+    if header_length + payload_length > MAX_MESSAGE_BYTES:
+        raise ConnectionError(
+            f"Message of {header_length + payload_length} bytes exceeds the "
+            f"limit of {MAX_MESSAGE_BYTES} bytes"
+        )
+    header = json.loads(await reader.readexactly(header_length))
+    payload = await reader.readexactly(payload_length)
+    return header, payload
+
+
+def write_message(writer, header, payload=b""):
+    """
+    Write a message to a stream. The caller is responsible for draining it.
+
+    Args:
+        writer (asyncio.StreamWriter): The stream to write to.
+        header (dict): A JSON-serializable header.
+        payload (bytes-like): The binary payload.
+    """
+    encoded_header = json.dumps(header).encode("utf-8")
+    writer.write(PREFIX.pack(len(encoded_header), len(payload)))
+    writer.write(encoded_header)
+    if payload:
+        writer.write(payload)
+
+
+def describe_client(client):
+    """
+    Return the JSON-serializable state of a client, or of a ClientSnapshot,
+    needed by the workers to process its scratch buffer.
+    """
+    chunk_id = getattr(client, "chunk_id", None)
+    if chunk_id is None:
+        chunk_id = os.path.splitext(client.get_file_name())[0]
+    return {
+        "client_id": client.client_id,
+        "chunk_id": chunk_id,
+        "config": client.config,
+        "sampling_rate": client.sampling_rate,
+        "samples_width": client.samples_width,
+    }
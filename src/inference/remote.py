@@ -0,0 +1,331 @@
+import asyncio
+import logging
+import time
+
+from src.asr.asr_interface import ASRInterface
+from src.metrics import metrics
+from src.vad.vad_interface import VADInterface
+
+from .protocol import describe_client, read_message, write_message
+
+
+class WorkerConnection:
+    """
+    A multiplexed connection to one inference worker.
+
+    Requests are tagged with an identifier and any number of them can be in
+    flight at the same time, a reader task resolving each of them when its
+    reply arrives. If the connection breaks, all its pending requests fail
+    with ConnectionError and the worker is marked unhealthy until it is
+    reconnected.
+
+    Attributes:
+        address (str): The host:port of the worker.
+        healthy (bool): Whether the worker is connected and answering.
+    """
+
+    def __init__(self, address):
+        host, _, port = address.strip().rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"Invalid inference worker address: {address}")
+        self.address = address.strip()
+        self.host = host
+        self.port = int(port)
+        self.healthy = False
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._next_id = 0
+
+    @property
+    def outstanding(self):
+        """
+        The number of requests waiting for a reply.
+        """
+        return len(self._pending)
+
+    async def connect(self):
+        reader, self._writer = await asyncio.open_connection(
+            self.host, self.port
+        )
+        self._reader_task = asyncio.create_task(self._read_replies(reader))
+        self.healthy = True
+
+    async def request(self, header, payload, timeout):
+        """
+        Send a request and wait for its reply header.
+
+        Raises:
+            ConnectionError: If the worker is not connected or the connection
+                             breaks before the reply.
+            asyncio.TimeoutError: If no reply arrives within the timeout.
+        """
+        if not self.healthy:
+            raise ConnectionError(f"Worker {self.address} is not connected")
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            write_message(self._writer, dict(header, id=request_id), payload)
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def close(self, reason="closed"):
+        """
+        Drop the connection, failing all the pending requests.
+        """
+        self.healthy = False
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if (
+            self._reader_task is not None
+            and self._reader_task is not asyncio.current_task()
+        ):
+            self._reader_task.cancel()
+        self._reader_task = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(
+                    ConnectionError(f"Worker {self.address} {reason}")
+                )
+
+    async def _read_replies(self, reader):
+        try:
+            while True:
+                header, _ = await read_message(reader)
+                future = self._pending.get(header.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(header)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.warning(f"Lost inference worker {self.address}: {e!r}")
+            self.close("disconnected")
+
+
+class WorkerPool:
+    """
+    Dispatches inference requests to a set of remote workers.
+
+    Each request goes to the healthy worker with the fewest requests in
+    flight. When a worker fails, or does not answer in time and the request
+    is cheap enough to be run twice, the request is retried on another one,
+    up to `max_retries` times. A background task
+    pings the workers periodically, reconnecting those that went away, so a
+    restarted worker is put back into rotation without restarting the
+    gateway.
+
+    Attributes:
+        workers (list): The WorkerConnection of each worker.
+        health_check_interval (float): Seconds between two health checks,
+                                       also the timeout of each ping.
+        request_timeout (float): Seconds to wait for the reply to a request.
+        max_retries (int): Number of times a failed request is retried on
+                           another worker.
+    """
+
+    def __init__(
+        self,
+        addresses,
+        health_check_interval=5.0,
+        request_timeout=60.0,
+        max_retries=2,
+    ):
+        self.workers = [
+            WorkerConnection(address) for address in addresses if address
+        ]
+        if not self.workers:
+            raise ValueError("At least one inference worker is required")
+        self.health_check_interval = health_check_interval
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self._health_task = None
+        self._health_lock = None
+
+    async def request(self, header, payload=b"", retry_timeouts=True):
+        """
+        Run a request on a worker.
+
+        Args:
+            header (dict): The header of the request.
+            payload (bytes): The audio of the request.
+            retry_timeouts (bool): Whether a request that timed out is
+                                   retried on another worker. A worker that
+                                   is slow to transcribe is probably still
+                                   at it, and retrying would only add load.
+
+        Returns:
+            The result returned by the worker.
+
+        Raises:
+            ConnectionError: If no worker could serve the request.
+            asyncio.TimeoutError: If the worker did not reply in time and
+                                  `retry_timeouts` is not set.
+            RuntimeError: If the worker failed to process the request.
+        """
+        await self._ensure_started()
+
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            worker = await self._pick(exclude=tried)
+            if worker is None:
+                break
+            if attempt > 0:
+                metrics.increment("inference.retries")
+
+            start = time.time()
+            try:
+                reply = await worker.request(
+                    header, payload, self.request_timeout
+                )
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                logging.warning(
+                    f"{header['op']} request to inference worker "
+                    f"{worker.address} failed: {e!r}"
+                )
+                metrics.increment("inference.worker_failures")
+                if isinstance(e, ConnectionError):
+                    worker.close("failed")
+                    self._update_healthy_gauge()
+                elif not retry_timeouts:
+                    raise
+                tried.add(worker)
+                last_error = e
+                continue
+            metrics.observe("inference.request_seconds", time.time() - start)
+
+            if "error" in reply:
+                raise RuntimeError(
+                    f"Inference worker {worker.address} failed to process "
+                    f"the {header['op']} request: {reply['error']}"
+                )
+            return reply["result"]
+
+        raise ConnectionError(
+            f"No inference worker could process the {header['op']} request"
+        ) from last_error
+
+    async def check_health(self):
+        """
+        Reconnect the disconnected workers and ping all of them.
+        """
+        if self._health_lock is None:
+            self._health_lock = asyncio.Lock()
+        async with self._health_lock:
+            await asyncio.gather(
+                *(self._check_worker(worker) for worker in self.workers)
+            )
+            self._update_healthy_gauge()
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for worker in self.workers:
+            worker.close()
+        self._update_healthy_gauge()
+
+    async def _check_worker(self, worker):
+        try:
+            if not worker.healthy:
+                await asyncio.wait_for(
+                    worker.connect(), self.health_check_interval
+                )
+                logging.info(f"Connected to inference worker {worker.address}")
+            await worker.request(
+                {"op": "ping"}, b"", self.health_check_interval
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            if worker.healthy:
+                logging.warning(
+                    f"Inference worker {worker.address} is unhealthy: {e!r}"
+                )
+            worker.close("unhealthy")
+
+    async def _ensure_started(self):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+            await self.check_health()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.check_health()
+            except Exception:
+                logging.exception("Inference workers health check failed")
+
+    async def _pick(self, exclude):
+        candidates = self._healthy(exclude)
+        if not candidates:
+            # The workers may have come back since the last health check
+            await self.check_health()
+            candidates = self._healthy(exclude)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda worker: worker.outstanding)
+
+    def _healthy(self, exclude):
+        return [
+            worker
+            for worker in self.workers
+            if worker.healthy and worker not in exclude
+        ]
+
+    def _update_healthy_gauge(self):
+        metrics.set_gauge(
+            "inference.workers_healthy",
+            sum(worker.healthy for worker in self.workers),
+        )
+
+
+class RemoteVAD(VADInterface):
+    """
+    Detects voice activity on the inference workers of a WorkerPool.
+    """
+
+    def __init__(self, worker_pool):
+        self.worker_pool = worker_pool
+
+    async def detect_activity(self, client):
+        return await self.worker_pool.request(
+            {"op": "vad", "client": describe_client(client)},
+            bytes(client.scratch_buffer),
+        )
+
+
+class RemoteASR(ASRInterface):
+    """
+    Transcribes on the inference workers of a WorkerPool.
+
+    The model requested by the client with the 'asr_model' config key is
+    selected by the worker, when it serves several models; `transcribe_with`
+    is only available if the workers do (see `multiple_models`). A
+    transcription that times out is not retried on another worker.
+    """
+
+    def __init__(self, worker_pool, multiple_models=False):
+        self.worker_pool = worker_pool
+        if multiple_models:
+            self.transcribe_with = self._transcribe_with
+
+    async def transcribe(self, client):
+        return await self.worker_pool.request(
+            {"op": "asr", "client": describe_client(client)},
+            bytes(client.scratch_buffer),
+            retry_timeouts=False,
+        )
+
+    async def _transcribe_with(self, model_name, client):
+        return await self.worker_pool.request(
+            {
+                "op": "asr",
+                "model": model_name,
+                "client": describe_client(client),
+            },
+            bytes(client.scratch_buffer),
+            retry_timeouts=False,
+        )
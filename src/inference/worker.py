@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import json
+import logging
+
+from src.client import ClientSnapshot
+from src.pipelines import add_pipeline_arguments, create_pipelines
+
+from .protocol import read_message, write_message
+
+
+class InferenceWorker:
+    """
+    Runs the VAD and ASR pipelines on behalf of one or more gateways.
+
+    A gateway is a VoiceStreamAI server started with --inference-workers: it
+    terminates the WebSocket connections, buffers the audio and forwards
+    each chunk to a worker over a plain TCP connection. Workers hold the
+    models, so they can be scaled, placed on GPU hosts and restarted
+    independently of the connections of the clients.
+
+    Requests received on a connection are processed concurrently and each
+    reply carries the identifier of its request, so one gateway connection
+    can have many chunks in flight.
+
+    Attributes:
+        vad_pipeline: The voice activity detection pipeline.
+        asr_pipeline: The automatic speech recognition pipeline.
+        host (str): The host address to listen on.
+        port (int): The port to listen on.
+    """
+
+    def __init__(self, vad_pipeline, asr_pipeline, host, port):
+        self.vad_pipeline = vad_pipeline
+        self.asr_pipeline = asr_pipeline
+        self.host = host
+        self.port = port
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port
+        )
+        logging.info(f"Inference worker listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in self._connections:
+                writer.close()
+            await self._server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        logging.info(f"Gateway {peer} connected")
+        write_lock = asyncio.Lock()
+        tasks = set()
+        self._connections.add(writer)
+        try:
+            while True:
+                header, payload = await read_message(reader)
+                task = asyncio.create_task(
+                    self.handle_request(header, payload, writer, write_lock)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.info(f"Gateway {peer} disconnected: {e!r}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._connections.discard(writer)
+            writer.close()
+
+    async def handle_request(self, header, payload, writer, write_lock):
+        try:
+            result = await self.run(header, payload)
+            reply = {"id": header["id"], "result": result}
+        except Exception as e:
+            logging.exception(f"Failed to process {header.get('op')} request")
+            reply = {"id": header.get("id"), "error": repr(e)}
+
+        async with write_lock:
+            try:
+                write_message(writer, reply)
+                await writer.drain()
+            except ConnectionError:
+                logging.warning("Gateway disconnected before the reply")
+
+    async def run(self, header, payload):
+        op = header["op"]
+        if op == "ping":
+            return "pong"
+
+        snapshot = ClientSnapshot.from_description(header["client"], payload)
+        if op == "vad":
+            return await self.vad_pipeline.detect_activity(snapshot)
+        if op == "asr":
+            model_name = header.get("model")
+            if model_name is None:
+                return await self.asr_pipeline.transcribe(snapshot)
+            if not hasattr(self.asr_pipeline, "transcribe_with"):
+                raise ValueError(
+                    f"Model {model_name} requested, but the worker does not "
+                    "serve several models"
+                )
+            return await self.asr_pipeline.transcribe_with(
+                model_name, snapshot
+            )
+        raise ValueError(f"Unknown operation: {op}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="VoiceStreamAI inference worker: runs the VAD and ASR "
+        "pipelines for one or more gateway servers."
+    )
+    add_pipeline_arguments(parser)
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Host to listen on for gateway connections",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8766,
+        help="Port to listen on for gateway connections",
+    )
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        default="error",
+        choices=["debug", "info", "warning", "error"],
+        help="Logging level: debug, info, warning, error. default: error",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    logging.basicConfig()
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    try:
+        vad_pipeline, asr_pipeline = create_pipelines(args)
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON arguments: {e}")
+        return
+
+    worker = InferenceWorker(vad_pipeline, asr_pipeline, args.host, args.port)
+    asyncio.get_event_loop().run_until_complete(worker.start())
+    asyncio.get_event_loop().run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import struct
+import time
+
+from src.metrics import metrics
+
+# The header of the binary frames of the 'sequenced' framing: the sequence
+# number of the frame and the time it was captured, in seconds since the
+# epoch on the client's clock
+FRAME_HEADER = struct.Struct("!Id")
+FRAMINGS = ("raw", "sequenced")
+
+
+class JitterBuffer:
+    """
+    Restores the order of the sequenced frames of a client.
+
+    Frames arriving ahead of a missing one are held until it arrives. When
+    more than `depth` frames are held, the missing frame is declared lost
+    and, if `fill_gaps` is set, replaced with silence of the length of the
+    previous frame, so that the timing of the audio is kept; at most
+    `max_gap_frames` frames of silence fill a single gap. Duplicated frames,
+    and frames arriving after being declared lost, are dropped. The lost,
+    late, duplicated and out of order frames are counted in the `jitter.*`
+    metrics.
+
+    Attributes:
+        depth (int): The maximum number of frames held while waiting for a
+                     missing one.
+        fill_gaps (bool): Whether lost frames are replaced with silence,
+                          which requires uncompressed audio.
+        max_gap_frames (int): The maximum number of frames of silence
+                              filling a gap.
+        next_sequence (int): The sequence number of the next frame to
+                             deliver, or None before the first frame.
+    """
+
+    def __init__(self, depth=3, fill_gaps=True, max_gap_frames=50):
+        self.depth = depth
+        self.fill_gaps = fill_gaps
+        self.max_gap_frames = max_gap_frames
+        self.next_sequence = None
+        self._held = {}
+        self._frame_size = 0
+
+    def push(self, frame):
+        """
+        Add a frame received from the client.
+
+        Args:
+            frame (bytes): The header followed by the audio.
+
+        Returns:
+            list: The (capture time, audio) of the frames that can be
+                  processed, in order. The capture time of silence filling
+                  a gap is None.
+
+        Raises:
+            ValueError: If the frame is shorter than the header.
+        """
+        if len(frame) < FRAME_HEADER.size:
+            raise ValueError("Frame shorter than its sequence header")
+        sequence, capture_time = FRAME_HEADER.unpack_from(frame)
+        header_size = FRAME_HEADER.size
+        audio = frame[header_size:]
+
+        if self.next_sequence is None:
+            self.next_sequence = sequence
+        if sequence < self.next_sequence:
+            metrics.increment("jitter.late")
+            return []
+        if sequence in self._held:
+            metrics.increment("jitter.duplicates")
+            return []
+        if sequence > self.next_sequence:
+            metrics.increment("jitter.out_of_order")
+        self._held[sequence] = (capture_time, audio)
+
+        ready = []
+        while self._held:
+            held = self._held.pop(self.next_sequence, None)
+            if held is not None:
+                ready.append(held)
+                self._frame_size = len(held[1])
+                self.next_sequence += 1
+            elif len(self._held) > self.depth:
+                self._skip_gap(ready)
+            else:
+                break
+        return ready
+
+    def _skip_gap(self, ready):
+        # Jump to the first frame held, in one step however long the gap
+        first = min(self._held)
+        lost = first - self.next_sequence
+        metrics.increment("jitter.lost", lost)
+        if self.fill_gaps and self._frame_size:
+            silence = bytes(self._frame_size)
+            ready.extend(
+                (None, silence) for _ in range(min(lost, self.max_gap_frames))
+            )
+        self.next_sequence = first
+
+
+class ClockSync:
+    """
+    Estimates the offset of the clock of a client from the server's.
+
+    The server sends a 'clock_sync' message with its time, which the client
+    echoes at once with its own time. Assuming the echo was sent halfway
+    through the round trip, the offset is the client time minus the middle
+    of the round trip. The estimate of the shortest of the recent round
+    trips, the least affected by queueing, is kept.
+
+    Attributes:
+        interval (float): The seconds between two pings.
+        offset (float): The client clock minus the server clock, in
+                        seconds, or None until the first echo.
+        round_trip (float): The round trip of the kept estimate.
+    """
+
+    def __init__(self, interval=30.0, samples=8):
+        self.interval = interval
+        self.offset = None
+        self.round_trip = None
+        self._samples = []
+        self._max_samples = samples
+        self._pinged_at = None
+
+    def ping_due(self):
+        return (
+            self._pinged_at is None
+            or time.time() - self._pinged_at >= self.interval
+        )
+
+    def ping(self):
+        """
+        Return the message to send to the client.
+        """
+        self._pinged_at = time.time()
+        return {"type": "clock_sync", "server_time": self._pinged_at}
+
+    def on_echo(self, message):
+        """
+        Update the estimate with the echo of a ping.
+
+        Raises:
+            ValueError: If the echo does not carry the times.
+        """
+        received = time.time()
+        try:
+            sent = float(message["server_time"])
+            client_time = float(message["client_time"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Invalid clock_sync echo")
+        round_trip = received - sent
+        if round_trip < 0:
+            raise ValueError("Invalid clock_sync echo")
+
+        offset = client_time - (sent + received) / 2
+        self._samples.append((round_trip, offset))
+        if len(self._samples) > self._max_samples:
+            self._samples.pop(0)
+        self.round_trip, self.offset = min(self._samples)
+        metrics.observe("clock_sync.round_trip", round_trip)
+
+    def to_server_time(self, client_time):
+        """
+        Convert a time of the client's clock to the server's, or return None
+        if the offset is not known yet.
+        """
+        if self.offset is None or client_time is None:
+            return None
+        return client_time - self.offset
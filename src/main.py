@@ -1,12 +1,46 @@
+# isort: skip_file
+
 import argparse
 import asyncio
 import json
 import logging
+import signal
 
-from src.asr.asr_factory import ASRFactory
-from src.vad.vad_factory import VADFactory
+from src.asr.asr_model_pool import MODEL_ARGUMENTS
+from src.asr.cached_asr import CachedASR
+from src.asr.packing_asr import PackingASR
+from src.buffering_strategy.buffering_strategies import DEFAULT_DRAFT_MODEL
+from src.inference.process_pool import (
+    ProcessPool,
+    ProcessPoolASR,
+    ProcessPoolVAD,
+)
+from src.inference.remote import RemoteASR, RemoteVAD, WorkerPool
+from src.pipelines import add_pipeline_arguments, create_pipelines
 
+from .memory_limits import POLICIES, MemoryLimiter
+from .overload import OverloadController
+from .processing_pipeline import ProcessingPipeline
+from .profiling import ChunkProfiler
 from .server import Server
+from .session_recorder import SessionRecorder
+from .traffic_capture import TrafficCapture
+
+
+def served_asr_models(args):
+    """
+    Return the models of the ASR model pool, which the clients may select,
+    or None without a pool or when it is run by remote workers.
+    """
+    if not args.asr_models or args.inference_workers:
+        return None
+    models = args.asr_models.split(",")
+    default_model = json.loads(args.asr_args).get(
+        MODEL_ARGUMENTS.get(args.asr_type)
+    )
+    if default_model is not None and default_model not in models:
+        models.insert(0, default_model)
+    return models
 
 
 def parse_args():
@@ -14,29 +48,96 @@ def parse_args():
         description="VoiceStreamAI Server: Real-time audio transcription "
         "using self-hosted Whisper and WebSocket."
     )
+    add_pipeline_arguments(parser)
     parser.add_argument(
-        "--vad-type",
+        "--inference-workers",
         type=str,
-        default="pyannote",
-        help="Type of VAD pipeline to use (e.g., 'pyannote')",
+        default=None,
+        help="Comma separated list of host:port of inference workers (see "
+        "src.inference.worker). When set, the server acts as a gateway and "
+        "forwards the audio to the workers instead of loading the VAD and "
+        "ASR models itself",
     )
     parser.add_argument(
-        "--vad-args",
-        type=str,
-        default='{"auth_token": "huggingface_token"}',
-        help="JSON string of additional arguments for VAD pipeline",
+        "--inference-processes",
+        type=int,
+        default=0,
+        help="Run the VAD and ASR pipelines in this number of worker "
+        "processes, each loading its own copy of the models, instead of in "
+        "the server process. default: 0, disabled",
+    )
+    parser.add_argument(
+        "--asr-cache-entries",
+        type=int,
+        default=0,
+        help="Cache up to this number of transcriptions by audio content, "
+        "to serve repeated audio without running the ASR again. default: 0, "
+        "disabled",
+    )
+    parser.add_argument(
+        "--asr-cache-mb",
+        type=float,
+        default=64,
+        help="Maximum size of the cached transcriptions. default: 64",
     )
     parser.add_argument(
-        "--asr-type",
+        "--pack-utterances",
+        action="store_true",
+        help="Transcribe the short utterances transcribed at the same time "
+        "together, concatenated into a single Whisper window, and split the "
+        "words back to each of them",
+    )
+    parser.add_argument(
+        "--pack-args",
         type=str,
-        default="faster_whisper",
-        help="Type of ASR pipeline to use (e.g., 'whisper')",
+        default="{}",
+        help="JSON string of arguments of the utterance packing: "
+        "'window_seconds', 'gap_seconds', 'max_utterance_seconds' and "
+        "'max_wait'",
+    )
+    parser.add_argument(
+        "--vad-workers",
+        type=int,
+        default=1,
+        help="Number of chunks analyzed by the VAD at the same time. "
+        "default: 1",
+    )
+    parser.add_argument(
+        "--asr-workers",
+        type=int,
+        default=4,
+        help="Number of chunks transcribed at the same time; raise it with "
+        "--inference-workers or --inference-processes. default: 4",
+    )
+    parser.add_argument(
+        "--stage-queue-size",
+        type=int,
+        default=64,
+        help="Maximum number of chunks waiting for each processing stage. "
+        "default: 64",
+    )
+    parser.add_argument(
+        "--no-pipeline",
+        action="store_true",
+        help="Process each chunk in a task of its own, the VAD and the ASR "
+        "of a client running one after the other, instead of in the "
+        "pipelined stages",
+    )
+    parser.add_argument(
+        "--overload-control",
+        action="store_true",
+        help="Degrade the quality of the transcriptions step by step when "
+        "the server is overloaded (greedy decoding, no word timestamps, "
+        "longer chunks by default), and restore it when the load drops",
     )
     parser.add_argument(
-        "--asr-args",
+        "--overload-args",
         type=str,
-        default='{"model_size": "large-v3"}',
-        help="JSON string of additional arguments for ASR pipeline",
+        default="{}",
+        help="JSON string of arguments of the overload controller: 'levels' "
+        "(list of client config overrides), 'small_model' (a model of "
+        "--asr-models for the default levels), 'rtf_high', 'rtf_low', "
+        "'queue_wait_high', 'queue_wait_low' and 'hold_seconds'",
     )
     parser.add_argument(
         "--host",
@@ -67,6 +168,126 @@ def parse_args():
         choices=["debug", "info", "warning", "error"],
         help="Logging level: debug, info, warning, error. default: error",
     )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30.0,
+        help="On SIGTERM, seconds given to the sessions to transcribe and "
+        "deliver the audio they sent before they are closed. default: 30",
+    )
+    parser.add_argument(
+        "--reconnect-spread",
+        type=float,
+        default=5.0,
+        help="Maximum delay, in seconds, after which the clients of a "
+        "draining server are asked to reconnect, spreading their "
+        "reconnections. default: 5",
+    )
+    parser.add_argument(
+        "--send-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds to wait for the delivery of each result to a client "
+        "before giving up on it",
+    )
+    parser.add_argument(
+        "--outbound-queue-size",
+        type=int,
+        default=64,
+        help="Maximum number of results waiting for delivery to each client, "
+        "the oldest draft or segment is dropped beyond it",
+    )
+    parser.add_argument(
+        "--max-streams",
+        type=int,
+        default=64,
+        help="Maximum number of open streams of a multiplexed connection",
+    )
+    parser.add_argument(
+        "--session-memory-mb",
+        type=float,
+        default=None,
+        help="Maximum memory held by each session: buffered audio, chunks "
+        "being processed and results waiting for delivery. default: None, "
+        "no limit",
+    )
+    parser.add_argument(
+        "--memory-limit-mb",
+        type=float,
+        default=None,
+        help="Maximum memory held by all the sessions; the sessions holding "
+        "the most are closed beyond it. default: None, no limit",
+    )
+    parser.add_argument(
+        "--memory-policy",
+        type=str,
+        default="trim",
+        choices=POLICIES,
+        help="What to do with a session above --session-memory-mb: drop its "
+        "oldest buffered audio, or close it. default: trim",
+    )
+    parser.add_argument(
+        "--capture-dir",
+        type=str,
+        default=None,
+        help="Capture the traffic of every session (frames, config messages "
+        "and results, with their timing) to this directory, to replay it "
+        "with src.replay. default: None, disabled",
+    )
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=0,
+        help="Profile one audio chunk every N chunks with cProfile and dump "
+        "the statistics to --profile-dir. default: 0 (disabled)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=str,
+        default="profiles",
+        help="Directory where the sampled profiles are saved",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also trace the allocations of the sampled chunks with "
+        "tracemalloc",
+    )
+    parser.add_argument(
+        "--record-dir",
+        type=str,
+        default=None,
+        help="Directory where the audio and transcriptions of every session "
+        "are archived. default: None (recording disabled)",
+    )
+    parser.add_argument(
+        "--record-format",
+        type=str,
+        default="flac",
+        choices=["flac", "wav"],
+        help="Audio format of the recorded sessions. default: flac",
+    )
+    parser.add_argument(
+        "--record-rotate-seconds",
+        type=float,
+        default=300,
+        help="Maximum duration of each recorded audio file. default: 300",
+    )
+    parser.add_argument(
+        "--record-queue-size",
+        type=int,
+        default=256,
+        help="Maximum number of recording requests waiting to be written. "
+        "default: 256",
+    )
+    parser.add_argument(
+        "--record-overflow",
+        type=str,
+        default="drop",
+        choices=["drop", "block"],
+        help="What to do when the recording queue is full: drop the audio, "
+        "or hold back the receiving of that client's audio. default: drop",
+    )
     return parser.parse_args()
 
 
@@ -76,15 +297,143 @@ def main():
     logging.basicConfig()
     logging.getLogger().setLevel(args.log_level.upper())
 
-    try:
-        vad_args = json.loads(args.vad_args)
-        asr_args = json.loads(args.asr_args)
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON arguments: {e}")
-        return
+    worker_pool = None
+    process_pool = None
+    if args.inference_workers:
+        worker_pool = WorkerPool(args.inference_workers.split(","))
+        vad_pipeline = RemoteVAD(worker_pool)
+        asr_pipeline = RemoteASR(
+            worker_pool, multiple_models=bool(args.asr_models)
+        )
+    elif args.inference_processes > 0:
+        try:
+            json.loads(args.vad_args)
+            json.loads(args.asr_args)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON arguments: {e}")
+            return
+        process_pool = ProcessPool(
+            create_pipelines, args, processes=args.inference_processes
+        )
+        vad_pipeline = ProcessPoolVAD(process_pool)
+        asr_pipeline = ProcessPoolASR(
+            process_pool, multiple_models=bool(args.asr_models)
+        )
+    else:
+        try:
+            vad_pipeline, asr_pipeline = create_pipelines(args)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON arguments: {e}")
+            return
+
+    if args.pack_utterances:
+        try:
+            asr_pipeline = PackingASR(
+                asr_pipeline, **json.loads(args.pack_args)
+            )
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON arguments: {e}")
+            return
+        except (TypeError, ValueError) as e:
+            print(f"Invalid --pack-args: {e}")
+            return
+        if not args.no_pipeline and args.asr_workers < 2:
+            logging.warning(
+                "Utterances are only packed when several are transcribed "
+                "at the same time, raise --asr-workers"
+            )
 
-    vad_pipeline = VADFactory.create_vad_pipeline(args.vad_type, **vad_args)
-    asr_pipeline = ASRFactory.create_asr_pipeline(args.asr_type, **asr_args)
+    if args.asr_cache_entries > 0:
+        asr_pipeline = CachedASR(
+            asr_pipeline,
+            max_entries=args.asr_cache_entries,
+            max_bytes=int(args.asr_cache_mb * 2**20),
+        )
+
+    profiler = None
+    if args.profile_every > 0:
+        profiler = ChunkProfiler(
+            args.profile_every,
+            output_dir=args.profile_dir,
+            trace_memory=args.profile_memory,
+        )
+
+    recorder = None
+    if args.record_dir:
+        try:
+            recorder = SessionRecorder(
+                args.record_dir,
+                audio_format=args.record_format,
+                rotate_seconds=args.record_rotate_seconds,
+                max_queue_size=args.record_queue_size,
+                overflow_policy=args.record_overflow,
+            )
+        except ValueError as e:
+            print(f"Invalid recording arguments: {e}")
+            return
+
+    capture = None
+    if args.capture_dir:
+        capture = TrafficCapture(args.capture_dir)
+
+    pipeline = None
+    if not args.no_pipeline:
+        pipeline = ProcessingPipeline(
+            vad_workers=args.vad_workers,
+            asr_workers=args.asr_workers,
+            queue_size=args.stage_queue_size,
+        )
+        try:
+            batch_wait_ms = json.loads(args.vad_args).get("batch_wait_ms", 0)
+        except (AttributeError, json.JSONDecodeError):
+            # Reported when the pipelines are created
+            batch_wait_ms = 0
+        if args.vad_workers < 2 and batch_wait_ms > 0:
+            logging.warning(
+                "VAD batches only gather the chunks analyzed at the same "
+                "time, raise --vad-workers"
+            )
+
+    overload = None
+    if args.overload_control:
+        try:
+            overload_args = json.loads(args.overload_args)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON arguments: {e}")
+            return
+        # The models of a pool run by remote workers are not known here
+        models = None
+        if not args.inference_workers:
+            models = args.asr_models.split(",") if args.asr_models else []
+        try:
+            overload = OverloadController(models=models, **overload_args)
+        except (TypeError, ValueError) as e:
+            print(f"Invalid --overload-args: {e}")
+            return
+
+    memory_limiter = None
+    if args.session_memory_mb or args.memory_limit_mb:
+        memory_limiter = MemoryLimiter(
+            session_max_bytes=(
+                None
+                if args.session_memory_mb is None
+                else int(args.session_memory_mb * 2**20)
+            ),
+            global_max_bytes=(
+                None
+                if args.memory_limit_mb is None
+                else int(args.memory_limit_mb * 2**20)
+            ),
+            policy=args.memory_policy,
+        )
+
+    asr_models = served_asr_models(args)
+    if asr_models is not None and DEFAULT_DRAFT_MODEL not in asr_models:
+        logging.warning(
+            f"The default draft model {DEFAULT_DRAFT_MODEL} is not in "
+            "--asr-models, the clients of the speculative strategy must set "
+            "their 'draft_model'"
+        )
 
     server = Server(
         vad_pipeline,
@@ -95,10 +444,40 @@ def main():
         samples_width=2,
         certfile=args.certfile,
         keyfile=args.keyfile,
+        profiler=profiler,
+        recorder=recorder,
+        send_timeout=args.send_timeout,
+        outbound_queue_size=args.outbound_queue_size,
+        capture=capture,
+        pipeline=pipeline,
+        overload=overload,
+        memory_limiter=memory_limiter,
+        asr_models=asr_models,
+        max_streams=args.max_streams,
     )
 
-    asyncio.get_event_loop().run_until_complete(server.start())
-    asyncio.get_event_loop().run_forever()
+    loop = asyncio.get_event_loop()
+    websocket_server = loop.run_until_complete(server.start())
+    # SIGTERM, sent by process managers to stop the server, drains it first
+    terminated = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, terminated.set)
+    loop.run_until_complete(terminated.wait())
+
+    loop.run_until_complete(
+        server.drain(args.drain_timeout, args.reconnect_spread)
+    )
+    websocket_server.close()
+    loop.run_until_complete(websocket_server.wait_closed())
+    if pipeline is not None:
+        pipeline.close()
+    if recorder is not None:
+        recorder.stop()
+    if capture is not None:
+        capture.stop()
+    if worker_pool is not None:
+        loop.run_until_complete(worker_pool.close())
+    if process_pool is not None:
+        process_pool.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+import logging
+import time
+
+from src.metrics import metrics
+
+POLICIES = ("trim", "close")
+
+
+def memory_stats(clients, largest=5):
+    """
+    Return the memory held by a set of sessions, as exposed on the /stats
+    endpoint: the total of each kind of usage (see Client.memory_usage) and
+    the sessions holding the most.
+    """
+    totals = {}
+    sessions = []
+    for client in clients:
+        usage = client.memory_usage()
+        for name, value in usage.items():
+            totals[name] = totals.get(name, 0) + value
+        sessions.append((usage["total"], client.client_id))
+    sessions.sort(reverse=True)
+    metrics.set_gauge("memory.total_bytes", totals.get("total", 0))
+    return {
+        "total": totals,
+        "largest_sessions": [
+            {"client_id": client_id, "bytes": total}
+            for total, client_id in sessions[:largest]
+        ],
+    }
+
+
+class MemoryLimiter:
+    """
+    Enforces limits on the memory held by the sessions.
+
+    The memory of a session is the audio of its buffers, the audio held by
+    its buffering strategy, the snapshots of its chunks being processed and
+    its results waiting for delivery (see Client.memory_usage). A session
+    above `session_max_bytes`, for example because the VAD never finds the
+    end of its speech, either has the oldest audio of its buffers dropped
+    (policy 'trim'), or is closed (policy 'close'); it is also closed when
+    trimming its buffers is not enough. When all the sessions together hold
+    more than `global_max_bytes`, the sessions holding the most are closed
+    until the total is back under the limit. The trimmed bytes and the
+    closed sessions are reported in the `memory.*` metrics.
+
+    Attributes:
+        session_max_bytes (int): The maximum memory of a session, or None
+                                 for no limit.
+        global_max_bytes (int): The maximum memory of all the sessions, or
+                                None for no limit.
+        policy (str): 'trim' or 'close'.
+        check_interval (float): The minimum time, in seconds, between two
+                                checks of the global limit.
+    """
+
+    def __init__(
+        self,
+        session_max_bytes=None,
+        global_max_bytes=None,
+        policy="trim",
+        check_interval=0.5,
+        clock=time.monotonic,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown memory policy: {policy}")
+        self.session_max_bytes = session_max_bytes
+        self.global_max_bytes = global_max_bytes
+        self.policy = policy
+        self.check_interval = check_interval
+        self.clock = clock
+        self._checked_at = None
+
+    def check_session(self, client):
+        """
+        Enforce the limit of a session, trimming its buffers if the policy
+        allows it.
+
+        Returns:
+            bool: Whether the session is within its limit; if not, it must
+                  be closed.
+        """
+        if self.session_max_bytes is None:
+            return True
+        excess = client.memory_usage()["total"] - self.session_max_bytes
+        if excess <= 0:
+            return True
+        if self.policy == "trim":
+            excess -= self._trim(client, excess)
+        if excess > 0:
+            metrics.increment("memory.sessions_closed.session")
+            logging.warning(
+                f"Client {client.client_id} exceeds its memory limit of "
+                f"{self.session_max_bytes} bytes"
+            )
+            return False
+        return True
+
+    def select_evictions(self, clients):
+        """
+        Select the sessions to close to bring the memory of all of them
+        under the global limit. The limit is checked at most every
+        `check_interval` seconds.
+
+        Returns:
+            list: The clients to close, holding the most memory first.
+        """
+        if self.global_max_bytes is None:
+            return []
+        now = self.clock()
+        if (
+            self._checked_at is not None
+            and now - self._checked_at < self.check_interval
+        ):
+            return []
+        self._checked_at = now
+
+        sessions = [
+            (client.memory_usage()["total"], client) for client in clients
+        ]
+        total = sum(usage for usage, _ in sessions)
+        evicted = []
+        for usage, client in sorted(
+            sessions, key=lambda session: session[0], reverse=True
+        ):
+            if total <= self.global_max_bytes:
+                break
+            evicted.append(client)
+            total -= usage
+        if evicted:
+            metrics.increment("memory.sessions_closed.global", len(evicted))
+            logging.warning(
+                f"The sessions exceed the memory limit of "
+                f"{self.global_max_bytes} bytes, closing {len(evicted)}"
+            )
+        return evicted
+
+    def stats(self):
+        return {
+            "session_max_bytes": self.session_max_bytes,
+            "global_max_bytes": self.global_max_bytes,
+            "policy": self.policy,
+        }
+
+    @staticmethod
+    def _trim(client, excess):
+        # Drop whole samples of the oldest audio, from the scratch buffer
+        # unless the VAD is reading it, then from the buffer
+        width = client.samples_width
+        excess += -excess % width
+        trimmed = 0
+        buffers = [client.buffer]
+        if not getattr(client.buffering_strategy, "processing_flag", False):
+            buffers.insert(0, client.scratch_buffer)
+        for buffer in buffers:
+            size = min(excess - trimmed, len(buffer) - len(buffer) % width)
+            del buffer[:size]
+            trimmed += size
+        if trimmed:
+            metrics.increment("memory.trimmed_bytes", trimmed)
+        return trimmed
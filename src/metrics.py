@@ -0,0 +1,105 @@
+import threading
+from collections import deque
+
+
+class Metrics:
+    """
+    A minimal, thread-safe registry of server metrics.
+
+    Components record counters (monotonically increasing values), gauges
+    (current values) and summaries (observations such as latencies, for
+    which the count, mean, exponentially weighted moving average and
+    percentiles over a recent window are reported). The whole registry is
+    exposed by the server on its stats surface.
+    """
+
+    def __init__(self, window_size=1024, ewma_alpha=0.2):
+        self.window_size = window_size
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def adjust_gauge(self, name, delta):
+        """
+        Add `delta` to a gauge, missing gauges starting from 0.
+
+        Returns:
+            The new value of the gauge.
+        """
+        with self._lock:
+            value = self._gauges.get(name, 0) + delta
+            self._gauges[name] = value
+            return value
+
+    def remove_gauge(self, name):
+        with self._lock:
+            self._gauges.pop(name, None)
+
+    def observe(self, name, value):
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "ewma": value,
+                    "window": deque(maxlen=self.window_size),
+                }
+                self._summaries[name] = summary
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["ewma"] += self.ewma_alpha * (value - summary["ewma"])
+            summary["window"].append(value)
+
+    def get_counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def get_gauge(self, name, default=None):
+        with self._lock:
+            return self._gauges.get(name, default)
+
+    def get_ewma(self, name, default=None):
+        """
+        Return the exponentially weighted moving average of a summary, or
+        `default` if nothing was observed yet.
+        """
+        with self._lock:
+            summary = self._summaries.get(name)
+            return default if summary is None else summary["ewma"]
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable copy of all the metrics.
+        """
+        with self._lock:
+            summaries = {}
+            for name, summary in self._summaries.items():
+                window = sorted(summary["window"])
+                summaries[name] = {
+                    "count": summary["count"],
+                    "mean": summary["sum"] / summary["count"],
+                    "ewma": summary["ewma"],
+                    "p50": window[int(0.5 * (len(window) - 1))],
+                    "p99": window[int(0.99 * (len(window) - 1))],
+                    "max": window[-1],
+                }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": summaries,
+            }
+
+
+# The registry shared by all the components of the server process
+metrics = Metrics()
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+from src.metrics import metrics
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Message types that are superseded by any later message of the same chunk
+PARTIAL_TYPES = ("draft", "partial")
+# Message types that can be dropped when the queue is full, since a later
+# result of their chunk carries their text
+EVICTABLE_TYPES = PARTIAL_TYPES + ("segment",)
+ENCODINGS = ("json", "msgpack")
+
+
+def check_encoding(encoding):
+    """
+    Raises:
+        ValueError: If the result encoding is unknown or msgpack is not
+                    installed.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown result encoding: {encoding}")
+    if encoding == "msgpack" and msgpack is None:
+        raise ValueError("The msgpack encoding requires msgpack")
+
+
+class OutboundQueue:
+    """
+    Delivers the results to a client from a dedicated writer task.
+
+    The processing tasks only enqueue their results, so a slow or stalled
+    client delays its own deliveries but never the inference of its next
+    chunks, nor the other clients. While waiting in the queue, a draft or
+    partial result is replaced by any later result of the same chunk, and
+    the segments of a chunk are superseded by its final result, so a
+    lagging client receives the latest state instead of every intermediate
+    one. A segment never replaces another segment, since each carries its
+    own part of the text. Each send is bounded by a timeout.
+    When the queue is full, the oldest draft, partial result or segment is
+    dropped; final results are never dropped, the queue grows beyond
+    `max_size` instead, bounded by the memory limits of the session.
+
+    Results are sent as JSON text frames, or as msgpack binary frames if
+    the client negotiated it and the msgpack package is installed.
+
+    Attributes:
+        websocket: The WebSocket connection of the client.
+        send_timeout (float): Seconds to wait for each send to complete.
+        max_size (int): The maximum number of queued results.
+        encoding (str): 'json' or 'msgpack'.
+        tags (dict): Keys added to every result, such as the stream id of
+                     a multiplexed connection.
+        queued_bytes (int): The size of the queued results, measured as
+                            their JSON encoding.
+    """
+
+    def __init__(self, websocket, send_timeout=5.0, max_size=64, tags=None):
+        self.websocket = websocket
+        self.tags = tags
+        self.send_timeout = send_timeout
+        self.max_size = max_size
+        self.encoding = "json"
+        self.queued_bytes = 0
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._sending = False
+        self._writer_task = asyncio.create_task(self._write())
+
+    def set_encoding(self, encoding):
+        """
+        Select the encoding of the following results.
+
+        Raises:
+            ValueError: If the encoding is unknown or msgpack is not
+                        installed.
+        """
+        check_encoding(encoding)
+        self.encoding = encoding
+
+    def put(self, message):
+        """
+        Enqueue a result, without waiting for its delivery.
+
+        Args:
+            message (dict): A JSON-serializable result, identified by its
+                            'chunk_id' for coalescing.
+        """
+        if self.tags:
+            message.update(self.tags)
+        size = len(json.dumps(message))
+        chunk_id = message.get("chunk_id")
+        if chunk_id is not None and self._coalesce(message, chunk_id, size):
+            return
+
+        if len(self._queue) >= self.max_size:
+            self._evict()
+        self._queue.append((message, time.time(), size))
+        self.queued_bytes += size
+        self._ready.set()
+
+    def _coalesce(self, message, chunk_id, size):
+        """
+        Put the message in place of the queued results of its chunk it
+        supersedes, if any.
+
+        Returns:
+            bool: Whether the message was queued.
+        """
+        if message.get("type") in EVICTABLE_TYPES:
+            superseded = PARTIAL_TYPES
+        else:
+            # A final result also carries the text of the segments
+            superseded = EVICTABLE_TYPES
+        position = None
+        kept = deque()
+        for queued, enqueued, queued_size in self._queue:
+            if (
+                queued.get("chunk_id") == chunk_id
+                and queued.get("type") in superseded
+            ):
+                self.queued_bytes -= queued_size
+                metrics.increment("outbound.coalesced")
+                if position is None:
+                    # The message takes the place of the first one
+                    position = len(kept)
+                    kept.append((message, enqueued, size))
+                    self.queued_bytes += size
+            else:
+                kept.append((queued, enqueued, queued_size))
+        if position is None:
+            return False
+        self._queue = kept
+        return True
+
+    def _evict(self):
+        for i, (queued, _, queued_size) in enumerate(self._queue):
+            if queued.get("type") in EVICTABLE_TYPES:
+                del self._queue[i]
+                self.queued_bytes -= queued_size
+                metrics.increment("outbound.dropped")
+                logging.warning(
+                    f"Outbound queue full, dropped a {queued['type']} "
+                    f"result of chunk {queued.get('chunk_id')}"
+                )
+                return
+        metrics.increment("outbound.overflows")
+
+    async def flush(self, timeout=None):
+        """
+        Wait until all the queued results have been sent, or the timeout.
+        """
+        try:
+            await asyncio.wait_for(self._drained(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def clear(self):
+        """
+        Drop the queued results.
+        """
+        self._queue.clear()
+        self.queued_bytes = 0
+
+    def close(self):
+        self._writer_task.cancel()
+
+    async def _drained(self):
+        while self._queue or self._sending:
+            await asyncio.sleep(0.01)
+
+    def _encode(self, message):
+        if self.encoding == "msgpack":
+            return msgpack.packb(message)
+        return json.dumps(message)
+
+    async def _write(self):
+        while True:
+            await self._ready.wait()
+            if not self._queue:
+                self._ready.clear()
+                continue
+
+            message, enqueued, size = self._queue.popleft()
+            self.queued_bytes -= size
+            self._sending = True
+            start = time.time()
+            metrics.observe("outbound.queue_seconds", start - enqueued)
+            try:
+                await asyncio.wait_for(
+                    self.websocket.send(self._encode(message)),
+                    self.send_timeout,
+                )
+                metrics.observe("outbound.send_seconds", time.time() - start)
+            except asyncio.TimeoutError:
+                metrics.increment("outbound.send_timeouts")
+                logging.warning(
+                    f"Sending chunk {message.get('chunk_id')} timed out "
+                    f"after {self.send_timeout}s"
+                )
+            except Exception as e:
+                # The connection is closed: the server ends the session
+                logging.debug(f"Failed to send a result: {e!r}")
+            finally:
+                self._sending = False
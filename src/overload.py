@@ -0,0 +1,175 @@
+import logging
+import time
+
+from src.metrics import metrics
+
+
+def default_levels(small_model=None):
+    """
+    Return the levels stepped through under load, after the full quality
+    level 0: greedy decoding, then no word timestamps, then `small_model` if
+    given, then chunks twice as long.
+    """
+    levels = [
+        {"beam_size": 1},
+        {"beam_size": 1, "word_timestamps": False},
+    ]
+    if small_model is not None:
+        levels.append(dict(levels[-1], asr_model=small_model))
+    levels.append(dict(levels[-1], chunk_length_factor=2))
+    return levels
+
+
+class OverloadController:
+    """
+    Degrades the quality of the transcriptions step by step when the server
+    is overloaded, and restores it when the load drops.
+
+    The load is estimated from the moving averages of the real time factor
+    of the chunks and of the time they wait for the VAD and the ASR, over
+    all the clients. When either is above its high threshold, the
+    controller steps down to the next level; when both are below their low
+    threshold, or when no chunk has been in flight for `hold_seconds`, it
+    steps back up. A level is held for at least `hold_seconds`, so that the
+    averages reflect it before the next step, and the band between the
+    thresholds keeps it from oscillating.
+
+    Level 0 is the full quality. Each further level is a dict of overrides
+    of the client config used to transcribe the chunks, for example
+    'beam_size', 'word_timestamps' or 'asr_model' (with an ASR model pool),
+    and may set a 'chunk_length_factor' multiplying the chunk length of the
+    clients. The level is updated as the audio of the clients arrives and
+    before each transcription. The current level is reported in the
+    `overload.level` gauge, and in the 'quality_level' of every
+    transcription.
+
+    Attributes:
+        levels (list): The overrides of the degraded levels, from the
+                       mildest to the strongest. Defaults to
+                       `default_levels(small_model)`.
+        rtf_high (float): The real time factor above which the quality
+                          steps down.
+        rtf_low (float): The real time factor below which the quality steps
+                         back up.
+        queue_wait_high (float): The wait, in seconds, above which the
+                                 quality steps down.
+        queue_wait_low (float): The wait, in seconds, below which the
+                                quality steps back up.
+        hold_seconds (float): The minimum time between two steps.
+        small_model (str): The model of the ASR model pool of the default
+                           levels, or None to keep the client's model.
+        models (list): The models of the ASR model pool, to check the
+                       'asr_model' of the levels against, or None not to
+                       check them.
+        clock (callable): Returns the current time, in seconds.
+        level (int): The current level, 0 being the full quality.
+    """
+
+    def __init__(
+        self,
+        levels=None,
+        rtf_high=0.8,
+        rtf_low=0.4,
+        queue_wait_high=2.0,
+        queue_wait_low=0.5,
+        hold_seconds=10.0,
+        small_model=None,
+        models=None,
+        clock=time.monotonic,
+    ):
+        if rtf_low > rtf_high or queue_wait_low > queue_wait_high:
+            raise ValueError(
+                "The low thresholds of the overload controller must not "
+                "exceed the high ones"
+            )
+        self.levels = default_levels(small_model) if levels is None else levels
+        if models is not None:
+            for level in self.levels:
+                model = level.get("asr_model")
+                if model is not None and model not in models:
+                    raise ValueError(
+                        f"The ASR model {model} of an overload level is not "
+                        "served by the ASR model pool (see --asr-models)"
+                    )
+        self.rtf_high = rtf_high
+        self.rtf_low = rtf_low
+        self.queue_wait_high = queue_wait_high
+        self.queue_wait_low = queue_wait_low
+        self.hold_seconds = hold_seconds
+        self.clock = clock
+        self.level = 0
+        self._changed_at = None
+        self._busy_at = clock()
+        metrics.set_gauge("overload.level", 0)
+
+    def update(self):
+        """
+        Step the level according to the current load, unless the current
+        level was reached less than `hold_seconds` ago.
+
+        Returns:
+            int: The current level.
+        """
+        now = self.clock()
+        if metrics.get_gauge("buffering.chunks_in_flight", 0) > 0:
+            self._busy_at = now
+        if (
+            self._changed_at is not None
+            and now - self._changed_at < self.hold_seconds
+        ):
+            return self.level
+
+        rtf = metrics.get_ewma("buffering.rtf", 0.0)
+        queue_wait = metrics.get_ewma("buffering.queue_wait", 0.0)
+        # The averages are only updated by the chunks transcribed, so they
+        # stay high once the load is gone
+        idle = now - self._busy_at >= self.hold_seconds
+        if idle:
+            level = max(self.level - 1, 0)
+            direction = "up"
+        elif rtf > self.rtf_high or queue_wait > self.queue_wait_high:
+            level = min(self.level + 1, len(self.levels))
+            direction = "down"
+        elif rtf < self.rtf_low and queue_wait < self.queue_wait_low:
+            level = max(self.level - 1, 0)
+            direction = "up"
+        else:
+            return self.level
+
+        if level != self.level:
+            logging.info(
+                f"Quality level {self.level} -> {level} "
+                f"(rtf {rtf:.2f}, queue wait {queue_wait:.2f}s)"
+            )
+            self.level = level
+            self._changed_at = now
+            metrics.increment(f"overload.steps.{direction}")
+            metrics.set_gauge("overload.level", level)
+        return self.level
+
+    def overrides(self):
+        """
+        Return the client config overrides of the current level.
+        """
+        if self.level == 0:
+            return {}
+        return {
+            key: value
+            for key, value in self.levels[self.level - 1].items()
+            if key != "chunk_length_factor"
+        }
+
+    def chunk_length_factor(self):
+        if self.level == 0:
+            return 1.0
+        return float(
+            self.levels[self.level - 1].get("chunk_length_factor", 1.0)
+        )
+
+    def stats(self):
+        return {
+            "level": self.level,
+            "levels": len(self.levels),
+            "overrides": self.overrides(),
+            "chunk_length_factor": self.chunk_length_factor(),
+        }
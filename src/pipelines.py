@@ -0,0 +1,77 @@
+import json
+
+from src.asr.asr_factory import ASRFactory
+from src.asr.asr_model_pool import ASRModelPool
+from src.vad.vad_factory import VADFactory
+
+
+def add_pipeline_arguments(parser):
+    """
+    Add the arguments selecting the VAD and ASR pipelines, shared by the
+    server and the inference workers.
+    """
+    parser.add_argument(
+        "--vad-type",
+        type=str,
+        default="pyannote",
+        help="Type of VAD pipeline to use (e.g., 'pyannote' or "
+        "'pyannote_onnx')",
+    )
+    parser.add_argument(
+        "--vad-args",
+        type=str,
+        default='{"auth_token": "huggingface_token"}',
+        help="JSON string of additional arguments for VAD pipeline",
+    )
+    parser.add_argument(
+        "--asr-type",
+        type=str,
+        default="faster_whisper",
+        help="Type of ASR pipeline to use (e.g., 'whisper')",
+    )
+    parser.add_argument(
+        "--asr-args",
+        type=str,
+        default='{"model_size": "large-v3"}',
+        help="JSON string of additional arguments for ASR pipeline",
+    )
+    parser.add_argument(
+        "--asr-models",
+        type=str,
+        default=None,
+        help="Comma separated list of models clients may select with the "
+        "'asr_model' config key, e.g. 'tiny,small,large-v3'. Models are "
+        "loaded on first use and shared by all the sessions",
+    )
+    parser.add_argument(
+        "--asr-memory-budget-mb",
+        type=int,
+        default=None,
+        help="Maximum memory held by the models listed in --asr-models; the "
+        "least recently used models are evicted beyond it",
+    )
+
+
+def create_pipelines(args):
+    """
+    Create the VAD and ASR pipelines selected by the arguments.
+
+    Raises:
+        json.JSONDecodeError: If --vad-args or --asr-args is not valid JSON.
+    """
+    vad_args = json.loads(args.vad_args)
+    asr_args = json.loads(args.asr_args)
+
+    vad_pipeline = VADFactory.create_vad_pipeline(args.vad_type, **vad_args)
+    if args.asr_models:
+        asr_pipeline = ASRModelPool(
+            args.asr_type,
+            models=args.asr_models.split(","),
+            memory_budget_mb=args.asr_memory_budget_mb,
+            **asr_args,
+        )
+    else:
+        asr_pipeline = ASRFactory.create_asr_pipeline(
+            args.asr_type, **asr_args
+        )
+    return vad_pipeline, asr_pipeline
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from src.metrics import metrics
+
+
+class Stage:
+    """
+    A stage of the processing pipeline: a bounded queue of jobs and the
+    worker tasks running them.
+
+    Jobs are coroutine functions taking no argument. A full queue holds back
+    the producers, so a backlog builds up in front of the slowest stage
+    instead of inside it. The depth of the queue, the busy workers and the
+    time spent waiting are reported in the `pipeline.<name>.*` metrics.
+
+    Attributes:
+        name (str): The name of the stage.
+        workers (int): The number of jobs run concurrently.
+        max_size (int): The maximum number of queued jobs.
+    """
+
+    def __init__(self, name, workers=1, max_size=64, window_seconds=10.0):
+        if workers < 1:
+            raise ValueError(f"The {name} stage needs at least one worker")
+        self.name = name
+        self.workers = workers
+        self.max_size = max_size
+        self.window_seconds = window_seconds
+        self._queue = None
+        self._tasks = []
+        self._running = {}
+        self._completed = deque()
+
+    def _ensure_workers(self):
+        # The queue and the workers need the running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_size)
+            self._tasks = [
+                asyncio.create_task(self._work(i)) for i in range(self.workers)
+            ]
+
+    def full(self):
+        return self._queue is not None and self._queue.full()
+
+    def put_nowait(self, job):
+        """
+        Enqueue a job.
+
+        Raises:
+            asyncio.QueueFull: If the queue is full.
+        """
+        self._ensure_workers()
+        self._queue.put_nowait((job, time.time()))
+        self._report_depth()
+
+    async def put(self, job):
+        """
+        Enqueue a job, waiting for room in the queue.
+        """
+        self._ensure_workers()
+        await self._queue.put((job, time.time()))
+        self._report_depth()
+
+    def qsize(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    def utilization(self):
+        """
+        Return the fraction of the time the workers were busy over the last
+        `window_seconds`.
+        """
+        now = time.time()
+        window_start = self._forget_before(now)
+        busy = sum(
+            end - max(start, window_start) for start, end in self._completed
+        )
+        busy += sum(
+            now - max(start, window_start) for start in self._running.values()
+        )
+        return busy / (self.window_seconds * self.workers)
+
+    def stats(self):
+        return {
+            "queue_depth": self.qsize(),
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "busy_workers": len(self._running),
+            "utilization": self.utilization(),
+        }
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def _forget_before(self, now):
+        window_start = now - self.window_seconds
+        while self._completed and self._completed[0][1] < window_start:
+            self._completed.popleft()
+        return window_start
+
+    def _report_depth(self):
+        metrics.set_gauge(f"pipeline.{self.name}.queue_depth", self.qsize())
+
+    async def _work(self, worker):
+        while True:
+            job, enqueued = await self._queue.get()
+            self._report_depth()
+            start = time.time()
+            metrics.observe(
+                f"pipeline.{self.name}.wait_seconds", start - enqueued
+            )
+            self._running[worker] = start
+            metrics.set_gauge(
+                f"pipeline.{self.name}.busy_workers", len(self._running)
+            )
+            try:
+                await job()
+            except Exception:
+                logging.exception(f"Job of the {self.name} stage failed")
+            finally:
+                end = time.time()
+                del self._running[worker]
+                self._completed.append((start, end))
+                self._forget_before(end)
+                metrics.set_gauge(
+                    f"pipeline.{self.name}.busy_workers", len(self._running)
+                )
+                metrics.observe(
+                    f"pipeline.{self.name}.job_seconds", end - start
+                )
+
+
+class ProcessingPipeline:
+    """
+    The stages processing the chunks of all the clients.
+
+    A chunk goes through:
+
+    - ingest: the audio received from the client is appended to its buffer,
+      and cut into a chunk once long enough (see the buffering strategies);
+    - gate: a client has at most one chunk in the VAD stage, since whether
+      the next chunk extends the audio of the previous one depends on its
+      VAD result. A chunk waiting at the gate, or held back because the VAD
+      queue is full, keeps growing in the client's buffer;
+    - vad: the voice activity detection, deciding whether the audio is
+      transcribed now or extended with the next chunk;
+    - asr: the transcription;
+    - deliver: the results are sent to the clients, in the order of their
+      chunks even if transcribed concurrently.
+
+    As soon as the VAD of a chunk is done, the next chunk of the same client
+    can enter the VAD stage while the first one is being transcribed, so
+    both models work at the same time.
+
+    Attributes:
+        vad (Stage): The VAD stage.
+        asr (Stage): The ASR stage.
+        deliver (Stage): The delivery stage.
+        chunks_in_flight (int): The chunks of all the clients between the
+                                gate and their delivery.
+    """
+
+    def __init__(self, vad_workers=1, asr_workers=4, queue_size=64):
+        self.chunks_in_flight = 0
+        self.vad = Stage("vad", workers=vad_workers, max_size=queue_size)
+        self.asr = Stage("asr", workers=asr_workers, max_size=queue_size)
+        # A single worker sends the results of each client in order
+        self.deliver = Stage("deliver", workers=1, max_size=queue_size)
+
+    def stats(self):
+        return {
+            stage.name: stage.stats()
+            for stage in (self.vad, self.asr, self.deliver)
+        }
+
+    def close(self):
+        for stage in (self.vad, self.asr, self.deliver):
+            stage.close()
@@ -0,0 +1,97 @@
+import cProfile
+import logging
+import os
+import tracemalloc
+from contextlib import contextmanager
+
+
+class ChunkProfiler:
+    """
+    Samples the processing of one audio chunk out of N through cProfile and,
+    optionally, tracemalloc, and dumps the collected statistics to a
+    directory.
+
+    The profiles are meant to be opened with the standard tooling, for
+    example `python -m pstats <chunk_id>.prof` or snakeviz, and
+    `tracemalloc.Snapshot.load(<chunk_id>.tracemalloc)`. Since chunks are
+    processed as asyncio tasks, a profile also contains whatever else the
+    event loop runs while the sampled chunk is being processed. Only one
+    chunk is profiled at a time. With the processing pipeline, the VAD and
+    ASR stages of a sampled chunk add up to a single profile, while the
+    allocations are those of its last stage.
+
+    Attributes:
+        sample_every (int): Profile one chunk every `sample_every` chunks.
+        output_dir (str): Directory where the statistics are written.
+        trace_memory (bool): Whether allocations are traced as well.
+    """
+
+    def __init__(
+        self, sample_every, output_dir="profiles", trace_memory=False
+    ):
+        if sample_every < 1:
+            raise ValueError("sample_every must be a positive integer")
+        self.sample_every = sample_every
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory
+        self._chunk_count = 0
+        self._active = False
+        self._sampled_chunk = None
+        self._profiler = None
+
+    def _should_sample(self):
+        self._chunk_count += 1
+        return not self._active and self._chunk_count % self.sample_every == 0
+
+    @contextmanager
+    def profile(self, chunk_id, continued=False):
+        """
+        Context manager wrapping the processing of a chunk; it only profiles
+        the sampled chunks and is a no-op for the others.
+
+        Args:
+            chunk_id (str): The identifier of the chunk, used to name the
+                            output files.
+            continued (bool): Whether this is a later stage of a chunk whose
+                              first stage was wrapped already. It does not
+                              count as a chunk, and is only profiled if the
+                              chunk was sampled.
+        """
+        if continued:
+            sampled = not self._active and chunk_id == self._sampled_chunk
+        else:
+            sampled = self._should_sample()
+            if sampled:
+                self._sampled_chunk = chunk_id
+                self._profiler = cProfile.Profile()
+        if not sampled:
+            yield
+            return
+
+        self._active = True
+        profiler = self._profiler
+        started_tracemalloc = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracemalloc = True
+
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._active = False
+            os.makedirs(self.output_dir, exist_ok=True)
+            base_path = os.path.join(self.output_dir, chunk_id)
+            profiler.dump_stats(f"{base_path}.prof")
+
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.take_snapshot().dump(f"{base_path}.tracemalloc")
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                logging.info(
+                    f"Profiled chunk {chunk_id}: peak traced memory "
+                    f"{peak / 1024:.1f} KiB"
+                )
+            logging.info(f"Profile of chunk {chunk_id} saved to {base_path}")
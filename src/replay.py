@@ -0,0 +1,244 @@
+"""
+Replay captured sessions against a server and compare the outcome.
+
+The traces written by a server started with --capture-dir are sent back to a
+server, all the sessions at once, with the original timing of their frames
+and config messages, optionally accelerated. The results of the replay are
+then paired with the original ones, by stream, chunk number and type, to
+compare their texts and latencies.
+
+Usage:
+
+    python -m src.replay captures/*.trace --url ws://127.0.0.1:8765
+    python -m src.replay captures/*.trace --speed 2 --report report.json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+import websockets
+
+from src.traffic_capture import AUDIO, RESULT, TEXT, read_trace
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def decode_result(payload):
+    if isinstance(payload, str):
+        return json.loads(payload)
+    try:
+        return json.loads(payload.decode("utf-8"))
+    except ValueError:
+        if msgpack is None:
+            raise ValueError("Decoding msgpack results requires msgpack")
+        return msgpack.unpackb(payload)
+
+
+def result_key(result):
+    """
+    Identify a result independently of the ids of the session, which differ
+    between the original run and the replay.
+    """
+    chunk_id = result.get("chunk_id", "")
+    return (
+        result.get("stream_id"),
+        chunk_id.rpartition("-")[2],
+        result.get("type"),
+        result.get("segment_index"),
+    )
+
+
+async def replay_session(trace_path, url, speed, tail_seconds):
+    """
+    Replay one captured session.
+
+    Returns:
+        tuple: The original and the replayed results, as lists of (time,
+               result) tuples, the time being relative to the start of the
+               session, in the original time scale.
+    """
+    header, records = read_trace(trace_path)
+    original = [
+        (timestamp, decode_result(payload))
+        for timestamp, kind, payload in records
+        if kind == RESULT
+    ]
+
+    replayed = []
+    async with websockets.connect(
+        url.rstrip("/") + header["path"], max_size=None
+    ) as websocket:
+        start = time.monotonic()
+
+        async def receive():
+            async for message in websocket:
+                replayed.append(
+                    (
+                        (time.monotonic() - start) * speed,
+                        decode_result(message),
+                    )
+                )
+
+        receiver = asyncio.create_task(receive())
+        for timestamp, kind, payload in records:
+            if kind not in (AUDIO, TEXT):
+                continue
+            delay = timestamp / speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await websocket.send(
+                payload if kind == AUDIO else payload.decode("utf-8")
+            )
+
+        # Wait for the results still being processed
+        deadline = time.monotonic() + tail_seconds
+        while len(replayed) < len(original) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        receiver.cancel()
+
+    return original, replayed
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values)),
+    }
+
+
+def compare(trace_path, original, replayed):
+    """
+    Pair the replayed results with the original ones and compare them.
+    """
+    replayed_by_key = {
+        result_key(result): (t, result) for t, result in replayed
+    }
+    text_mismatches = []
+    delays = {"original": [], "replayed": []}
+    processing_times = {"original": [], "replayed": []}
+    matched = 0
+    for original_time, result in original:
+        key = result_key(result)
+        if key not in replayed_by_key:
+            continue
+        matched += 1
+        replayed_time, replayed_result = replayed_by_key[key]
+        if replayed_result.get("text") != result.get("text"):
+            text_mismatches.append(
+                {
+                    "chunk": key[1],
+                    "stream_id": key[0],
+                    "original": result.get("text"),
+                    "replayed": replayed_result.get("text"),
+                }
+            )
+        delays["original"].append(original_time)
+        delays["replayed"].append(replayed_time)
+        for name, source in (
+            ("original", result),
+            ("replayed", replayed_result),
+        ):
+            if "processing_time" in source:
+                processing_times[name].append(source["processing_time"])
+
+    return {
+        "trace": trace_path,
+        "results": {
+            "original": len(original),
+            "replayed": len(replayed),
+            "matched": matched,
+        },
+        "text_mismatches": text_mismatches,
+        "result_time": {name: summarize(v) for name, v in delays.items()},
+        "processing_time": {
+            name: summarize(v) for name, v in processing_times.items()
+        },
+    }
+
+
+def print_report(report):
+    results = report["results"]
+    print(
+        f"{report['trace']}: {results['matched']}/{results['original']} "
+        f"results matched, {results['replayed']} replayed, "
+        f"{len(report['text_mismatches'])} text mismatches"
+    )
+    for name in ("result_time", "processing_time"):
+        for run in ("original", "replayed"):
+            summary = report[name][run]
+            if summary is not None:
+                print(
+                    f"    {name:>15} {run:>8}: p50 {summary['p50']:.3f}s, "
+                    f"p99 {summary['p99']:.3f}s, max {summary['max']:.3f}s"
+                )
+
+
+async def replay(traces, url, speed, tail_seconds):
+    sessions = await asyncio.gather(
+        *(replay_session(trace, url, speed, tail_seconds) for trace in traces)
+    )
+    return [
+        compare(trace, original, replayed)
+        for trace, (original, replayed) in zip(traces, sessions)
+    ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replay captured sessions against a VoiceStreamAI server "
+        "and compare the results and latencies with the original run"
+    )
+    parser.add_argument(
+        "traces", nargs="+", help="The .trace files written by --capture-dir"
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="ws://127.0.0.1:8765",
+        help="The URL of the server",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay speed factor, e.g. 2 to send the frames twice as fast",
+    )
+    parser.add_argument(
+        "--tail-seconds",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for the remaining results after the last frame",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Also save the comparison as JSON to this file",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    reports = asyncio.run(
+        replay(args.traces, args.url, args.speed, args.tail_seconds)
+    )
+    for report in reports:
+        print_report(report)
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,32 @@
+import asyncio
 import json
 import logging
+import random
 import ssl
+import struct
 import uuid
+from http import HTTPStatus
 
 import websockets
 
+from src.audio_decoder import StreamingAudioDecoder
+from src.buffering_strategy.buffering_strategies import (
+    SpeculativeSilenceAtEndOfChunk,
+)
 from src.client import Client
+from src.jitter_buffer import FRAMINGS, ClockSync, JitterBuffer
+from src.memory_limits import memory_stats
+from src.metrics import metrics
+from src.outbound_queue import OutboundQueue, check_encoding
+
+# The path of the WebSocket endpoint multiplexing several audio streams
+MULTIPLEX_PATH = "/multiplex"
+# The header of the binary frames of a multiplexed connection: the stream id
+STREAM_HEADER = struct.Struct("!I")
+# The close code of the sessions closed by the server for their usage
+POLICY_VIOLATION = 1008
+# The close code of the sessions closed by the server draining
+SERVICE_RESTART = 1012
 
 
 class Server:
@@ -25,6 +46,31 @@ class Server:
         samples_width (int): The width of each audio sample in bits.
         connected_clients (dict): A dictionary mapping client IDs to Client
                                   objects.
+        profiler (ChunkProfiler): Optional profiler sampling the processing
+                                  of the audio chunks.
+        recorder (SessionRecorder): Optional recorder archiving the audio and
+                                    transcriptions of every session.
+        send_timeout (float): Seconds to wait for the delivery of each result
+                              to a client.
+        outbound_queue_size (int): The maximum number of results waiting for
+                                   delivery to each client.
+        capture (TrafficCapture): Optional capture of the traffic of every
+                                  session, to replay it with src.replay.
+        pipeline (ProcessingPipeline): Optional stages processing the chunks
+                                       of all the clients; without it each
+                                       chunk is processed in its own task.
+        overload (OverloadController): Optional controller degrading the
+                                       quality of the transcriptions of all
+                                       the clients under load.
+        memory_limiter (MemoryLimiter): Optional limits on the memory held
+                                        by each session and by all of them.
+        asr_models (list): The models of the ASR model pool the clients may
+                           select with 'asr_model', or None not to check
+                           them.
+        max_streams (int): The maximum number of open streams of a
+                           multiplexed connection.
+        draining (bool): Whether the server is draining its sessions before
+                         stopping, see `drain`.
     """
 
     def __init__(
@@ -37,6 +83,16 @@ class Server:
         samples_width=2,
         certfile=None,
         keyfile=None,
+        profiler=None,
+        recorder=None,
+        send_timeout=5.0,
+        outbound_queue_size=64,
+        capture=None,
+        pipeline=None,
+        overload=None,
+        memory_limiter=None,
+        asr_models=None,
+        max_streams=64,
     ):
         self.vad_pipeline = vad_pipeline
         self.asr_pipeline = asr_pipeline
@@ -47,40 +103,533 @@ class Server:
         self.certfile = certfile
         self.keyfile = keyfile
         self.connected_clients = {}
+        self.profiler = profiler
+        self.recorder = recorder
+        self.send_timeout = send_timeout
+        self.outbound_queue_size = outbound_queue_size
+        self.capture = capture
+        self.pipeline = pipeline
+        self.overload = overload
+        self.memory_limiter = memory_limiter
+        self.asr_models = asr_models
+        self.max_streams = max_streams
+        self.draining = False
+
+    async def receive_audio(self, client, audio_data, capture_time=None):
+        audio_data = client.append_audio_data(audio_data, capture_time)
+        if self.recorder is not None:
+            await self.recorder.record_audio(client.client_id, audio_data)
+
+    async def update_decoder(self, client, websocket):
+        """
+        Start, replace or stop the client's decoder according to the codec
+        negotiated in its config.
+        """
+        codec = client.config.get("codec", "pcm")
+        if client.decoder is not None and (
+            client.decoder.codec != codec or client.decoder.failed
+        ):
+            await client.decoder.close()
+            client.decoder = None
+        if codec == "pcm" or client.decoder is not None:
+            return
+
+        async def on_decoded_audio(audio_data):
+            await self.receive_audio(client, audio_data)
+            client.process_audio(
+                websocket, self.vad_pipeline, self.asr_pipeline
+            )
+
+        client.decoder = StreamingAudioDecoder(
+            codec, self.sampling_rate, on_decoded_audio
+        )
+        await client.decoder.start()
+
+    def create_client(self, client_id, websocket, tags=None):
+        client = Client(
+            client_id,
+            self.sampling_rate,
+            self.samples_width,
+            profiler=self.profiler,
+            recorder=self.recorder,
+        )
+        client.outbound = OutboundQueue(
+            websocket,
+            send_timeout=self.send_timeout,
+            max_size=self.outbound_queue_size,
+            tags=tags,
+        )
+        client.pipeline = self.pipeline
+        client.overload = self.overload
+        self.connected_clients[client_id] = client
+        return client
+
+    async def close_client(self, client):
+        if client.decoder is not None:
+            await client.decoder.close()
+        client.close()
+        client.outbound.close()
+        del self.connected_clients[client.client_id]
+        if self.recorder is not None:
+            await self.recorder.close_session(client.client_id)
+
+    def update_framing(self, client):
+        """
+        Start or stop reordering the frames of the client according to the
+        framing negotiated in its config.
+
+        Raises:
+            ValueError: If the framing is unknown.
+        """
+        framing = client.config.get("framing", "raw")
+        if framing not in FRAMINGS:
+            raise ValueError(f"Unknown framing: {framing}")
+        if framing == "raw":
+            client.jitter_buffer = None
+            client.clock_sync = None
+        elif client.jitter_buffer is None:
+            client.jitter_buffer = JitterBuffer(
+                depth=int(client.config.get("jitter_buffer_frames", 3)),
+                # Silence can only be inserted in uncompressed audio
+                fill_gaps=client.config.get("codec", "pcm") == "pcm",
+            )
+            client.clock_sync = ClockSync()
+            client.outbound.put(client.clock_sync.ping())
+
+    def handle_clock_sync(self, client, message):
+        if client.clock_sync is None:
+            return
+        try:
+            client.clock_sync.on_echo(message)
+        except ValueError as e:
+            logging.warning(f"Client {client.client_id}: {e}")
+
+    async def update_config(self, client, websocket, config_data):
+        """
+        Apply a config message of the client.
+
+        Raises:
+            ValueError: If the config is invalid. An 'asr_model', or a draft
+                        or final model of the speculative strategy, that is
+                        not served, or an unknown 'result_encoding', is
+                        rejected before the config is changed.
+        """
+        if self.asr_models is not None:
+            config = dict(client.config, **config_data)
+            models = [config.get("asr_model")]
+            if (
+                config.get("processing_strategy")
+                == "speculative_silence_at_end_of_chunk"
+            ):
+                models += SpeculativeSilenceAtEndOfChunk.models(
+                    config.get("processing_args") or {}
+                )
+            for model in models:
+                if model is not None and model not in self.asr_models:
+                    raise ValueError(
+                        f"ASR model {model} is not served, available "
+                        f"models: {', '.join(self.asr_models)}"
+                    )
+        encoding = config_data.get(
+            "result_encoding", client.config.get("result_encoding", "json")
+        )
+        check_encoding(encoding)
+        client.update_config(config_data)
+        client.outbound.set_encoding(encoding)
+        self.update_framing(client)
+        await self.update_decoder(client, websocket)
+        logging.debug(f"Updated config: {client.config}")
+
+    async def apply_config(self, client, websocket, config_data):
+        """
+        Apply a config message of the client, replying with an error message
+        if it is invalid.
+        """
+        try:
+            if not isinstance(config_data, dict):
+                raise ValueError("The config data must be an object")
+            await self.update_config(client, websocket, config_data)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Invalid config from {client.client_id}: {e}")
+            client.outbound.put({"type": "error", "error": str(e)})
+
+    async def receive_frame(self, client, websocket, frame):
+        if client.jitter_buffer is None:
+            await self.receive_payload(client, websocket, frame)
+            return
+
+        try:
+            frames = client.jitter_buffer.push(frame)
+        except ValueError as e:
+            logging.warning(f"Client {client.client_id}: {e}")
+            return
+        if client.clock_sync.ping_due():
+            client.outbound.put(client.clock_sync.ping())
+        for capture_time, audio_data in frames:
+            if client.closing_reason is not None:
+                return
+            await self.receive_payload(
+                client,
+                websocket,
+                audio_data,
+                client.clock_sync.to_server_time(capture_time),
+            )
+
+    async def receive_payload(
+        self, client, websocket, audio_data, capture_time=None
+    ):
+        if self.draining:
+            # The client was told to reconnect, its remaining audio has
+            # already been flushed
+            metrics.increment("drain.dropped_bytes", len(audio_data))
+            return
+        if client.decoder is not None:
+            await self.feed_decoder(client, audio_data)
+            return
+        await self.receive_audio(client, audio_data, capture_time)
+        # this is synchronous, any async operation is in BufferingStrategy
+        client.process_audio(websocket, self.vad_pipeline, self.asr_pipeline)
+        if self.memory_limiter is not None:
+            self.enforce_memory_limits(client)
+
+    async def feed_decoder(self, client, audio_data):
+        """
+        Feed the client's compressed audio to its decoder. When the decoder
+        fails, the client is sent an error and its audio is dropped until
+        it sends a config again.
+        """
+        if client.decoder.failed:
+            return
+        try:
+            await client.decoder.feed(audio_data)
+        except ValueError as e:
+            logging.warning(f"Client {client.client_id}: {e}")
+            await client.decoder.close()
+            client.outbound.put({"type": "error", "error": str(e)})
+
+    def enforce_memory_limits(self, client):
+        """
+        Check the memory limits after the client received audio, and evict
+        the sessions exceeding them.
+        """
+        if not self.memory_limiter.check_session(client):
+            self.evict_client(client, "session_memory_limit")
+        for evicted in self.memory_limiter.select_evictions(
+            list(self.connected_clients.values())
+        ):
+            self.evict_client(evicted, "server_memory_limit")
+
+    def evict_client(self, client, reason):
+        """
+        Release the memory of a session right away and send it an error.
+        The session is then closed by its connection handler, at its next
+        message.
+        """
+        if client.closing_reason is not None:
+            return
+        client.closing_reason = reason
+        client.close()
+        client.buffer.clear()
+        client.scratch_buffer.clear()
+        client.outbound.clear()
+        client.outbound.put({"type": "error", "error": reason})
+
+    async def close_evicted(self, client, websocket):
+        # Give the error a chance to be delivered first
+        await client.outbound.flush(self.send_timeout)
+        await websocket.close(POLICY_VIOLATION, client.closing_reason)
 
     async def handle_audio(self, client, websocket):
         while True:
             message = await websocket.recv()
 
             if isinstance(message, bytes):
-                client.append_audio_data(message)
+                await self.receive_frame(client, websocket, message)
             elif isinstance(message, str):
                 config = json.loads(message)
                 if config.get("type") == "config":
-                    client.update_config(config["data"])
-                    logging.debug(f"Updated config: {client.config}")
-                    continue
+                    await self.apply_config(client, websocket, config["data"])
+                elif config.get("type") == "clock_sync":
+                    self.handle_clock_sync(client, config)
             else:
                 print(f"Unexpected message type from {client.client_id}")
 
-            # this is synchronous, any async operation is in BufferingStrategy
-            client.process_audio(
-                websocket, self.vad_pipeline, self.asr_pipeline
-            )
+            if client.closing_reason is not None:
+                await self.close_evicted(client, websocket)
+                return
+
+    async def handle_multiplexed_audio(self, connection_id, websocket):
+        """
+        Receive the audio of several streams over one connection.
+
+        Binary frames start with the id of their stream, an unsigned 32-bit
+        big-endian integer, followed by the audio. Text messages carry the
+        'stream_id' they apply to: a 'config' message configures a stream,
+        and 'close_stream' ends it. Each stream has its own Client, with its
+        own buffering strategy, and its results are tagged with its
+        'stream_id'. A stream is opened by its first frame or config message,
+        up to `max_streams` open streams; the others are sent an error and
+        their audio is dropped. The results of a closed stream are still
+        delivered, in the background, and its audio is dropped meanwhile.
+        An invalid message is answered with an error, and only affects its
+        stream.
+        """
+        streams = {}
+        closing = {}
+        rejected = set()
+        header_size = STREAM_HEADER.size
+
+        async def get_stream(stream_id):
+            client = streams.get(stream_id)
+            if client is None:
+                if stream_id in closing:
+                    return None
+                if len(streams) + len(closing) >= self.max_streams:
+                    if stream_id not in rejected:
+                        rejected.add(stream_id)
+                        metrics.increment("multiplex.rejected_streams")
+                        logging.warning(
+                            f"Connection {connection_id} has "
+                            f"{self.max_streams} streams open, rejected "
+                            f"stream {stream_id}"
+                        )
+                        await websocket.send(
+                            json.dumps(
+                                {
+                                    "type": "error",
+                                    "error": "too_many_streams",
+                                    "stream_id": stream_id,
+                                }
+                            )
+                        )
+                    return None
+                client = self.create_client(
+                    f"{connection_id}-{stream_id}",
+                    websocket,
+                    tags={"stream_id": stream_id},
+                )
+                streams[stream_id] = client
+                logging.debug(f"Opened stream {client.client_id}")
+            return client
+
+        try:
+            while True:
+                message = await websocket.recv()
+
+                if isinstance(message, bytes):
+                    if len(message) < header_size:
+                        logging.warning(
+                            f"Frame without stream id from {connection_id}"
+                        )
+                        continue
+                    (stream_id,) = STREAM_HEADER.unpack_from(message)
+                    audio_data = message[header_size:]
+                    client = await get_stream(stream_id)
+                    if client is not None:
+                        await self.receive_frame(client, websocket, audio_data)
+                    await self.close_evicted_streams(streams)
+                    continue
+
+                try:
+                    control = json.loads(message)
+                except json.JSONDecodeError:
+                    control = None
+                if not isinstance(control, dict):
+                    logging.warning(f"Invalid message from {connection_id}")
+                    continue
+                stream_id = control.get("stream_id")
+                if not isinstance(stream_id, int):
+                    logging.warning(
+                        f"Message without stream id from {connection_id}"
+                    )
+                elif control.get("type") == "config":
+                    client = await get_stream(stream_id)
+                    if client is not None:
+                        await self.apply_config(
+                            client, websocket, control.get("data")
+                        )
+                elif control.get("type") == "clock_sync":
+                    if stream_id in streams:
+                        self.handle_clock_sync(streams[stream_id], control)
+                elif control.get("type") == "close_stream":
+                    if stream_id in streams:
+                        task = asyncio.create_task(
+                            self.close_stream(streams.pop(stream_id))
+                        )
+                        closing[stream_id] = task
+                        task.add_done_callback(
+                            lambda _, stream_id=stream_id: closing.pop(
+                                stream_id
+                            )
+                        )
+                        # There may be room for the rejected streams now
+                        rejected.clear()
+                await self.close_evicted_streams(streams)
+        finally:
+            # The results of the closing streams can no longer be delivered
+            tasks = list(closing.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for client in streams.values():
+                await self.close_client(client)
+
+    async def close_stream(self, client):
+        """
+        Transcribe the audio left in a closed stream of a multiplexed
+        connection and deliver its results, then release it.
+        """
+        try:
+            await self.flush_client(client)
+        finally:
+            await self.close_client(client)
+
+    async def close_evicted_streams(self, streams):
+        # The other streams of the connection go on
+        evicted = [
+            stream_id
+            for stream_id, client in streams.items()
+            if client.closing_reason is not None
+        ]
+        for stream_id in evicted:
+            client = streams.pop(stream_id)
+            await client.outbound.flush(self.send_timeout)
+            await self.close_client(client)
 
     async def handle_websocket(self, websocket):
         client_id = str(uuid.uuid4())
-        client = Client(client_id, self.sampling_rate, self.samples_width)
-        self.connected_clients[client_id] = client
+        multiplexed = websocket.path == MULTIPLEX_PATH
+        if self.capture is not None:
+            websocket = self.capture.wrap(websocket, client_id)
 
         print(f"Client {client_id} connected")
 
+        client = None
         try:
-            await self.handle_audio(client, websocket)
+            if multiplexed:
+                await self.handle_multiplexed_audio(client_id, websocket)
+            else:
+                client = self.create_client(client_id, websocket)
+                await self.handle_audio(client, websocket)
         except websockets.ConnectionClosed as e:
             print(f"Connection with {client_id} closed: {e}")
         finally:
-            del self.connected_clients[client_id]
+            if client is not None:
+                await self.close_client(client)
+            if self.capture is not None:
+                websocket.close_trace()
+
+    async def drain(self, timeout=30.0, reconnect_spread=5.0):
+        """
+        Drain the sessions before the server stops, so that a rolling restart
+        loses none of the audio already received.
+
+        From then on, new connections are refused and the /ready endpoint
+        answers 503, so that the load balancer sends the clients to the
+        other instances. Every session is sent a 'reconnect' message at
+        once, with a random 'retry_after' delay spreading the reconnections,
+        and the audio it sends afterwards is dropped. The audio left in its
+        decoder and buffers is transcribed, even if the speech has not
+        ended, its results are delivered, and its connection is closed with
+        the code 1012 (service restart). The sessions not drained within
+        `timeout` seconds are closed all the same.
+
+        Args:
+            timeout (float): The drain deadline, in seconds.
+            reconnect_spread (float): The maximum 'retry_after' of the
+                                      'reconnect' messages, in seconds.
+        """
+        self.draining = True
+        metrics.set_gauge("server.draining", 1)
+        clients = list(self.connected_clients.values())
+        logging.info(f"Draining {len(clients)} sessions")
+        for client in clients:
+            client.outbound.put(
+                {
+                    "type": "reconnect",
+                    "reason": "server_draining",
+                    "retry_after": random.uniform(0, reconnect_spread),
+                }
+            )
+
+        flushes = [
+            asyncio.create_task(self.flush_client(client))
+            for client in clients
+        ]
+        if flushes:
+            _, pending = await asyncio.wait(flushes, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                metrics.increment("drain.timeouts", len(pending))
+                logging.warning(
+                    f"{len(pending)} sessions not drained after {timeout}s"
+                )
+
+        # The streams of a multiplexed connection share its WebSocket
+        websockets_to_close = {
+            id(client.outbound.websocket): client.outbound.websocket
+            for client in clients
+        }
+        for websocket in websockets_to_close.values():
+            await websocket.close(SERVICE_RESTART, "server_draining")
+        logging.info("Drained")
+
+    async def flush_client(self, client):
+        """
+        Transcribe the audio left in the decoder and buffers of a session,
+        and deliver its results.
+        """
+        if client.closing_reason is not None:
+            return
+        if client.decoder is not None:
+            # Delivers the audio still in the decoder
+            await client.decoder.close()
+            client.decoder = None
+        await client.buffering_strategy.flush(
+            client.outbound.websocket, self.vad_pipeline, self.asr_pipeline
+        )
+        if client.client_id in self.connected_clients:
+            await client.outbound.flush()
+
+    def get_stats(self):
+        """
+        Return the server statistics exposed on the /stats endpoint.
+        """
+        stats = {
+            "connected_clients": len(self.connected_clients),
+            "draining": self.draining,
+            "memory": memory_stats(self.connected_clients.values()),
+            "metrics": metrics.snapshot(),
+        }
+        if self.memory_limiter is not None:
+            stats["memory"]["limits"] = self.memory_limiter.stats()
+        if self.pipeline is not None:
+            stats["pipeline"] = self.pipeline.stats()
+        if self.overload is not None:
+            stats["overload"] = self.overload.stats()
+        return stats
+
+    async def process_request(self, path, request_headers):
+        """
+        Answer plain HTTP requests to the /stats and /ready endpoints; every
+        other request continues with the WebSocket handshake, unless the
+        server is draining.
+        """
+        if path == "/ready":
+            if self.draining:
+                return HTTPStatus.SERVICE_UNAVAILABLE, [], b"draining\n"
+            return HTTPStatus.OK, [], b"ready\n"
+        if path == "/stats":
+            body = json.dumps(self.get_stats()).encode()
+            return (
+                HTTPStatus.OK,
+                [("Content-Type", "application/json")],
+                body,
+            )
+        if self.draining:
+            return HTTPStatus.SERVICE_UNAVAILABLE, [], b"draining\n"
+        return None
 
     def start(self):
         if self.certfile:
@@ -103,7 +652,11 @@ class Server:
             # and port. Ensure the secure flag is set to True if using a secure
             # WebSocket protocol (wss://)
             return websockets.serve(
-                self.handle_websocket, self.host, self.port, ssl=ssl_context
+                self.handle_websocket,
+                self.host,
+                self.port,
+                ssl=ssl_context,
+                process_request=self.process_request,
             )
         else:
             print(
@@ -111,5 +664,8 @@ class Server:
                 f"{self.host}:{self.port}"
             )
             return websockets.serve(
-                self.handle_websocket, self.host, self.port
+                self.handle_websocket,
+                self.host,
+                self.port,
+                process_request=self.process_request,
             )
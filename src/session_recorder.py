@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+OVERFLOW_POLICIES = ("drop", "block")
+AUDIO_FORMATS = ("flac", "wav")
+
+
+class SessionRecorder:
+    """
+    Archives the audio and the transcriptions of every session to disk.
+
+    Recording requests are put on a bounded queue and written by a single
+    background thread, which also takes care of encoding (e.g. to FLAC) and
+    of rotating the audio files, so that no file I/O nor compression happens
+    on the event loop. When the queue is full the recorder either drops the
+    request or makes the calling coroutine wait, without ever blocking the
+    event loop itself, depending on the overflow policy.
+
+    Each session is stored in its own directory under `output_dir`, as a
+    sequence of audio files `<segment>.<format>` and a `transcripts.jsonl`
+    file.
+
+    Attributes:
+        output_dir (str): Directory where the sessions are stored.
+        audio_format (str): 'flac' or 'wav'.
+        rotate_seconds (float): Maximum duration of each audio file, at
+                                least one sample.
+        overflow_policy (str): 'drop' or 'block'.
+        sampling_rate (int): The sampling rate of the recorded audio in Hz.
+        samples_width (int): The width of each recorded sample in bytes.
+        dropped (int): Number of recording requests dropped so far.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        audio_format="flac",
+        rotate_seconds=300,
+        max_queue_size=256,
+        overflow_policy="drop",
+        sampling_rate=16000,
+        samples_width=2,
+    ):
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"Unknown recording format: {audio_format}")
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        if int(rotate_seconds * sampling_rate) < 1:
+            raise ValueError(
+                "The audio files must be rotated after at least one sample"
+            )
+        if audio_format == "flac":
+            # Fail early rather than in the writer thread
+            import soundfile  # noqa: F401
+
+        self.output_dir = output_dir
+        self.audio_format = audio_format
+        self.rotate_seconds = rotate_seconds
+        self.overflow_policy = overflow_policy
+        self.sampling_rate = sampling_rate
+        self.samples_width = samples_width
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # Waits for room in the queue, so that the blocked sessions do not
+        # take the threads of the default executor, used by the pipelines
+        self._put_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="session-recorder-put"
+        )
+        self._sessions = {}
+        self._thread = threading.Thread(
+            target=self._run, name="session-recorder", daemon=True
+        )
+        self._thread.start()
+
+    async def record_audio(self, client_id, audio_data):
+        """
+        Queue audio received from a client for recording.
+
+        Args:
+            client_id (str): The identifier of the session.
+            audio_data (bytes): PCM audio, as fed to the pipelines.
+        """
+        await self._put(("audio", client_id, bytes(audio_data)))
+
+    async def record_transcription(self, client_id, transcription):
+        """
+        Queue a transcription sent to a client for recording.
+
+        Args:
+            client_id (str): The identifier of the session.
+            transcription (dict): The transcription sent to the client.
+        """
+        await self._put(("transcription", client_id, transcription))
+
+    async def close_session(self, client_id):
+        """
+        Close the files of a session once its pending requests are written.
+        This request is never dropped.
+
+        Args:
+            client_id (str): The identifier of the session.
+        """
+        await self._put(("close", client_id, None), can_drop=False)
+
+    def stop(self):
+        """
+        Write all pending requests, close every file and stop the writer
+        thread. This call blocks until the thread has finished.
+        """
+        self._put_executor.shutdown()
+        self._queue.put(None)
+        self._thread.join()
+
+    async def _put(self, item, can_drop=True):
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        if can_drop and self.overflow_policy == "drop":
+            self.dropped += 1
+            logging.warning(
+                f"Session recorder is falling behind, dropped {item[0]} "
+                f"for {item[1]} ({self.dropped} dropped so far)"
+            )
+            return
+
+        # Wait for room in the queue without blocking the event loop: only
+        # the coroutine recording this session is held back.
+        await asyncio.get_running_loop().run_in_executor(
+            self._put_executor, self._queue.put, item
+        )
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, client_id, payload = item
+            try:
+                if kind == "audio":
+                    self._write_audio(client_id, payload)
+                elif kind == "transcription":
+                    self._write_transcription(client_id, payload)
+                elif kind == "close":
+                    self._close_session(client_id)
+            except Exception:
+                logging.exception(f"Failed to record {kind} for {client_id}")
+
+        for client_id in list(self._sessions):
+            self._close_session(client_id)
+
+    def _get_session(self, client_id):
+        session = self._sessions.get(client_id)
+        if session is None:
+            directory = os.path.join(self.output_dir, client_id)
+            os.makedirs(directory, exist_ok=True)
+            session = {
+                "directory": directory,
+                "segment": 0,
+                "audio_file": None,
+                "samples_in_segment": 0,
+                "transcripts_file": open(
+                    os.path.join(directory, "transcripts.jsonl"), "a"
+                ),
+            }
+            self._sessions[client_id] = session
+        return session
+
+    def _open_audio_file(self, session):
+        file_path = os.path.join(
+            session["directory"],
+            f"{session['segment']:05d}.{self.audio_format}",
+        )
+        if self.audio_format == "flac":
+            import soundfile
+
+            return soundfile.SoundFile(
+                file_path,
+                mode="w",
+                samplerate=self.sampling_rate,
+                channels=1,
+                subtype="PCM_16",
+                format="FLAC",
+            )
+
+        wav_file = wave.open(file_path, "wb")
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(self.samples_width)
+        wav_file.setframerate(self.sampling_rate)
+        return wav_file
+
+    def _write_frames(self, audio_file, audio_data):
+        if self.audio_format == "flac":
+            audio_file.write(np.frombuffer(audio_data, dtype="<i2"))
+        else:
+            audio_file.writeframes(audio_data)
+
+    def _write_audio(self, client_id, audio_data):
+        session = self._get_session(client_id)
+        samples_per_file = int(self.rotate_seconds * self.sampling_rate)
+        audio_data = audio_data[
+            : len(audio_data) - len(audio_data) % self.samples_width
+        ]
+
+        while audio_data:
+            if session["audio_file"] is None:
+                session["audio_file"] = self._open_audio_file(session)
+                session["samples_in_segment"] = 0
+
+            room = samples_per_file - session["samples_in_segment"]
+            frames = audio_data[: room * self.samples_width]
+            audio_data = audio_data[len(frames) :]  # noqa: E203
+            self._write_frames(session["audio_file"], frames)
+            session["samples_in_segment"] += len(frames) // self.samples_width
+
+            if session["samples_in_segment"] >= samples_per_file:
+                session["audio_file"].close()
+                session["audio_file"] = None
+                session["segment"] += 1
+
+    def _write_transcription(self, client_id, transcription):
+        session = self._get_session(client_id)
+        record = {"time": time.time(), "transcription": transcription}
+        session["transcripts_file"].write(json.dumps(record) + "\n")
+        session["transcripts_file"].flush()
+
+    def _close_session(self, client_id):
+        session = self._sessions.pop(client_id, None)
+        if session is None:
+            return
+        if session["audio_file"] is not None:
+            session["audio_file"].close()
+        session["transcripts_file"].close()
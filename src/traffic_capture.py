@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+# Each record: its time since the start of the session, its kind and the
+# length of its payload
+RECORD = struct.Struct("!dBI")
+
+# Record kinds
+SESSION = 0  # JSON header of the trace, always the first record
+AUDIO = 1  # Binary frame received from the client
+TEXT = 2  # Text message, such as a config message, received from the client
+RESULT = 3  # Message sent to the client
+
+
+class TrafficCapture:
+    """
+    Captures the traffic of every session to reproduce it later.
+
+    Each session is written to a '<session_id>.trace' file in the output
+    directory: a header with the WebSocket path of the session, then every
+    frame and message received from the client and every result sent to it,
+    each with the time elapsed since the start of the session. Frames are
+    stored exactly as received, before any decoding or conversion, so that
+    `python -m src.replay` can send them again to a server with the same
+    sizes and timing.
+
+    The files are opened, written and closed by a background thread shared
+    by all the sessions, so the receive path only costs a copy and never
+    waits for the disk. The records waiting for the thread are held in
+    memory; the capture is meant to be enabled while investigating.
+
+    Attributes:
+        output_dir (str): The directory of the traces.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="traffic-capture", daemon=True
+        )
+        self._thread.start()
+
+    def wrap(self, websocket, session_id):
+        """
+        Return a proxy of the websocket capturing its traffic to the trace
+        of the session.
+        """
+        trace = TraceWriter(
+            os.path.join(self.output_dir, f"{session_id}.trace"),
+            websocket.path,
+            self._queue,
+        )
+        return CapturingWebSocket(websocket, trace)
+
+    def stop(self):
+        """
+        Write all pending records, close every trace and stop the writer
+        thread. This call blocks until the thread has finished.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        files = {}
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            trace, data = item
+            try:
+                if data is None:
+                    file = files.pop(trace, None)
+                    if file is not None:
+                        file.close()
+                        logging.info(
+                            f"Saved the traffic capture {trace.file_path}"
+                        )
+                    continue
+                file = files.get(trace)
+                if file is None:
+                    file = files[trace] = open(trace.file_path, "wb")
+                file.write(data)
+            except OSError as e:
+                logging.error(f"Failed to write {trace.file_path}: {e}")
+        for file in files.values():
+            file.close()
+
+
+class TraceWriter:
+    """
+    Queues the records of a session for the writer thread of a
+    TrafficCapture.
+    """
+
+    def __init__(self, file_path, path, records):
+        self.file_path = file_path
+        self._records = records
+        self._start = time.monotonic()
+        self.write(
+            SESSION,
+            json.dumps({"path": path, "started": time.time()}).encode(),
+        )
+
+    def write(self, kind, payload):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        header = RECORD.pack(
+            time.monotonic() - self._start, kind, len(payload)
+        )
+        self._records.put((self, header + payload))
+
+    def close(self):
+        self._records.put((self, None))
+
+
+class CapturingWebSocket:
+    """
+    A WebSocket proxy recording the messages received and sent to a trace.
+    """
+
+    def __init__(self, websocket, trace):
+        self.websocket = websocket
+        self.trace = trace
+
+    async def recv(self):
+        message = await self.websocket.recv()
+        self.trace.write(
+            AUDIO if isinstance(message, bytes) else TEXT, message
+        )
+        return message
+
+    async def send(self, message):
+        self.trace.write(RESULT, message)
+        await self.websocket.send(message)
+
+    def close_trace(self):
+        self.trace.close()
+
+    def __getattr__(self, name):
+        return getattr(self.websocket, name)
+
+
+def read_trace(file_path):
+    """
+    Read the records of a trace.
+
+    Args:
+        file_path (str): The path of the trace.
+
+    Returns:
+        tuple: The header of the trace (dict) and the list of its other
+               records, as (time, kind, payload) tuples.
+    """
+    records = []
+    with open(file_path, "rb") as file:
+        data = file.read()
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        timestamp, kind, length = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        offset = start + length
+        if offset > len(data):
+            # The capture was interrupted in the middle of a record
+            break
+        records.append((timestamp, kind, data[start:offset]))
+    if not records or records[0][1] != SESSION:
+        raise ValueError(f"{file_path} is not a traffic capture")
+    return json.loads(records[0][2]), records[1:]
@@ -0,0 +1,75 @@
+import math
+
+import numpy as np
+
+
+class EnergyFrameVAD:
+    """
+    A cheap frame-level voice activity detector based on the energy of the
+    signal.
+
+    Unlike the VAD pipelines, which analyze a whole chunk with a neural
+    model, it classifies short frames of 16-bit PCM one at a time, fast
+    enough to run on every frame received from a client. A frame is speech
+    when its level exceeds both an absolute threshold and an estimate of
+    the background noise by a margin. The noise floor follows the level of
+    the frames, quickly when it drops and slowly when it rises, so the
+    detector adapts to the microphone and the room of each client.
+
+    Attributes:
+        sampling_rate (int): The sampling rate of the audio in Hz.
+        frame_ms (int): The duration of each frame in milliseconds.
+        threshold_db (float): The minimum level of speech, in dBFS.
+        margin_db (float): How far above the noise floor speech must be.
+        noise_floor_db (float): The current estimate of the noise level.
+    """
+
+    def __init__(
+        self,
+        sampling_rate=16000,
+        frame_ms=30,
+        threshold_db=-45.0,
+        margin_db=10.0,
+        noise_adaptation=0.05,
+    ):
+        self.sampling_rate = sampling_rate
+        self.frame_ms = frame_ms
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.noise_adaptation = noise_adaptation
+        self.noise_floor_db = threshold_db - margin_db
+        self.frame_bytes = sampling_rate * frame_ms // 1000 * 2
+
+    def is_speech(self, frame):
+        """
+        Classify a frame and update the noise floor.
+
+        Args:
+            frame (bytes-like): `frame_bytes` of mono 16-bit PCM.
+
+        Returns:
+            bool: Whether the frame contains speech.
+        """
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        rms = math.sqrt(float(np.dot(samples, samples)) / len(samples))
+        level_db = 20 * math.log10(max(rms / 32768, 1e-10))
+
+        speech = level_db > max(
+            self.threshold_db, self.noise_floor_db + self.margin_db
+        )
+        if level_db < self.noise_floor_db:
+            # Follow drops of the noise level immediately, down to the level
+            # below which the absolute threshold prevails anyway
+            self.noise_floor_db = max(
+                level_db, self.threshold_db - self.margin_db
+            )
+        else:
+            # Rise slowly, and even more slowly during speech, so that a
+            # loud steady background is eventually not taken for speech
+            adaptation = self.noise_adaptation
+            if speech:
+                adaptation /= 10
+            self.noise_floor_db += adaptation * (
+                level_db - self.noise_floor_db
+            )
+        return speech
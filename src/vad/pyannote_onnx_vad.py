@@ -0,0 +1,390 @@
+"""
+Pyannote segmentation VAD running on ONNX Runtime.
+
+The segmentation model is exported once to ONNX, optionally quantized to
+int8, next to a JSON file describing its windows and frames. It can be
+exported ahead of time, for example while building an image:
+
+    python -m src.vad.pyannote_onnx_vad onnx_models/segmentation.onnx \
+        --auth-token <token> --quantize
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+import numpy as np
+
+from .vad_batcher import VADBatcher
+from .vad_interface import VADInterface
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+DEFAULT_PYANNOTE_ARGS = {
+    "onset": 0.5,
+    "offset": 0.5,
+    "min_duration_on": 0.3,
+    "min_duration_off": 0.3,
+}
+
+
+def export_segmentation_model(
+    onnx_path,
+    model_name="pyannote/segmentation",
+    auth_token=None,
+    quantize=False,
+):
+    """
+    Export a pyannote segmentation model to ONNX.
+
+    Requires pyannote.audio and torch, and onnx to quantize. The windows and
+    frames of the model are saved to '<onnx_path>.json'.
+
+    :param onnx_path: The path of the exported model.
+    :param model_name: The pyannote model to export.
+    :param auth_token: The Hugging Face token giving access to the model.
+    :param quantize: Whether to quantize the weights to int8.
+    """
+    import torch
+    from pyannote.audio import Model
+
+    model = Model.from_pretrained(model_name, use_auth_token=auth_token)
+    model.eval()
+
+    specifications = model.specifications
+    if isinstance(specifications, tuple):
+        specifications = specifications[0]
+    sample_rate = model.hparams.sample_rate
+    window_samples = int(specifications.duration * sample_rate)
+    dummy = torch.zeros(1, 1, window_samples)
+    with torch.no_grad():
+        num_frames = model(dummy).shape[1]
+
+    # The frames of the output, in seconds from the start of the window
+    frames = getattr(model, "receptive_field", None)
+    if frames is None:
+        frames = model.example_output.frames
+    metadata = {
+        "model_name": model_name,
+        "sample_rate": sample_rate,
+        "window_seconds": specifications.duration,
+        "num_frames": num_frames,
+        "frame_start": frames.start,
+        "frame_duration": frames.duration,
+        "frame_step": frames.step,
+        "powerset": bool(getattr(specifications, "powerset", False)),
+    }
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    export_path = onnx_path + ".fp32" if quantize else onnx_path
+    torch.onnx.export(
+        model,
+        dummy,
+        export_path,
+        input_names=["waveform"],
+        output_names=["scores"],
+        dynamic_axes={"waveform": {0: "batch"}, "scores": {0: "batch"}},
+        opset_version=17,
+    )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(export_path, onnx_path, weight_type=QuantType.QInt8)
+        os.remove(export_path)
+
+    with open(onnx_path + ".json", "w") as file:
+        json.dump(metadata, file, indent=2)
+
+
+def binarize(
+    timestamps, scores, onset, offset, min_duration_on, min_duration_off
+):
+    """
+    Turn frame-level speech scores into speech regions, as pyannote's
+    Binarize: a region starts when the score rises above `onset` and ends
+    when it falls below `offset`; gaps shorter than `min_duration_off` are
+    then filled, and regions shorter than `min_duration_on` removed.
+
+    :param timestamps: The time of each frame, in seconds.
+    :param scores: The speech score of each frame.
+    :return: A list of (start, end, mean score) tuples.
+    """
+    regions = []
+    if len(scores) == 0:
+        return regions
+
+    start = 0
+    active = scores[0] > onset
+    for i in range(1, len(scores)):
+        if active and scores[i] < offset:
+            regions.append([start, i])
+            active = False
+        elif not active and scores[i] > onset:
+            start = i
+            active = True
+    if active:
+        regions.append([start, len(scores) - 1])
+
+    merged = []
+    for region in regions:
+        if (
+            merged
+            and timestamps[region[0]] - timestamps[merged[-1][1]]
+            < min_duration_off
+        ):
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+
+    results = []
+    for first, last in merged:
+        if timestamps[last] - timestamps[first] < min_duration_on:
+            continue
+        end = last + 1
+        results.append(
+            (
+                float(timestamps[first]),
+                float(timestamps[last]),
+                float(np.mean(scores[first:end])),
+            )
+        )
+    return results
+
+
+class PyannoteOnnxVAD(VADInterface):
+    """
+    Pyannote segmentation VAD running on ONNX Runtime.
+
+    Produces the same segments as PyannoteVAD, within the precision of the
+    exported model, without the PyTorch overhead: the audio is read from the
+    client's buffer instead of a file, cut into overlapping windows scored
+    in batches, and the scores are aggregated and binarized with the
+    'pyannote_args' thresholds. With 'batch_wait_ms', the windows of the
+    chunks of different clients analyzed at the same time are scored in the
+    same batches (see VADBatcher). The model is exported on first use if the
+    ONNX file does not exist yet, which requires pyannote.audio and torch.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initializes the ONNX Runtime session, exporting the model if needed.
+
+        Args:
+            model_name (str): The model name for Pyannote.
+            auth_token (str, optional): Authentication token for Hugging
+                                        Face, only needed for the export.
+            onnx_path (str): The path of the ONNX model. Defaults to a file
+                             named after the model in 'onnx_models'.
+            quantize (bool): Whether the exported model is quantized to
+                             int8.
+            pyannote_args (dict): The onset, offset, min_duration_on and
+                                  min_duration_off of the binarization.
+            step_ratio (float): The step between windows, relative to their
+                                duration.
+            batch_size (int): The maximum number of windows scored at once.
+            batch_wait_ms (float): How long the windows of a chunk wait for
+                                   those of other chunks to share a batch;
+                                   0, the default, scores each chunk on its
+                                   own.
+            num_threads (int): The number of threads of ONNX Runtime.
+        """
+        if onnxruntime is None:
+            raise ValueError("The pyannote_onnx VAD requires onnxruntime")
+
+        model_name = kwargs.get("model_name", "pyannote/segmentation")
+        quantize = kwargs.get("quantize", False)
+        onnx_path = kwargs.get("onnx_path")
+        if onnx_path is None:
+            suffix = "_int8" if quantize else ""
+            onnx_path = os.path.join(
+                "onnx_models", f"{model_name.replace('/', '_')}{suffix}.onnx"
+            )
+
+        if not os.path.exists(onnx_path):
+            auth_token = os.environ.get("PYANNOTE_AUTH_TOKEN")
+            if not auth_token:
+                auth_token = kwargs.get("auth_token")
+            if auth_token is None:
+                raise ValueError(
+                    f"{onnx_path} does not exist, exporting it requires the "
+                    "env var PYANNOTE_AUTH_TOKEN or the argument in "
+                    "--vad-args: 'auth_token'"
+                )
+            export_segmentation_model(
+                onnx_path, model_name, auth_token, quantize
+            )
+
+        with open(onnx_path + ".json") as file:
+            self.metadata = json.load(file)
+        self.pyannote_args = dict(
+            DEFAULT_PYANNOTE_ARGS, **kwargs.get("pyannote_args", {})
+        )
+        self.step_ratio = float(kwargs.get("step_ratio", 0.1))
+        self.batch_size = int(kwargs.get("batch_size", 32))
+        batch_wait_ms = float(kwargs.get("batch_wait_ms", 0))
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = int(kwargs.get("num_threads", 1))
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            onnx_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.batcher = None
+        if batch_wait_ms > 0:
+            self.batcher = VADBatcher(
+                self.score_windows,
+                max_batch_size=self.batch_size,
+                max_wait=batch_wait_ms / 1000,
+            )
+
+    async def detect_activity(self, client):
+        waveform = (
+            np.frombuffer(client.scratch_buffer, dtype="<i2").astype(
+                np.float32
+            )
+            / 32768.0
+        )
+        if self.batcher is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.detect_speech, waveform
+            )
+        activations = await self.batcher.submit(self.cut_windows(waveform))
+        return self.segments(len(waveform), activations)
+
+    def detect_speech(self, waveform):
+        """
+        Detect the speech regions of a mono waveform at the sample rate of
+        the model, with samples between -1 and 1.
+        """
+        windows = self.cut_windows(waveform)
+        scores = []
+        for first in range(0, len(windows), self.batch_size):
+            last = first + self.batch_size
+            scores.append(self.score_windows(windows[first:last]))
+        return self.segments(len(waveform), np.concatenate(scores))
+
+    def cut_windows(self, waveform):
+        """
+        Cut a waveform into windows of the duration of the model, every
+        'step_ratio' of it, the last one padded with silence.
+
+        Returns:
+            np.ndarray: The windows, shaped (windows, 1, samples).
+        """
+        window, step = self._window_and_step()
+        num_samples = len(waveform)
+        num_windows = 1
+        if num_samples > window:
+            num_windows += -(-(num_samples - window) // step)
+        padded = np.zeros((num_windows - 1) * step + window, dtype=np.float32)
+        padded[:num_samples] = waveform
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+        return np.ascontiguousarray(windows[::step, np.newaxis, :])
+
+    def score_windows(self, windows):
+        """
+        Run the model on a batch of windows.
+
+        Returns:
+            np.ndarray: The speech score of each frame of each window, its
+                        highest speaker activation.
+        """
+        (activations,) = self.session.run(None, {"waveform": windows})
+        if self.metadata["powerset"]:
+            # Log-probabilities of the speaker combinations, the first one
+            # being non-speech
+            return 1.0 - np.exp(activations[:, :, 0])
+        return activations.max(axis=-1)
+
+    def segments(self, num_samples, window_scores):
+        """
+        Aggregate the scores of the windows of a waveform of `num_samples`
+        and binarize them into speech segments.
+        """
+        timestamps, scores = self.speech_scores(num_samples, window_scores)
+        return [
+            {"start": start, "end": end, "confidence": confidence}
+            for start, end, confidence in binarize(
+                timestamps, scores, **self.pyannote_args
+            )
+        ]
+
+    def speech_scores(self, num_samples, window_scores):
+        """
+        Average the scores of the overlapping windows of a waveform with
+        Hamming weights, as pyannote's Inference does.
+
+        Returns:
+            tuple: The time of the center of each frame, in seconds, and the
+                   speech score of each frame.
+        """
+        metadata = self.metadata
+        sample_rate = metadata["sample_rate"]
+        frame_step = metadata["frame_step"]
+        _, step = self._window_and_step()
+        num_windows, num_frames = window_scores.shape
+
+        total_frames = (
+            int(round((num_windows - 1) * step / sample_rate / frame_step))
+            + num_frames
+        )
+        score_sum = np.zeros(total_frames, dtype=np.float64)
+        weight_sum = np.zeros(total_frames, dtype=np.float64)
+        hamming = np.hamming(num_frames)
+        for i, scores in enumerate(window_scores):
+            offset = int(round(i * step / sample_rate / frame_step))
+            end = offset + num_frames
+            score_sum[offset:end] += scores * hamming
+            weight_sum[offset:end] += hamming
+
+        timestamps = (
+            metadata["frame_start"]
+            + np.arange(total_frames) * frame_step
+            + metadata["frame_duration"] / 2
+        )
+        # Only keep the frames of the actual audio, not of the padding
+        keep = (timestamps < num_samples / sample_rate) & (weight_sum > 0)
+        return timestamps[keep], score_sum[keep] / weight_sum[keep]
+
+    def _window_and_step(self):
+        window = int(
+            self.metadata["window_seconds"] * self.metadata["sample_rate"]
+        )
+        return window, max(int(window * self.step_ratio), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export a pyannote segmentation model to ONNX for the "
+        "pyannote_onnx VAD"
+    )
+    parser.add_argument("onnx_path", help="The path of the exported model")
+    parser.add_argument(
+        "--model-name",
+        default="pyannote/segmentation",
+        help="The pyannote model to export",
+    )
+    parser.add_argument(
+        "--auth-token",
+        default=os.environ.get("PYANNOTE_AUTH_TOKEN"),
+        help="The Hugging Face token, default: $PYANNOTE_AUTH_TOKEN",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Quantize the weights of the model to int8",
+    )
+    args = parser.parse_args()
+    export_segmentation_model(
+        args.onnx_path, args.model_name, args.auth_token, args.quantize
+    )
+
+
+if __name__ == "__main__":
+    main()
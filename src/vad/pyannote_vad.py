@@ -1,3 +1,4 @@
+import asyncio
 import os
 from os import remove
 
@@ -54,8 +55,14 @@ class PyannoteVAD(VADInterface):
         audio_file_path = await save_audio_to_file(
             client.scratch_buffer, client.get_file_name()
         )
-        vad_results = self.vad_pipeline(audio_file_path)
-        remove(audio_file_path)
+        # The model runs in the default executor, so that the event loop
+        # keeps receiving audio and the ASR of other chunks keeps going
+        try:
+            vad_results = await asyncio.get_running_loop().run_in_executor(
+                None, self.vad_pipeline, audio_file_path
+            )
+        finally:
+            remove(audio_file_path)
         vad_segments = []
         if len(vad_results) > 0:
             vad_segments = [
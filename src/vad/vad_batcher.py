@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import numpy as np
+
+from src.metrics import metrics
+
+
+class VADBatcher:
+    """
+    Gathers the windows of concurrent VAD requests into batched forward
+    passes of the segmentation model.
+
+    A batch is run as soon as it holds `max_batch_size` windows, or when its
+    oldest request has waited `max_wait` seconds. While a batch runs, the
+    next requests accumulate, so under load the batches fill up without
+    waiting. A request with more windows than `max_batch_size` is run in
+    several passes. The size of the batches, the number of requests per
+    batch and the time the requests waited are reported in the
+    `vad_batch.*` metrics.
+
+    Attributes:
+        run_batch (callable): Runs the model on an array of windows and
+                              returns an array with one result per window.
+                              It is called in the default executor.
+        max_batch_size (int): The maximum number of windows per batch.
+        max_wait (float): The maximum time, in seconds, a request waits for
+                          others to join its batch.
+    """
+
+    def __init__(self, run_batch, max_batch_size=32, max_wait=0.005):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._pending_windows = 0
+        self._ready = None
+        self._full = None
+        self._worker = None
+        self._loop = None
+
+    async def submit(self, windows):
+        """
+        Score windows with the next batch.
+
+        Args:
+            windows (np.ndarray): The windows, along the first axis.
+
+        Returns:
+            np.ndarray: The results of the windows, in order.
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._loop is not loop:
+            self._loop = loop
+            self._ready = asyncio.Event()
+            self._full = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+        future = loop.create_future()
+        self._pending.append((windows, future, time.monotonic()))
+        self._pending_windows += len(windows)
+        self._ready.set()
+        if self._pending_windows >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+
+    def _take_batch(self):
+        batch = [self._pending.pop(0)]
+        size = len(batch[0][0])
+        while (
+            self._pending
+            and size + len(self._pending[0][0]) <= self.max_batch_size
+        ):
+            request = self._pending.pop(0)
+            batch.append(request)
+            size += len(request[0])
+        self._pending_windows -= size
+        return batch
+
+    def _run_in_passes(self, windows):
+        results = []
+        for start in range(0, len(windows), self.max_batch_size):
+            end = start + self.max_batch_size
+            results.append(self.run_batch(windows[start:end]))
+        return np.concatenate(results)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            delay = self._pending[0][2] + self.max_wait - time.monotonic()
+            if self._pending_windows < self.max_batch_size and delay > 0:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._take_batch()
+            start = time.monotonic()
+            for _, _, submitted in batch:
+                metrics.observe("vad_batch.wait_seconds", start - submitted)
+            windows = np.concatenate([request[0] for request in batch])
+            metrics.increment("vad_batch.batches")
+            metrics.observe("vad_batch.windows", len(windows))
+            metrics.observe("vad_batch.requests", len(batch))
+            try:
+                results = await loop.run_in_executor(
+                    None, self._run_in_passes, windows
+                )
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            metrics.observe("vad_batch.run_seconds", time.monotonic() - start)
+
+            offset = 0
+            for request_windows, future, _ in batch:
+                end = offset + len(request_windows)
+                if not future.done():
+                    future.set_result(results[offset:end])
+                offset = end
@@ -1,3 +1,4 @@
+from .pyannote_onnx_vad import PyannoteOnnxVAD
 from .pyannote_vad import PyannoteVAD
 
 
@@ -12,7 +13,8 @@ class VADFactory:
         Creates a VAD pipeline based on the specified type.
 
         Args:
-            type (str): The type of VAD pipeline to create (e.g., 'pyannote').
+            type (str): The type of VAD pipeline to create (e.g., 'pyannote'
+                        or 'pyannote_onnx').
             kwargs: Additional arguments for the VAD pipeline creation.
 
         Returns:
@@ -20,5 +22,7 @@ class VADFactory:
         """
         if type == "pyannote":
             return PyannoteVAD(**kwargs)
+        elif type == "pyannote_onnx":
+            return PyannoteOnnxVAD(**kwargs)
         else:
             raise ValueError(f"Unknown VAD pipeline type: {type}")
@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from src.asr.asr_model_pool import ASRModelPool
+from src.client import Client
+from src.metrics import metrics
+
+
+class FakeASR:
+    def __init__(self, model_size):
+        self.model_size = model_size
+
+    async def transcribe(self, client):
+        return {"text": self.model_size}
+
+
+class TestASRModelPool(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch(
+            "src.asr.asr_model_pool.ASRFactory.create_asr_pipeline",
+            side_effect=lambda asr_type, **kwargs: FakeASR(
+                kwargs["model_size"]
+            ),
+        )
+        self.create_asr_pipeline = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client("test_client", 16000, 2)
+
+    def transcribe(self, pool, model_name=None):
+        self.client.config["asr_model"] = model_name
+        return asyncio.run(pool.transcribe(self.client))["text"]
+
+    def test_models_are_loaded_lazily_and_shared(self):
+        pool = ASRModelPool(
+            "faster_whisper", models=["tiny", "small"], model_size="tiny"
+        )
+        self.assertEqual(self.create_asr_pipeline.call_count, 0)
+
+        self.assertEqual(self.transcribe(pool), "tiny")
+        self.assertEqual(self.transcribe(pool, "small"), "small")
+        self.assertEqual(self.transcribe(pool, "tiny"), "tiny")
+
+        self.assertEqual(self.create_asr_pipeline.call_count, 2)
+
+    def test_unknown_model_is_rejected(self):
+        pool = ASRModelPool("faster_whisper", models=["tiny"])
+        with self.assertRaises(ValueError):
+            self.transcribe(pool, "large-v3")
+
+    def test_least_recently_used_model_is_evicted(self):
+        pool = ASRModelPool(
+            "faster_whisper",
+            models=["tiny", "small", "large-v3"],
+            memory_budget_mb=3,
+            model_memory_mb={"tiny": 1, "small": 1, "large-v3": 2},
+        )
+        evictions = metrics.get_counter("asr_pool.evictions")
+
+        self.transcribe(pool, "tiny")
+        self.transcribe(pool, "small")
+        self.transcribe(pool, "tiny")
+        self.transcribe(pool, "large-v3")
+
+        self.assertEqual(list(pool._loaded), ["tiny", "large-v3"])
+        self.assertEqual(
+            metrics.get_counter("asr_pool.evictions"), evictions + 1
+        )
+
+    def test_model_stays_in_use_until_a_cancelled_inference_ends(self):
+        inference_done = None
+
+        class SlowASR(FakeASR):
+            async def transcribe(self, client):
+                # Like the inference thread, the work goes on when the
+                # caller is cancelled
+                await asyncio.shield(inference_done)
+                return await super().transcribe(client)
+
+        self.create_asr_pipeline.side_effect = (
+            lambda asr_type, **kwargs: SlowASR(kwargs["model_size"])
+        )
+        pool = ASRModelPool("faster_whisper", models=["tiny"])
+
+        async def run():
+            nonlocal inference_done
+            inference_done = asyncio.get_running_loop().create_future()
+            self.client.config["asr_model"] = "tiny"
+            task = asyncio.create_task(pool.transcribe(self.client))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.sleep(0.01)
+            in_use = pool._loaded["tiny"]["in_use"]
+            inference_done.set_result(None)
+            await asyncio.sleep(0.01)
+            return in_use, pool._loaded["tiny"]["in_use"]
+
+        self.assertEqual(asyncio.run(run()), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
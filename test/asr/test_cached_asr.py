@@ -0,0 +1,132 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from src.asr.cached_asr import CachedASR, audio_fingerprint
+from src.client import Client
+
+
+class CountingASR:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+
+    async def transcribe(self, client):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"text": f"call {self.calls}", "words": []}
+
+
+def make_client(audio, language=None):
+    client = Client("test_client", 16000, 2)
+    client.config["language"] = language
+    client.scratch_buffer = bytearray(audio)
+    return client
+
+
+def tone(seconds=0.5, amplitude=8000, frequency=440, padding=0):
+    t = np.arange(int(16000 * seconds)) / 16000
+    samples = amplitude * np.sin(2 * np.pi * frequency * t)
+    silence = np.zeros(padding)
+    return np.concatenate([silence, samples, silence]).astype("<i2").tobytes()
+
+
+class TestCachedASR(unittest.TestCase):
+    def test_repeated_audio_is_transcribed_once(self):
+        asr = CountingASR()
+        cached = CachedASR(asr)
+
+        async def run():
+            first = await cached.transcribe(make_client(tone()))
+            second = await cached.transcribe(make_client(tone()))
+            other = await cached.transcribe(make_client(tone(frequency=880)))
+            french = await cached.transcribe(make_client(tone(), "fr"))
+            return first, second, other, french
+
+        first, second, other, french = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertEqual(other["text"], "call 2")
+        self.assertEqual(french["text"], "call 3")
+
+        # The cached transcription is not shared with the callers
+        second["text"] = "modified"
+        again = asyncio.run(cached.transcribe(make_client(tone())))
+        self.assertEqual(again["text"], "call 1")
+
+    def test_padding_and_gain_do_not_change_the_fingerprint(self):
+        self.assertEqual(
+            audio_fingerprint(tone()),
+            audio_fingerprint(tone(amplitude=4000, padding=1600)),
+        )
+        self.assertNotEqual(
+            audio_fingerprint(tone()), audio_fingerprint(tone(seconds=0.6))
+        )
+
+    def test_concurrent_identical_requests_share_a_transcription(self):
+        asr = CountingASR(delay=0.05)
+        cached = CachedASR(asr)
+
+        async def run():
+            return await asyncio.gather(
+                *(cached.transcribe(make_client(tone())) for _ in range(3))
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(asr.calls, 1)
+        self.assertEqual([r["text"] for r in results], ["call 1"] * 3)
+
+    def test_waiters_take_over_a_cancelled_request(self):
+        asr = CountingASR(delay=0.05)
+        cached = CachedASR(asr)
+
+        async def run():
+            first = asyncio.create_task(cached.transcribe(make_client(tone())))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(
+                cached.transcribe(make_client(tone()))
+            )
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await asyncio.wait_for(second, 1)
+
+        self.assertEqual(asyncio.run(run())["text"], "call 2")
+        self.assertEqual(cached._in_flight, {})
+
+    def test_waiters_do_not_see_changes_of_the_first_caller(self):
+        cached = CachedASR(CountingASR(delay=0.05))
+
+        async def first_caller():
+            transcription = await cached.transcribe(make_client(tone()))
+            transcription["text"] = "modified"
+            return transcription
+
+        async def run():
+            return await asyncio.gather(
+                first_caller(), cached.transcribe(make_client(tone()))
+            )
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first["text"], "modified")
+        self.assertEqual(second["text"], "call 1")
+
+    def test_least_recently_used_entries_are_evicted(self):
+        asr = CountingASR()
+        cached = CachedASR(asr, max_entries=2)
+        frequencies = [440, 880, 440, 1320, 880]
+
+        async def run():
+            for frequency in frequencies:
+                await cached.transcribe(make_client(tone(frequency=frequency)))
+
+        asyncio.run(run())
+        # 880 was evicted by 1320, after 440 was used again
+        self.assertEqual(asr.calls, 4)
+
+        cached = CachedASR(asr, max_bytes=60)
+        asyncio.run(run())
+        self.assertEqual(len(cached._entries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
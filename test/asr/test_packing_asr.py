@@ -0,0 +1,119 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from src.asr.packing_asr import PackingASR
+from src.client import Client
+
+
+class WordsASR:
+    """
+    Transcribes each run of identical non-zero samples as a word named
+    after the value of the samples.
+    """
+
+    def __init__(self, word_timestamps=True):
+        self.word_timestamps = word_timestamps
+        self.calls = []
+
+    async def transcribe(self, client):
+        self.calls.append(client)
+        samples = np.frombuffer(client.scratch_buffer, dtype="<i2")
+        words = []
+        start = None
+        for index, value in enumerate(np.append(samples, 0)):
+            if start is not None and value != samples[start]:
+                words.append(
+                    {
+                        "word": f" w{samples[start]}",
+                        "start": start / 16000,
+                        "end": index / 16000,
+                    }
+                )
+                start = None
+            if start is None and value != 0:
+                start = index
+        return {
+            "language": "en",
+            "language_probability": 1.0,
+            "text": "".join(word["word"] for word in words).strip(),
+            "words": words if self.word_timestamps else "UNSUPPORTED",
+        }
+
+
+def make_client(client_id, values, language="english"):
+    client = Client(client_id, 16000, 2)
+    client.config["language"] = language
+    audio = np.concatenate(
+        [np.full(1600, value) if value else np.zeros(1600) for value in values]
+    )
+    client.scratch_buffer = bytearray(audio.astype("<i2").tobytes())
+    return client
+
+
+class TestPackingASR(unittest.TestCase):
+    def test_short_utterances_share_a_window(self):
+        asr = WordsASR()
+        packing = PackingASR(asr, gap_seconds=0.2)
+
+        async def run():
+            return await asyncio.gather(
+                packing.transcribe(make_client("a", [0, 1, 0, 2])),
+                packing.transcribe(make_client("b", [3, 0, 0, 0])),
+                packing.transcribe(make_client("c", [4], language="french")),
+            )
+
+        first, second, french = asyncio.run(run())
+        # The two english utterances are transcribed together
+        self.assertEqual(len(asr.calls), 2)
+        self.assertEqual(first["text"], "w1 w2")
+        self.assertEqual(second["text"], "w3")
+        self.assertEqual(french["text"], "w4")
+        # The timestamps are relative to each utterance again
+        self.assertAlmostEqual(first["words"][1]["start"], 0.3)
+        self.assertAlmostEqual(second["words"][0]["start"], 0.0)
+        self.assertAlmostEqual(second["words"][0]["end"], 0.1)
+
+    def test_windows_are_bounded_and_long_utterances_passed_through(self):
+        asr = WordsASR()
+        packing = PackingASR(
+            asr, window_seconds=1.0, gap_seconds=0.2, max_utterance_seconds=1
+        )
+
+        async def run():
+            return await asyncio.gather(
+                *(
+                    packing.transcribe(make_client(str(i), [i + 1] * 4))
+                    for i in range(3)
+                ),
+                packing.transcribe(make_client("long", [9] * 11)),
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(
+            [result["text"] for result in results], ["w1", "w2", "w3", "w9"]
+        )
+        # Two utterances of 0.4s fit in a window of 1s, the third does not
+        self.assertEqual(
+            sorted(len(call.scratch_buffer) for call in asr.calls),
+            [12800, 32000, 35200],
+        )
+
+    def test_pipelines_without_word_timestamps_fall_back(self):
+        asr = WordsASR(word_timestamps=False)
+        packing = PackingASR(asr)
+
+        async def run():
+            return await asyncio.gather(
+                packing.transcribe(make_client("a", [1])),
+                packing.transcribe(make_client("b", [2])),
+            )
+
+        first, second = asyncio.run(run())
+        self.assertEqual((first["text"], second["text"]), ("w1", "w2"))
+        self.assertEqual(len(asr.calls), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
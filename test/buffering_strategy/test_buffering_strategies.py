@@ -0,0 +1,235 @@
+import asyncio
+import unittest
+from test.fakes import FakeASR, FakeVAD, FakeWebSocket
+from unittest import mock
+
+from src.client import Client
+from src.metrics import Metrics
+from src.processing_pipeline import ProcessingPipeline
+
+CHUNK = b"\x01\x00" * 16000
+SPEECH = b"\xb8\x0b" * 8000
+SILENCE = bytes(16000)
+
+
+class FakeModelPool:
+    """
+    Transcribes each chunk to the model and chunk_id, taking `delays[model]`
+    seconds for the first chunk.
+    """
+
+    def __init__(self, delays):
+        self.delays = delays
+
+    async def transcribe(self, client):
+        return await self.transcribe_with("large", client)
+
+    async def transcribe_with(self, model_name, client):
+        if client.chunk_id.endswith("-1"):
+            await asyncio.sleep(self.delays.get(model_name, 0))
+        return {"text": f"{model_name} {client.chunk_id}"}
+
+
+def speculative_client():
+    client = Client("client", 16000, 2)
+    client.update_config(
+        {
+            "processing_strategy": "speculative_silence_at_end_of_chunk",
+            "processing_args": {
+                "chunk_length_seconds": 1,
+                "chunk_offset_seconds": 0.1,
+            },
+        }
+    )
+    return client
+
+
+class TestLatencyBreakdown(unittest.TestCase):
+    def test_transcription_carries_the_latency_of_its_chunk(self):
+        client = Client("client", 16000, 2)
+        strategy = client.buffering_strategy
+        websocket = FakeWebSocket()
+        timings = {
+            "arrival": 100.0,
+            "capture": 99.5,
+            "enqueue": 101.0,
+            "start": 101.5,
+            "vad_end": 101.75,
+            "asr_start": 102.0,
+            "asr_end": 103.0,
+        }
+
+        asyncio.run(
+            strategy.send_transcription(
+                websocket, {"text": "hello"}, "client-1", timings, 4.0
+            )
+        )
+        message = websocket.messages[0]
+        latency = message["latency"]
+        self.assertEqual(message["chunk_id"], "client-1")
+        self.assertEqual(latency["arrival_to_enqueue"], 1.0)
+        self.assertEqual(latency["queue_wait"], 0.5)
+        self.assertEqual(latency["vad"], 0.25)
+        self.assertEqual(latency["asr_queue_wait"], 0.25)
+        self.assertEqual(latency["asr"], 1.0)
+        self.assertEqual(latency["capture_to_arrival"], 0.5)
+        self.assertGreaterEqual(latency["deliver_wait"], 0)
+        self.assertAlmostEqual(
+            latency["end_to_end"] - latency["deliver_wait"], 3.5
+        )
+        self.assertAlmostEqual(
+            latency["rtf"], message["processing_time"] / 4.0
+        )
+
+
+class TestAdaptiveChunkLength(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(ewma_alpha=1.0)
+        patcher = mock.patch(
+            "src.buffering_strategy.buffering_strategies.metrics",
+            self.metrics,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client("client", 16000, 2)
+        self.client.update_config(
+            {
+                "processing_args": {
+                    "chunk_length_seconds": 2,
+                    "chunk_offset_seconds": 0.1,
+                    "adaptive_chunk_length": True,
+                    "min_chunk_length_seconds": 1.5,
+                    "max_chunk_length_seconds": 3,
+                    "max_chunks_in_flight": 2,
+                }
+            }
+        )
+        self.strategy = self.client.buffering_strategy
+
+    def test_length_follows_the_real_time_factor_within_bounds(self):
+        self.metrics.observe("buffering.rtf", 0.8)
+        self.strategy.adapt_chunk_length()
+        self.assertEqual(self.strategy.chunk_length_seconds, 2.5)
+        self.strategy.adapt_chunk_length()
+        self.assertEqual(self.strategy.chunk_length_seconds, 3)
+
+        # Between rtf_low and rtf_high the length is kept
+        self.metrics.observe("buffering.rtf", 0.4)
+        self.strategy.adapt_chunk_length()
+        self.assertEqual(self.strategy.chunk_length_seconds, 3)
+
+        self.metrics.observe("buffering.rtf", 0.1)
+        for _ in range(5):
+            self.strategy.adapt_chunk_length()
+        self.assertEqual(self.strategy.chunk_length_seconds, 1.5)
+        self.assertEqual(
+            self.metrics.get_counter(
+                "buffering.chunk_length_adjustments.down"
+            ),
+            4,
+        )
+
+    def test_chunks_in_flight_of_the_pipeline_lengthen_the_chunks(self):
+        self.metrics.observe("buffering.rtf", 0.1)
+        self.client.pipeline = ProcessingPipeline()
+        self.client.pipeline.chunks_in_flight = 3
+        self.strategy.adapt_chunk_length()
+        self.assertEqual(self.strategy.chunk_length_seconds, 2.5)
+
+        # Without a pipeline only the chunks of the client count
+        self.client.pipeline = None
+        self.strategy.adapt_chunk_length()
+        self.assertEqual(self.strategy.chunk_length_seconds, 2)
+
+
+class TestSpeculativeSilenceAtEndOfChunk(unittest.TestCase):
+    def run_chunks(self, client, pool, before_close=1.0):
+        websocket = FakeWebSocket()
+
+        async def run():
+            for _ in range(2):
+                client.append_audio_data(CHUNK + b"\x00\x00")
+                client.process_audio(websocket, FakeVAD(), pool)
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(before_close)
+            client.close()
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+        return [
+            (message["type"], message["text"])
+            for message in websocket.messages
+        ]
+
+    def test_finals_are_sent_in_chunk_order(self):
+        client = speculative_client()
+        messages = self.run_chunks(client, FakeModelPool({"large": 0.3}))
+        self.assertEqual(
+            messages,
+            [
+                ("draft", "tiny client-1"),
+                ("draft", "tiny client-2"),
+                ("final", "large client-1"),
+                ("final", "large client-2"),
+            ],
+        )
+        self.assertEqual(client.buffering_strategy.in_flight, 0)
+
+    def test_final_passes_are_cancelled_on_close(self):
+        client = speculative_client()
+        messages = self.run_chunks(
+            client, FakeModelPool({"large": 0.3}), before_close=0.1
+        )
+        self.assertEqual(
+            messages, [("draft", "tiny client-1"), ("draft", "tiny client-2")]
+        )
+        self.assertEqual(client.buffering_strategy.final_tasks, set())
+
+
+class TestVADEndpointing(unittest.TestCase):
+    def setUp(self):
+        self.client = Client("client", 16000, 2)
+        self.client.update_config(
+            {"processing_strategy": "vad_endpointing", "processing_args": {}}
+        )
+        self.websocket = FakeWebSocket()
+
+    def test_utterances_are_transcribed_at_their_end(self):
+        asr = FakeASR()
+
+        async def run():
+            # A blip shorter than min_utterance_seconds is noise
+            self.client.append_audio_data(SPEECH[:3000] + SILENCE)
+            self.client.append_audio_data(SPEECH + SILENCE)
+            self.client.process_audio(self.websocket, FakeVAD(), asr)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(
+            [message["text"] for message in self.websocket.messages],
+            ["client-1"],
+        )
+        self.assertEqual(self.client.buffering_strategy.in_flight, 0)
+
+    def test_utterances_closed_before_the_asr_stage_are_not_in_flight(self):
+        asr = FakeASR([0.2, 0.2, 0.2])
+        pipeline = ProcessingPipeline(asr_workers=1, queue_size=1)
+        self.client.pipeline = pipeline
+
+        async def run():
+            for _ in range(3):
+                self.client.append_audio_data(SPEECH + SILENCE)
+                self.client.process_audio(self.websocket, FakeVAD(), asr)
+                await asyncio.sleep(0.01)
+            # The third utterance waits for room in the ASR stage
+            self.client.close()
+            await asyncio.sleep(0.5)
+            pipeline.close()
+
+        asyncio.run(run())
+        self.assertEqual(self.client.buffering_strategy.in_flight, 0)
+        self.assertEqual(pipeline.chunks_in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import time
+
+
+class FakeWebSocket:
+    """
+    Records the messages sent, and receives those put in `incoming`; an
+    exception put in `incoming` is raised by `recv`.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.close_code = None
+        self.incoming = asyncio.Queue()
+
+    async def recv(self):
+        message = await self.incoming.get()
+        if isinstance(message, BaseException):
+            raise message
+        return message
+
+    async def send(self, message):
+        self.messages.append(json.loads(message))
+
+    async def close(self, code=1000, reason=""):
+        self.close_code = code
+
+
+class FakeVAD:
+    """
+    Finds speech at the start of every chunk, after `delay` seconds.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def detect_activity(self, client):
+        start = time.monotonic()
+        await asyncio.sleep(self.delay)
+        self.calls.append((start, time.monotonic()))
+        return [{"start": 0.0, "end": 0.2, "confidence": 1.0}]
+
+
+class FakeASR:
+    """
+    Transcribes each chunk to its chunk_id, taking the next of `delays`
+    seconds, and records the config of the chunks.
+    """
+
+    def __init__(self, delays=None):
+        self.delays = list(delays or [])
+        self.calls = []
+        self.configs = []
+
+    async def transcribe(self, client):
+        start = time.monotonic()
+        self.configs.append(client.config)
+        await asyncio.sleep(self.delays.pop(0) if self.delays else 0)
+        self.calls.append((start, time.monotonic()))
+        return {"text": client.chunk_id}
@@ -0,0 +1,108 @@
+# isort: skip_file
+
+import asyncio
+import os
+import unittest
+
+from src.client import Client
+from src.inference.process_pool import (
+    ProcessPool,
+    ProcessPoolASR,
+    ProcessPoolVAD,
+)
+
+
+class StubVAD:
+    async def detect_activity(self, client):
+        return [{"start": 0.0, "end": 1.0, "confidence": 1.0}]
+
+
+class StubASR:
+    async def transcribe(self, client):
+        if client.config.get("crash"):
+            os._exit(1)
+        return {
+            "text": bytes(client.scratch_buffer[:4]).hex(),
+            "tail": bytes(client.scratch_buffer[-4:]).hex(),
+            "length": len(client.scratch_buffer),
+            "pid": os.getpid(),
+        }
+
+
+def create_stub_pipelines(args):
+    return StubVAD(), StubASR()
+
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.client = Client("test_client", 16000, 2)
+        self.client.scratch_buffer = bytearray(b"\x01\x02\x03\x04" * 8000)
+
+    def run_pool(self, coroutine_function, **kwargs):
+        async def run():
+            pool = ProcessPool(create_stub_pipelines, None, **kwargs)
+            try:
+                return await coroutine_function(pool)
+            finally:
+                pool.stop()
+
+        return asyncio.run(run())
+
+    def test_audio_is_handed_over_to_the_processes(self):
+        async def run(pool):
+            vad_results = await ProcessPoolVAD(pool).detect_activity(
+                self.client
+            )
+            transcriptions = await asyncio.gather(
+                *(
+                    ProcessPoolASR(pool).transcribe(self.client)
+                    for _ in range(8)
+                )
+            )
+            return vad_results, transcriptions
+
+        vad_results, transcriptions = self.run_pool(run, processes=2, slots=3)
+        # transcribe_with is only exposed when several models are served
+        self.assertFalse(hasattr(ProcessPoolASR(None), "transcribe_with"))
+        self.assertEqual(vad_results[0]["end"], 1.0)
+        for transcription in transcriptions:
+            self.assertEqual(transcription["text"], "01020304")
+            self.assertEqual(transcription["length"], 32000)
+        self.assertEqual(len({t["pid"] for t in transcriptions}), 2)
+
+    def test_chunks_larger_than_a_slot_are_split_or_given_a_block(self):
+        async def run(pool):
+            asr = ProcessPoolASR(pool)
+            self.client.scratch_buffer[-4:] = b"\x05\x06\x07\x08"
+            split = await asyncio.gather(
+                asr.transcribe(self.client), asr.transcribe(self.client)
+            )
+            self.client.scratch_buffer += bytes(40000)
+            oversized = await asr.transcribe(self.client)
+            return split, oversized, pool._free_slots.qsize()
+
+        split, oversized, free_slots = self.run_pool(
+            run, processes=1, slots=4, slot_bytes=10000
+        )
+        for transcription in split:
+            self.assertEqual(transcription["length"], 32000)
+            self.assertEqual(transcription["tail"], "05060708")
+        self.assertEqual(oversized["length"], 72000)
+        self.assertEqual(oversized["tail"], "00000000")
+        self.assertEqual(free_slots, 4)
+
+    def test_dead_processes_are_restarted(self):
+        async def run(pool):
+            asr = ProcessPoolASR(pool)
+            self.client.config["crash"] = True
+            with self.assertRaises(RuntimeError):
+                await asr.transcribe(self.client)
+            self.client.config["crash"] = False
+            return await asr.transcribe(self.client)
+
+        transcription = self.run_pool(run, processes=1)
+        self.assertEqual(transcription["length"], 32000)
+
+
+if __name__ == "__main__":
+    unittest.main()
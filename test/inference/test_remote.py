@@ -0,0 +1,122 @@
+import asyncio
+import socket
+import unittest
+
+from src.client import Client
+from src.inference.remote import RemoteASR, RemoteVAD, WorkerPool
+from src.inference.worker import InferenceWorker
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubVAD:
+    async def detect_activity(self, client):
+        return [{"start": 0.0, "end": 1.0, "confidence": 1.0}]
+
+
+class StubASR:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+
+    async def transcribe(self, client):
+        self.calls += 1
+        await asyncio.sleep(client.config.get("delay", 0))
+        if client.config.get("fail"):
+            raise ValueError("cannot transcribe")
+        return {
+            "text": f"{self.name}:{len(client.scratch_buffer)}",
+            "client_id": client.client_id,
+        }
+
+
+class TestRemoteInference(unittest.TestCase):
+    def setUp(self):
+        self.client = Client("test_client", 16000, 2)
+        self.client.scratch_buffer = bytearray(b"\x01\x00" * 16000)
+
+    async def start_workers(self, count, request_timeout=5):
+        workers = []
+        for i in range(count):
+            worker = InferenceWorker(
+                StubVAD(), StubASR(f"worker{i}"), "127.0.0.1", free_port()
+            )
+            await worker.start()
+            workers.append(worker)
+        pool = WorkerPool(
+            [f"127.0.0.1:{worker.port}" for worker in workers],
+            health_check_interval=0.5,
+            request_timeout=request_timeout,
+        )
+        return workers, pool
+
+    def test_chunks_are_processed_remotely(self):
+        async def run():
+            workers, pool = await self.start_workers(1)
+            vad_results = await RemoteVAD(pool).detect_activity(self.client)
+            transcription = await RemoteASR(pool).transcribe(self.client)
+            await pool.close()
+            await workers[0].stop()
+            return vad_results, transcription
+
+        vad_results, transcription = asyncio.run(run())
+        self.assertEqual(vad_results[0]["end"], 1.0)
+        self.assertEqual(transcription["text"], "worker0:32000")
+        self.assertEqual(transcription["client_id"], "test_client")
+
+    def test_requests_fail_over_to_healthy_workers(self):
+        async def run():
+            workers, pool = await self.start_workers(2)
+            asr = RemoteASR(pool)
+            await asr.transcribe(self.client)
+            await workers[0].stop()
+            texts = [
+                (await asr.transcribe(self.client))["text"] for _ in range(4)
+            ]
+            await pool.close()
+            await workers[1].stop()
+            return texts
+
+        self.assertEqual(asyncio.run(run()), ["worker1:32000"] * 4)
+
+    def test_worker_errors_are_not_retried(self):
+        self.client.config["fail"] = True
+
+        async def run():
+            workers, pool = await self.start_workers(1)
+            try:
+                with self.assertRaises(RuntimeError):
+                    await RemoteASR(pool).transcribe(self.client)
+            finally:
+                await pool.close()
+                await workers[0].stop()
+
+        asyncio.run(run())
+
+    def test_timed_out_transcriptions_are_not_retried(self):
+        self.client.config["delay"] = 0.5
+
+        async def run():
+            workers, pool = await self.start_workers(2, request_timeout=0.1)
+            asr = RemoteASR(pool)
+            try:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asr.transcribe(self.client)
+            finally:
+                await pool.close()
+                for worker in workers:
+                    await worker.stop()
+            return asr, [worker.asr_pipeline.calls for worker in workers]
+
+        asr, calls = asyncio.run(run())
+        self.assertEqual(sorted(calls), [0, 1])
+        # The workers are not known to serve several models
+        self.assertFalse(hasattr(asr, "transcribe_with"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+from http import HTTPStatus
+from test.fakes import FakeASR, FakeWebSocket
+
+from src.processing_pipeline import ProcessingPipeline
+from src.server import SERVICE_RESTART, Server
+
+
+class ContinuousSpeechVAD:
+    """
+    Finds speech running until the end of every chunk.
+    """
+
+    async def detect_activity(self, client):
+        duration = len(client.scratch_buffer) / (
+            client.sampling_rate * client.samples_width
+        )
+        return [{"start": 0.0, "end": duration, "confidence": 1.0}]
+
+
+class TestDrain(unittest.TestCase):
+    def test_buffered_audio_is_transcribed_before_closing(self):
+        asr = FakeASR()
+        server = Server(
+            ContinuousSpeechVAD(), asr, pipeline=ProcessingPipeline()
+        )
+        websocket = FakeWebSocket()
+
+        async def run():
+            client = server.create_client("client", websocket)
+            # The speech of the first chunk goes on, it is kept for the next
+            await server.receive_payload(client, websocket, bytes(192000))
+            await asyncio.sleep(0.1)
+            await server.receive_payload(client, websocket, bytes(32000))
+            self.assertEqual(asr.calls, [])
+
+            drain = asyncio.create_task(server.drain(timeout=5))
+            await asyncio.sleep(0)
+            self.assertEqual(
+                (await server.process_request("/ready", {}))[0],
+                HTTPStatus.SERVICE_UNAVAILABLE,
+            )
+            await drain
+            # Audio received while draining is dropped
+            await server.receive_payload(client, websocket, bytes(192000))
+            await asyncio.sleep(0.1)
+            server.pipeline.close()
+            return client
+
+        client = asyncio.run(run())
+        self.assertEqual(websocket.close_code, SERVICE_RESTART)
+        self.assertEqual(
+            [message.get("type") for message in websocket.messages],
+            ["reconnect", None],
+        )
+        self.assertEqual(websocket.messages[1]["text"], "client-2")
+        self.assertEqual(len(asr.calls), 1)
+        self.assertEqual(client.buffering_strategy.in_flight, 0)
+        self.assertTrue(server.get_stats()["draining"])
+
+
+if __name__ == "__main__":
+    unittest.main()
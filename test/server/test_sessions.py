@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import shutil
+import unittest
+from test.fakes import FakeASR, FakeVAD, FakeWebSocket
+from unittest import mock
+
+from src.server import STREAM_HEADER, Server
+
+
+class TestConfig(unittest.TestCase):
+    def test_unknown_asr_model_is_rejected(self):
+        server = Server(FakeVAD(), FakeASR(), asr_models=["tiny", "small"])
+        websocket = FakeWebSocket()
+
+        async def run():
+            client = server.create_client("client", websocket)
+            await server.apply_config(client, websocket, {"asr_model": "big"})
+            await server.apply_config(client, websocket, {"asr_model": "tiny"})
+            await server.apply_config(
+                client, websocket, {"result_encoding": "xml"}
+            )
+            await client.outbound.flush(1)
+            client.outbound.close()
+            return client
+
+        client = asyncio.run(run())
+        self.assertEqual(client.config["asr_model"], "tiny")
+        self.assertNotIn("result_encoding", client.config)
+        self.assertEqual(
+            [message["type"] for message in websocket.messages],
+            ["error", "error"],
+        )
+        self.assertIn("tiny, small", websocket.messages[0]["error"])
+
+    @unittest.skipIf(shutil.which("false") is None, "false not available")
+    def test_failed_decoder_is_reported_once(self):
+        server = Server(FakeVAD(), FakeASR())
+        websocket = FakeWebSocket()
+
+        async def run():
+            client = server.create_client("client", websocket)
+            await server.apply_config(client, websocket, {"codec": "flac"})
+            await client.decoder._process.wait()
+            for _ in range(2):
+                await server.receive_payload(client, websocket, bytes(100000))
+            await client.outbound.flush(1)
+            await server.close_client(client)
+            return client
+
+        with mock.patch.dict(os.environ, {"FFMPEG_BINARY": "false"}):
+            client = asyncio.run(run())
+        self.assertTrue(client.decoder.failed)
+        self.assertEqual(
+            [message["type"] for message in websocket.messages], ["error"]
+        )
+        self.assertEqual(len(client.buffer), 0)
+
+
+class TestMultiplexedStreams(unittest.TestCase):
+    def run_connection(self, server, messages, settle=0.2):
+        websocket = FakeWebSocket()
+
+        async def run():
+            handler = asyncio.create_task(
+                server.handle_multiplexed_audio("conn", websocket)
+            )
+            for message in messages:
+                websocket.incoming.put_nowait(message)
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(settle)
+            websocket.incoming.put_nowait(ConnectionError())
+            with self.assertRaises(ConnectionError):
+                await handler
+
+        asyncio.run(run())
+        return websocket.messages
+
+    def test_invalid_messages_and_extra_streams_are_rejected(self):
+        server = Server(FakeVAD(), FakeASR(), max_streams=1)
+        messages = self.run_connection(
+            server,
+            [
+                json.dumps({"type": "config", "stream_id": 1, "data": "tiny"}),
+                "not json",
+                "[1]",
+                STREAM_HEADER.pack(2) + bytes(100),
+                STREAM_HEADER.pack(2) + bytes(100),
+            ],
+        )
+        self.assertEqual(
+            [(m["type"], m["stream_id"]) for m in messages],
+            [("error", 1), ("error", 2)],
+        )
+        self.assertEqual(messages[1]["error"], "too_many_streams")
+        self.assertEqual(server.connected_clients, {})
+
+    def test_closed_streams_deliver_their_buffered_audio(self):
+        server = Server(FakeVAD(), FakeASR())
+        messages = self.run_connection(
+            server,
+            [
+                STREAM_HEADER.pack(1) + bytes(32000),
+                STREAM_HEADER.pack(2) + bytes(32000),
+                json.dumps({"type": "close_stream", "stream_id": 1}),
+                # Dropped while the stream is closing
+                STREAM_HEADER.pack(1) + bytes(32000),
+            ],
+        )
+        self.assertEqual(
+            [(m["text"], m["stream_id"]) for m in messages],
+            [("conn-1-1", 1)],
+        )
+        self.assertEqual(server.connected_clients, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import os
+import shutil
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src.audio_decoder import StreamingAudioDecoder
+
+
+class TestStreamingAudioDecoder(unittest.TestCase):
+    def decode(self, codec, frames):
+        decoded = bytearray()
+
+        async def on_audio(audio_data):
+            decoded.extend(audio_data)
+
+        async def run():
+            decoder = StreamingAudioDecoder(codec, 16000, on_audio)
+            await decoder.start()
+            for frame in frames:
+                await decoder.feed(frame)
+            await decoder.close()
+
+        asyncio.run(run())
+        return bytes(decoded)
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+    def test_flac_frames_are_decoded_to_pcm(self):
+        import soundfile
+
+        samples = (np.sin(np.arange(16000) / 10) * 8000).astype("<i2")
+        flac = io.BytesIO()
+        soundfile.write(flac, samples, 16000, format="FLAC")
+        data = flac.getvalue()
+        # Fed in small frames, as sent by a streaming client
+        frames = []
+        while data:
+            frames.append(data[:1000])
+            data = data[1000:]
+
+        decoded = self.decode("flac", frames)
+        np.testing.assert_array_equal(
+            np.frombuffer(decoded, dtype="<i2"), samples
+        )
+
+    @unittest.skipIf(shutil.which("false") is None, "false not available")
+    def test_exited_decoder_is_reported(self):
+        with mock.patch.dict(os.environ, {"FFMPEG_BINARY": "false"}):
+
+            async def on_audio(audio_data):
+                pass
+
+            async def run():
+                decoder = StreamingAudioDecoder("flac", 16000, on_audio)
+                await decoder.start()
+                await decoder._process.wait()
+                with self.assertRaises(ValueError):
+                    await decoder.feed(bytes(100000))
+                await decoder.close()
+                return decoder
+
+            self.assertTrue(asyncio.run(run()).failed)
+
+        with self.assertRaises(ValueError):
+            StreamingAudioDecoder("mp3", 16000, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
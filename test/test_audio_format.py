@@ -0,0 +1,76 @@
+import unittest
+
+import numpy as np
+
+from src.audio_format import AudioFormatConverter, PolyphaseResampler
+from src.client import Client
+
+
+class TestPolyphaseResampler(unittest.TestCase):
+    def sine(self, rate, seconds, frequency=440.0):
+        t = np.arange(int(rate * seconds)) / rate
+        return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+    def test_streaming_matches_one_shot(self):
+        signal = self.sine(44100, 1.0)
+
+        one_shot = PolyphaseResampler(44100, 16000).process(signal)
+
+        resampler = PolyphaseResampler(44100, 16000)
+        frames = [
+            resampler.process(signal[i : i + 1234])  # noqa: E203
+            for i in range(0, len(signal), 1234)
+        ]
+        streamed = np.concatenate(frames)
+
+        self.assertEqual(len(one_shot), len(streamed))
+        np.testing.assert_allclose(one_shot, streamed, atol=1e-5)
+
+    def test_output_length_and_content(self):
+        signal = self.sine(48000, 1.0)
+        output = PolyphaseResampler(48000, 16000).process(signal)
+
+        self.assertAlmostEqual(len(output), 16000, delta=16)
+        expected = self.sine(16000, 1.0)[: len(output)]
+        # Ignore the filter transient at the start
+        np.testing.assert_allclose(output[100:], expected[100:], atol=1e-2)
+
+
+class TestAudioFormatConverter(unittest.TestCase):
+    def test_no_converter_for_native_format(self):
+        self.assertIsNone(AudioFormatConverter.from_config({}, 16000))
+        self.assertIsNone(
+            AudioFormatConverter.from_config(
+                {"sampleRate": 16000, "channels": 1}, 16000
+            )
+        )
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            AudioFormatConverter.from_config({"sampleFormat": "mp3"}, 16000)
+
+    def test_stereo_float32_is_downmixed(self):
+        converter = AudioFormatConverter.from_config(
+            {"sampleRate": 16000, "channels": 2, "sampleFormat": "float32"},
+            16000,
+        )
+        frames = np.array([[0.5, 0.0], [-0.5, -0.5]], dtype="<f4").tobytes()
+
+        # Split in the middle of a sample frame
+        output = converter.convert(frames[:5]) + converter.convert(frames[5:])
+
+        np.testing.assert_array_equal(
+            np.frombuffer(output, dtype="<i2"), [8192, -16384]
+        )
+
+    def test_client_resamples_to_server_rate(self):
+        client = Client("test_client", 16000, 2)
+        client.update_config({"sampleRate": 48000, "sampleFormat": "int16"})
+
+        client.append_audio_data(np.zeros(48000, dtype="<i2").tobytes())
+
+        self.assertAlmostEqual(len(client.buffer), 32000, delta=64)
+
+
+if __name__ == "__main__":
+    unittest.main()
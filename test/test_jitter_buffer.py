@@ -0,0 +1,66 @@
+import time
+import unittest
+from unittest import mock
+
+from src.jitter_buffer import FRAME_HEADER, ClockSync, JitterBuffer
+
+
+def frame(sequence, audio=b"\x01\x00" * 4, capture_time=None):
+    if capture_time is None:
+        capture_time = 1000.0 + sequence
+    return FRAME_HEADER.pack(sequence, capture_time) + audio
+
+
+class TestJitterBuffer(unittest.TestCase):
+    def test_reorders_and_drops_duplicates(self):
+        jitter_buffer = JitterBuffer(depth=3)
+        self.assertEqual(len(jitter_buffer.push(frame(10))), 1)
+        self.assertEqual(jitter_buffer.push(frame(12)), [])
+        self.assertEqual(jitter_buffer.push(frame(12)), [])
+        ready = jitter_buffer.push(frame(11))
+        self.assertEqual([capture for capture, _ in ready], [1011.0, 1012.0])
+        self.assertEqual(jitter_buffer.push(frame(11)), [])
+        self.assertEqual(jitter_buffer.next_sequence, 13)
+
+    def test_fills_lost_frames_with_silence(self):
+        jitter_buffer = JitterBuffer(depth=2, max_gap_frames=2)
+        jitter_buffer.push(frame(0))
+        # Frames 1 to 3 are lost
+        self.assertEqual(jitter_buffer.push(frame(4)), [])
+        self.assertEqual(jitter_buffer.push(frame(5)), [])
+        ready = jitter_buffer.push(frame(6))
+        self.assertEqual(
+            ready,
+            [(None, bytes(8)), (None, bytes(8))]
+            + [(1000.0 + i, b"\x01\x00" * 4) for i in (4, 5, 6)],
+        )
+        # A lost frame arriving late is dropped
+        self.assertEqual(jitter_buffer.push(frame(2)), [])
+
+        with self.assertRaises(ValueError):
+            jitter_buffer.push(b"\x00")
+
+
+class TestClockSync(unittest.TestCase):
+    def test_keeps_the_offset_of_the_shortest_round_trip(self):
+        clock_sync = ClockSync()
+        self.assertIsNone(clock_sync.to_server_time(5.0))
+        with mock.patch("src.jitter_buffer.time.time", return_value=100.0):
+            ping = clock_sync.ping()
+
+        # The client clock is 50s ahead; the first echo was delayed on the
+        # way back
+        with mock.patch("src.jitter_buffer.time.time", return_value=101.0):
+            clock_sync.on_echo(dict(ping, client_time=150.1))
+        with mock.patch("src.jitter_buffer.time.time", return_value=100.2):
+            clock_sync.on_echo(dict(ping, client_time=150.1))
+        self.assertAlmostEqual(clock_sync.offset, 50.0)
+        self.assertAlmostEqual(clock_sync.round_trip, 0.2)
+        self.assertAlmostEqual(clock_sync.to_server_time(160.0), 110.0)
+
+        with self.assertRaises(ValueError):
+            clock_sync.on_echo({"server_time": time.time()})
+
+
+if __name__ == "__main__":
+    unittest.main()
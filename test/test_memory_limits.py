@@ -0,0 +1,86 @@
+import asyncio
+import gc
+import unittest
+from test.fakes import FakeWebSocket
+
+from src.client import Client
+from src.memory_limits import MemoryLimiter, memory_stats
+from src.outbound_queue import OutboundQueue
+
+
+def make_client(client_id, scratch_bytes=0, buffer_bytes=0):
+    client = Client(client_id, 16000, 2)
+    client.scratch_buffer += b"\x01" * scratch_bytes
+    client.buffer += b"\x02" * buffer_bytes
+    return client
+
+
+class TestMemoryLimits(unittest.TestCase):
+    def test_usage_includes_pending_chunks_and_results(self):
+        async def run():
+            client = make_client("client", scratch_bytes=1000)
+            client.outbound = OutboundQueue(FakeWebSocket())
+            snapshot = client.snapshot("client-1")
+            client.outbound.put({"text": "hello", "chunk_id": "client-1"})
+            usage = client.memory_usage()
+            client.outbound.close()
+            del snapshot
+            gc.collect()
+            return usage, client.memory_usage()
+
+        usage, released = asyncio.run(run())
+        self.assertEqual(usage["pending_chunks"], 1000)
+        self.assertGreater(usage["outbound"], 0)
+        self.assertEqual(
+            usage["total"], 2000 + usage["outbound"] + usage["buffer"]
+        )
+        self.assertEqual(released["pending_chunks"], 0)
+
+    def test_sessions_above_their_limit_are_trimmed_or_closed(self):
+        limiter = MemoryLimiter(session_max_bytes=1000)
+        client = make_client("client", scratch_bytes=901, buffer_bytes=300)
+        self.assertTrue(limiter.check_session(client))
+        # The oldest audio is dropped first, in whole samples
+        self.assertEqual(len(client.scratch_buffer), 699)
+        self.assertEqual(len(client.buffer), 300)
+
+        # The audio being analyzed by the VAD is left alone
+        client.buffering_strategy.processing_flag = True
+        client.buffer += b"\x02" * 100
+        self.assertTrue(limiter.check_session(client))
+        self.assertEqual(len(client.scratch_buffer), 699)
+        self.assertEqual(len(client.buffer), 300)
+
+        client.buffering_strategy.processing_flag = False
+        limiter = MemoryLimiter(session_max_bytes=1000, policy="close")
+        client.buffer += b"\x02" * 100
+        self.assertFalse(limiter.check_session(client))
+
+    def test_largest_sessions_are_closed_beyond_the_global_limit(self):
+        time = [0.0]
+        limiter = MemoryLimiter(
+            global_max_bytes=2500, check_interval=1, clock=lambda: time[0]
+        )
+        clients = [
+            make_client("small", scratch_bytes=500),
+            make_client("large", scratch_bytes=2000),
+            make_client("medium", scratch_bytes=1000),
+        ]
+        self.assertEqual(limiter.select_evictions(clients), [clients[1]])
+        # The limit is only checked every check_interval
+        self.assertEqual(limiter.select_evictions(clients), [])
+        time[0] = 1
+        self.assertEqual(
+            limiter.select_evictions(clients[:1] + clients[2:]), []
+        )
+
+        stats = memory_stats(clients, largest=2)
+        self.assertEqual(stats["total"]["scratch_buffer"], 3500)
+        self.assertEqual(
+            [session["client_id"] for session in stats["largest_sessions"]],
+            ["large", "medium"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import unittest
+
+from src.outbound_queue import OutboundQueue
+
+
+class FakeWebSocket:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.sent = []
+
+    async def send(self, message):
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(message))
+
+
+class TestOutboundQueue(unittest.TestCase):
+    def test_partial_results_are_coalesced(self):
+        async def run():
+            websocket = FakeWebSocket(delay=0.05)
+            outbound = OutboundQueue(websocket)
+            outbound.put({"chunk_id": "c-1", "type": "final", "text": "a"})
+            outbound.put({"chunk_id": "c-2", "type": "draft", "text": "b"})
+            outbound.put({"chunk_id": "c-2", "type": "draft", "text": "bc"})
+            outbound.put({"chunk_id": "c-2", "type": "final", "text": "bcd"})
+            await outbound.flush(timeout=5)
+            outbound.close()
+            return websocket.sent
+
+        sent = asyncio.run(run())
+        self.assertEqual([m["text"] for m in sent], ["a", "bcd"])
+
+    def test_segments_are_superseded_by_their_final_result(self):
+        async def run():
+            websocket = FakeWebSocket(delay=0.05)
+            outbound = OutboundQueue(websocket)
+            outbound.put({"chunk_id": "c-0", "type": "final", "text": "a"})
+            for text in ("b", "c"):
+                outbound.put(
+                    {"chunk_id": "c-1", "type": "segment", "text": text}
+                )
+            for text in ("d", "e"):
+                outbound.put(
+                    {"chunk_id": "c-2", "type": "segment", "text": text}
+                )
+            outbound.put({"chunk_id": "c-1", "type": "final", "text": "bc"})
+            await outbound.flush(timeout=5)
+            outbound.close()
+            return websocket.sent, outbound.queued_bytes
+
+        sent, queued_bytes = asyncio.run(run())
+        # Segments do not replace each other, and the final result takes
+        # the place of the first segment of its chunk
+        self.assertEqual([m["text"] for m in sent], ["a", "bc", "d", "e"])
+        self.assertEqual(queued_bytes, 0)
+
+    def test_stalled_sends_time_out(self):
+        async def run():
+            websocket = FakeWebSocket(delay=10)
+            outbound = OutboundQueue(websocket, send_timeout=0.05)
+            for i in range(3):
+                outbound.put({"chunk_id": f"c-{i}", "text": "a"})
+            await outbound.flush(timeout=5)
+            outbound.close()
+            return websocket.sent
+
+        self.assertEqual(asyncio.run(run()), [])
+
+    def test_oldest_partial_result_is_dropped_when_full(self):
+        async def run():
+            websocket = FakeWebSocket()
+            outbound = OutboundQueue(websocket, max_size=3)
+            outbound.put({"chunk_id": "c-0", "text": "0"})
+            outbound.put({"chunk_id": "c-1", "type": "segment", "text": "1"})
+            outbound.put({"chunk_id": "c-2", "type": "draft", "text": "2"})
+            outbound.put({"chunk_id": "c-3", "text": "3"})
+            outbound.put({"chunk_id": "c-4", "text": "4"})
+            # Final results are kept beyond the maximum size
+            outbound.put({"chunk_id": "c-5", "text": "5"})
+            await outbound.flush(timeout=5)
+            outbound.close()
+            return websocket.sent
+
+        sent = asyncio.run(run())
+        self.assertEqual([m["text"] for m in sent], ["0", "3", "4", "5"])
+
+    def test_unknown_encodings_are_rejected(self):
+        async def run():
+            outbound = OutboundQueue(FakeWebSocket())
+            with self.assertRaises(ValueError):
+                outbound.set_encoding("xml")
+            outbound.close()
+            return outbound.encoding
+
+        self.assertEqual(asyncio.run(run()), "json")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+from test.fakes import FakeASR, FakeVAD, FakeWebSocket
+from unittest import mock
+
+from src.client import Client
+from src.metrics import Metrics
+from src.overload import OverloadController
+
+CHUNK = b"\x01\x00" * 16000
+
+
+class TestOverloadController(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(ewma_alpha=1.0)
+        patcher = mock.patch("src.overload.metrics", self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.time = 0.0
+
+    def clock(self):
+        return self.time
+
+    def load(self, rtf, queue_wait=0.0, in_flight=1):
+        self.metrics.set_gauge("buffering.chunks_in_flight", in_flight)
+        self.metrics.observe("buffering.rtf", rtf)
+        self.metrics.observe("buffering.queue_wait", queue_wait)
+
+    def test_steps_down_and_back_up_with_hysteresis(self):
+        controller = OverloadController(hold_seconds=10, clock=self.clock)
+        self.load(1.5)
+        self.assertEqual(controller.update(), 1)
+        self.assertEqual(controller.overrides(), {"beam_size": 1})
+
+        # The level is held before the next step
+        self.time = 5
+        self.assertEqual(controller.update(), 1)
+        self.time = 10
+        self.load(0.2, queue_wait=3)
+        self.assertEqual(controller.update(), 2)
+        self.time = 20
+        self.assertEqual(controller.update(), 3)
+        self.assertEqual(controller.chunk_length_factor(), 2)
+        self.time = 30
+        self.assertEqual(controller.update(), 3)
+
+        # Between the thresholds the level does not change
+        self.time = 40
+        self.load(0.6)
+        self.assertEqual(controller.update(), 3)
+        self.load(0.2)
+        self.assertEqual(controller.update(), 2)
+        self.assertNotIn("chunk_length_factor", controller.overrides())
+        self.assertEqual(self.metrics.get_gauge("overload.level"), 2)
+        self.assertEqual(self.metrics.get_counter("overload.steps.down"), 3)
+        self.assertEqual(self.metrics.get_counter("overload.steps.up"), 1)
+
+        # Once nothing is processed, the stale averages are ignored
+        self.load(1.5, in_flight=0)
+        self.time = 45
+        self.assertEqual(controller.update(), 2)
+        self.time = 50
+        self.assertEqual(controller.update(), 1)
+        self.time = 60
+        self.assertEqual(controller.update(), 0)
+
+    def test_levels_must_use_served_models(self):
+        with self.assertRaises(ValueError):
+            OverloadController(small_model="small", models=["large-v3"])
+        controller = OverloadController(
+            small_model="small", models=["large-v3", "small"]
+        )
+        self.assertEqual(controller.levels[2]["asr_model"], "small")
+
+    def test_transcriptions_use_the_current_level(self):
+        controller = OverloadController(
+            levels=[{"beam_size": 1, "chunk_length_factor": 3}],
+            clock=self.clock,
+        )
+        self.load(2.0)
+        client = Client("client", 16000, 2)
+        client.update_config(
+            {
+                "processing_args": {
+                    "chunk_length_seconds": 1,
+                    "chunk_offset_seconds": 0.1,
+                }
+            }
+        )
+        client.overload = controller
+        asr, websocket = FakeASR(), FakeWebSocket()
+
+        async def run():
+            # The degraded level waits for chunks three times as long
+            client.append_audio_data(CHUNK + b"\x00\x00")
+            client.process_audio(websocket, FakeVAD(), asr)
+            await asyncio.sleep(0.1)
+            self.assertEqual(websocket.messages, [])
+            client.append_audio_data(CHUNK * 2)
+            client.process_audio(websocket, FakeVAD(), asr)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(asr.configs[0]["beam_size"], 1)
+        self.assertNotIn("beam_size", client.config)
+        self.assertEqual(len(websocket.messages), 1)
+        self.assertEqual(websocket.messages[0]["quality_level"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
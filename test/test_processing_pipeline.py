@@ -0,0 +1,89 @@
+import asyncio
+import time
+import unittest
+from test.fakes import FakeASR, FakeVAD, FakeWebSocket
+
+from src.client import Client
+from src.processing_pipeline import ProcessingPipeline, Stage
+
+CHUNK = b"\x01\x00" * 16000
+
+
+class TestProcessingPipeline(unittest.TestCase):
+    def run_chunks(self, asr, pipeline, chunks=3):
+        client = Client("client", 16000, 2)
+        client.update_config(
+            {
+                "processing_args": {
+                    "chunk_length_seconds": 1,
+                    "chunk_offset_seconds": 0.1,
+                }
+            }
+        )
+        client.pipeline = pipeline
+        vad, websocket = FakeVAD(delay=0.05), FakeWebSocket()
+
+        async def run():
+            for _ in range(chunks):
+                client.append_audio_data(CHUNK + b"\x00\x00")
+                client.process_audio(websocket, vad, asr)
+                # Let the VAD of the chunk complete before the next one
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(1)
+            pipeline.close()
+
+        asyncio.run(run())
+        return vad, websocket
+
+    def test_vad_overlaps_the_asr_of_the_previous_chunk(self):
+        asr = FakeASR([0.3, 0.3, 0.3])
+        pipeline = ProcessingPipeline(asr_workers=1)
+        vad, _ = self.run_chunks(asr, pipeline)
+        # The second chunk went through the VAD while the first one was
+        # being transcribed
+        self.assertLess(vad.calls[1][1], asr.calls[0][1])
+        self.assertEqual(pipeline.chunks_in_flight, 0)
+
+    def test_results_are_delivered_in_chunk_order(self):
+        asr = FakeASR([0.4, 0.05, 0.05])
+        _, websocket = self.run_chunks(asr, ProcessingPipeline(asr_workers=3))
+        # The first chunk, the first to start, finished its transcription
+        # last
+        self.assertEqual(
+            asr.calls[-1][0], min(start for start, _ in asr.calls)
+        )
+        self.assertEqual(
+            [message["text"] for message in websocket.messages],
+            ["client-1", "client-2", "client-3"],
+        )
+        self.assertIn("asr_queue_wait", websocket.messages[0]["latency"])
+
+    def test_full_stage_holds_back_the_producers(self):
+        stage = Stage("test", workers=1, max_size=1)
+        done = []
+
+        async def job():
+            await asyncio.sleep(0.05)
+            done.append(time.monotonic())
+
+        async def run():
+            stage.put_nowait(job)
+            await asyncio.sleep(0)
+            stage.put_nowait(job)
+            self.assertTrue(stage.full())
+            with self.assertRaises(asyncio.QueueFull):
+                stage.put_nowait(job)
+            await stage.put(job)
+            await asyncio.sleep(0.2)
+            stats = stage.stats()
+            stage.close()
+            return stats
+
+        stats = asyncio.run(run())
+        self.assertEqual(len(done), 3)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertGreater(stats["utilization"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
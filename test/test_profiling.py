@@ -0,0 +1,58 @@
+import os
+import pstats
+import tempfile
+import tracemalloc
+import unittest
+
+from src.profiling import ChunkProfiler
+
+
+class TestChunkProfiler(unittest.TestCase):
+    def test_one_chunk_out_of_n_is_profiled(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            profiler = ChunkProfiler(2, output_dir=output_dir)
+            for i in range(1, 5):
+                with profiler.profile(f"chunk-{i}"):
+                    sum(range(1000))
+            self.assertEqual(
+                sorted(os.listdir(output_dir)),
+                ["chunk-2.prof", "chunk-4.prof"],
+            )
+
+    def test_later_stages_add_to_the_profile_of_a_sampled_chunk(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            profiler = ChunkProfiler(2, output_dir=output_dir)
+            for i in range(1, 4):
+                with profiler.profile(f"chunk-{i}"):
+                    sum(range(10))
+                # The later stages do not count as chunks
+                with profiler.profile(f"chunk-{i}", continued=True):
+                    sorted(range(10))
+            self.assertEqual(os.listdir(output_dir), ["chunk-2.prof"])
+            functions = pstats.Stats(
+                os.path.join(output_dir, "chunk-2.prof")
+            ).stats
+            names = {name for _, _, name in functions}
+            self.assertIn("<built-in method builtins.sum>", names)
+            self.assertIn("<built-in method builtins.sorted>", names)
+
+    def test_only_one_chunk_is_profiled_at_a_time(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            profiler = ChunkProfiler(
+                1, output_dir=output_dir, trace_memory=True
+            )
+            with profiler.profile("outer"):
+                with profiler.profile("inner"):
+                    pass
+            self.assertEqual(
+                sorted(os.listdir(output_dir)),
+                ["outer.prof", "outer.tracemalloc"],
+            )
+            self.assertFalse(tracemalloc.is_tracing())
+
+        with self.assertRaises(ValueError):
+            ChunkProfiler(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+import wave
+
+from src.session_recorder import SessionRecorder
+
+
+class TestSessionRecorder(unittest.TestCase):
+    def test_audio_is_rotated_and_transcriptions_appended(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            recorder = SessionRecorder(
+                output_dir, audio_format="wav", rotate_seconds=1
+            )
+
+            async def run():
+                await recorder.record_audio("client", bytes(40000))
+                await recorder.record_transcription("client", {"text": "hi"})
+                await recorder.close_session("client")
+
+            asyncio.run(run())
+            recorder.stop()
+
+            directory = os.path.join(output_dir, "client")
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ["00000.wav", "00001.wav", "transcripts.jsonl"],
+            )
+            lengths = []
+            for name in ("00000.wav", "00001.wav"):
+                with wave.open(os.path.join(directory, name)) as wav_file:
+                    lengths.append(wav_file.getnframes())
+            self.assertEqual(lengths, [16000, 4000])
+            with open(os.path.join(directory, "transcripts.jsonl")) as file:
+                record = json.loads(file.readline())
+            self.assertEqual(record["transcription"], {"text": "hi"})
+
+        with self.assertRaises(ValueError):
+            SessionRecorder(output_dir, audio_format="wav", rotate_seconds=0)
+
+    def test_block_policy_holds_back_the_session_only(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            recorder = SessionRecorder(
+                output_dir,
+                audio_format="wav",
+                max_queue_size=1,
+                overflow_policy="block",
+            )
+            # Hold the writer thread so that the queue stays full
+            write_audio = recorder._write_audio
+
+            def slow_write_audio(client_id, audio_data):
+                time.sleep(0.2)
+                write_audio(client_id, audio_data)
+
+            recorder._write_audio = slow_write_audio
+
+            async def run():
+                ticks = 0
+
+                async def tick():
+                    nonlocal ticks
+                    while True:
+                        await asyncio.sleep(0.01)
+                        ticks += 1
+
+                ticker = asyncio.create_task(tick())
+                for _ in range(3):
+                    await recorder.record_audio("client", bytes(3200))
+                ticker.cancel()
+                return ticks
+
+            ticks = asyncio.run(run())
+            recorder.stop()
+            # The event loop kept running while the session waited
+            self.assertGreater(ticks, 5)
+            self.assertEqual(recorder.dropped, 0)
+            with wave.open(
+                os.path.join(output_dir, "client", "00000.wav")
+            ) as wav_file:
+                self.assertEqual(wav_file.getnframes(), 4800)
+
+
+if __name__ == "__main__":
+    unittest.main()
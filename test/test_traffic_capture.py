@@ -0,0 +1,67 @@
+# isort: skip_file
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from src.traffic_capture import (
+    AUDIO,
+    RESULT,
+    TEXT,
+    TrafficCapture,
+    read_trace,
+)
+
+
+class FakeWebSocket:
+    path = "/multiplex"
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def recv(self):
+        return self.messages.pop(0)
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class TestTrafficCapture(unittest.TestCase):
+    def test_traffic_is_captured_and_read_back(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            capture = TrafficCapture(output_dir)
+            websocket = capture.wrap(
+                FakeWebSocket(['{"type": "config"}', b"\x00\x01" * 100]),
+                "session",
+            )
+
+            async def run():
+                await websocket.recv()
+                await websocket.recv()
+                await websocket.send('{"text": "hello"}')
+
+            asyncio.run(run())
+            websocket.close_trace()
+            capture.stop()
+
+            header, records = read_trace(
+                os.path.join(output_dir, "session.trace")
+            )
+
+        self.assertEqual(header["path"], "/multiplex")
+        self.assertEqual(
+            [(kind, payload) for _, kind, payload in records],
+            [
+                (TEXT, b'{"type": "config"}'),
+                (AUDIO, b"\x00\x01" * 100),
+                (RESULT, b'{"text": "hello"}'),
+            ],
+        )
+        timestamps = [timestamp for timestamp, _, _ in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+import numpy as np
+
+from src.vad.energy_vad import EnergyFrameVAD
+
+
+class TestEnergyFrameVAD(unittest.TestCase):
+    def setUp(self):
+        self.vad = EnergyFrameVAD(sampling_rate=16000, frame_ms=30)
+        samples = self.vad.frame_bytes // 2
+        t = np.arange(samples) / 16000
+        self.tone = (8000 * np.sin(2 * np.pi * 300 * t)).astype("<i2")
+        rng = np.random.default_rng(0)
+        self.noise = rng.normal(0, 30, samples).astype("<i2")
+
+    def test_speech_is_detected_over_noise(self):
+        self.assertFalse(self.vad.is_speech(self.noise.tobytes()))
+        self.assertTrue(self.vad.is_speech(self.tone.tobytes()))
+        self.assertFalse(self.vad.is_speech(np.zeros_like(self.tone)))
+
+    def test_noise_floor_adapts_to_loud_backgrounds(self):
+        loud_noise = (self.noise * 100).tobytes()
+        results = [self.vad.is_speech(loud_noise) for _ in range(400)]
+        self.assertFalse(results[-1])
+        self.assertTrue(self.vad.is_speech((self.tone * 4).tobytes()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.client import Client
+from src.vad.pyannote_onnx_vad import PyannoteOnnxVAD, binarize
+
+try:
+    import onnx
+    import onnxruntime  # noqa: F401
+    from onnx import TensorProto, helper
+except ImportError:
+    onnx = None
+
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 5
+NUM_FRAMES = 100
+
+
+def save_energy_model(onnx_path):
+    """
+    Save a stand-in for the segmentation model whose score is a sigmoid of
+    the energy of each frame, with the metadata of an export.
+    """
+    window = WINDOW_SECONDS * SAMPLE_RATE
+
+    def constant(name, values, dtype=TensorProto.FLOAT):
+        return helper.make_tensor(name, dtype, [len(values)], values)
+
+    graph = helper.make_graph(
+        [
+            helper.make_node("Abs", ["waveform"], ["magnitude"]),
+            helper.make_node("Reshape", ["magnitude", "shape"], ["frames"]),
+            helper.make_node(
+                "ReduceMean", ["frames"], ["energy"], axes=[2], keepdims=1
+            ),
+            helper.make_node("Mul", ["energy", "gain"], ["scaled"]),
+            helper.make_node("Sub", ["scaled", "bias"], ["logits"]),
+            helper.make_node("Sigmoid", ["logits"], ["scores"]),
+        ],
+        "energy",
+        [
+            helper.make_tensor_value_info(
+                "waveform", TensorProto.FLOAT, ["batch", 1, window]
+            )
+        ],
+        [
+            helper.make_tensor_value_info(
+                "scores", TensorProto.FLOAT, ["batch", NUM_FRAMES, 1]
+            )
+        ],
+        [
+            constant(
+                "shape",
+                [0, NUM_FRAMES, window // NUM_FRAMES],
+                TensorProto.INT64,
+            ),
+            constant("gain", [200.0]),
+            constant("bias", [5.0]),
+        ],
+    )
+    model = helper.make_model(
+        graph, opset_imports=[helper.make_opsetid("", 13)]
+    )
+    model.ir_version = 8
+    onnx.save(model, onnx_path)
+    frame_step = WINDOW_SECONDS / NUM_FRAMES
+    with open(onnx_path + ".json", "w") as file:
+        json.dump(
+            {
+                "sample_rate": SAMPLE_RATE,
+                "window_seconds": WINDOW_SECONDS,
+                "num_frames": NUM_FRAMES,
+                "frame_start": 0.0,
+                "frame_duration": frame_step,
+                "frame_step": frame_step,
+                "powerset": False,
+            },
+            file,
+        )
+
+
+class TestBinarize(unittest.TestCase):
+    def test_hysteresis_and_durations(self):
+        timestamps = np.arange(20) * 0.1
+        scores = np.array(
+            [0.1, 0.9, 0.9, 0.6, 0.9, 0.2, 0.9, 0.9, 0.9, 0.1]
+            + [0.1] * 5
+            + [0.9, 0.1, 0.1, 0.1, 0.1]
+        )
+        regions = binarize(
+            timestamps,
+            scores,
+            onset=0.7,
+            offset=0.5,
+            min_duration_on=0.2,
+            min_duration_off=0.15,
+        )
+        # 0.6 stays above the offset, the 0.1s gap at 0.5 is filled, and
+        # the 0.1s blip at 1.5 is too short
+        self.assertEqual(len(regions), 1)
+        start, end, _ = regions[0]
+        self.assertAlmostEqual(start, 0.1)
+        self.assertAlmostEqual(end, 0.9)
+
+
+@unittest.skipIf(onnx is None, "requires onnx and onnxruntime")
+class TestPyannoteOnnxVAD(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.onnx_path = os.path.join(directory.name, "energy.onnx")
+        save_energy_model(self.onnx_path)
+
+    def detect(self, audio, **kwargs):
+        vad = PyannoteOnnxVAD(onnx_path=self.onnx_path, **kwargs)
+        client = Client("test_client", SAMPLE_RATE, 2)
+        client.scratch_buffer = bytearray(audio.astype("<i2").tobytes())
+        return asyncio.run(vad.detect_activity(client))
+
+    def test_detects_speech_in_short_and_long_audio(self):
+        t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+        tone = 8000 * np.sin(2 * np.pi * 300 * t)
+        silence = np.zeros(SAMPLE_RATE)
+
+        # Shorter than a window
+        segments = self.detect(np.concatenate([silence, tone, silence]))
+        self.assertEqual(len(segments), 1)
+        self.assertAlmostEqual(segments[0]["start"], 1.0, delta=0.1)
+        self.assertAlmostEqual(segments[0]["end"], 2.0, delta=0.1)
+
+        # Several windows, scored in several batches
+        audio = np.concatenate([silence, tone] * 4 + [silence] * 4)
+        segments = self.detect(audio, batch_size=4, batch_wait_ms=5)
+        self.assertEqual(len(segments), 4)
+        for i, segment in enumerate(segments):
+            self.assertAlmostEqual(segment["start"], 2 * i + 1, delta=0.1)
+            self.assertAlmostEqual(segment["end"], 2 * i + 2, delta=0.1)
+
+    def test_silence_has_no_speech(self):
+        self.assertEqual(self.detect(np.zeros(3 * SAMPLE_RATE)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
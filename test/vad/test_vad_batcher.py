@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from src.vad.vad_batcher import VADBatcher
+
+
+class TestVADBatcher(unittest.TestCase):
+    def setUp(self):
+        self.batch_sizes = []
+
+    def run_batch(self, windows):
+        self.batch_sizes.append(len(windows))
+        return windows * 2
+
+    def test_concurrent_requests_share_a_batch(self):
+        batcher = VADBatcher(self.run_batch, max_batch_size=8, max_wait=0.05)
+
+        async def run():
+            requests = [np.full(3, i) for i in range(2)] + [np.arange(10)]
+            results = await asyncio.gather(
+                *(batcher.submit(request) for request in requests)
+            )
+            batcher.close()
+            return requests, results
+
+        requests, results = asyncio.run(run())
+        for request, result in zip(requests, results):
+            np.testing.assert_array_equal(result, request * 2)
+        # The two small requests in one batch, the large one in two passes
+        self.assertEqual(self.batch_sizes, [6, 8, 2])
+
+    def test_a_full_batch_does_not_wait(self):
+        batcher = VADBatcher(self.run_batch, max_batch_size=4, max_wait=10)
+
+        async def run():
+            result = await asyncio.wait_for(
+                asyncio.gather(
+                    batcher.submit(np.ones(2)), batcher.submit(np.ones(2))
+                ),
+                timeout=1,
+            )
+            batcher.close()
+            return result
+
+        asyncio.run(run())
+        self.assertEqual(self.batch_sizes, [4])
+
+    def test_errors_reach_every_request_of_the_batch(self):
+        def fail(windows):
+            raise RuntimeError("inference failed")
+
+        batcher = VADBatcher(fail, max_batch_size=8, max_wait=0.01)
+
+        async def run():
+            results = await asyncio.gather(
+                batcher.submit(np.ones(1)),
+                batcher.submit(np.ones(1)),
+                return_exceptions=True,
+            )
+            batcher.close()
+            return results
+
+        for result in asyncio.run(run()):
+            self.assertIsInstance(result, RuntimeError)
+
+
+if __name__ == "__main__":
+    unittest.main()